@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Check that a serial capture holds whole frames when the port takes only
+part of a report.
+
+A port that takes at most a few bytes per write stands in for a backed up
+gadget UART. SerialConnection writes the rest of a cut short report ahead
+of the next one, the capture must record those bytes too, so the analyzer
+finds no malformed frames and the capture matches what the port got.
+Runs both consoles. Exits with status 1 if a check fails.
+
+python3 bench/capture.py
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nsgpadserial import NSGamepadSerial, NSButton
+from ds4gpadserial import DS4GamepadSerial, DS4Button
+from gadgetemu import FrameParser
+from serialcapture import SerialCapture, Capture
+from serialconnection import SerialConnection
+
+class ShortPort:
+    """Take at most limit bytes per write, keep them"""
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+
+    def write(self, data):
+        """Keep the first limit bytes"""
+        taken = bytes(data[:self.limit])
+        self.data += taken
+        return len(taken)
+
+    def close(self):
+        """Nothing to close"""
+        return
+
+class ShortConnection(SerialConnection):
+    """SerialConnection opening a ShortPort"""
+    def __init__(self, limit):
+        super().__init__(['short://'], write_timeout=0)
+        self.limit = limit
+
+    def open(self, candidate):
+        return ShortPort(self.limit)
+
+def check(gamepad_class, button, limit, path):
+    """Press and release through a short port, return the failures as text"""
+    connection = ShortConnection(limit)
+    connection.connect()
+    capture = SerialCapture(path, connection.baudrate)
+    connection.capture = capture
+    port = connection.port
+    gamepad = gamepad_class()
+    gamepad.begin(connection)
+    for _ in range(20):
+        gamepad.press(button)
+        gamepad.release(button)
+    # Leaves the tail of a report cut short by the last write
+    tail = len(connection.tail)
+    gamepad.end()
+    capture.close()
+    sent = bytes(port.data)
+    recorded = b''.join(data for _, data in Capture(path).records())
+    parser = FrameParser()
+    parser.feed(recorded, 0)
+    failures = []
+    if connection.partial_writes == 0:
+        failures.append('no partial writes')
+    if recorded != sent:
+        failures.append('capture has %d bytes, the port took %d' % (len(recorded), len(sent)))
+    # Only the start of the report cut short by the last write is left
+    left = len(parser.buffer)
+    if parser.bad_frames or parser.skipped_bytes or \
+            (left + tail != parser.buffer[1] + 3 if left else tail):
+        failures.append('%d bad frames, %d bytes skipped, %d left over' %
+                        (parser.bad_frames, parser.skipped_bytes, len(parser.buffer)))
+    return failures
+
+def main():
+    """ Run the checks, print the failures """
+    failed = 0
+    path = os.path.join(tempfile.mkdtemp(), 'short.cap')
+    for gamepad_class, button in ((NSGamepadSerial, NSButton.A),
+                                  (DS4GamepadSerial, DS4Button.CROSS)):
+        for limit in (1, 5, 9):
+            failures = check(gamepad_class, button, limit, path)
+            if failures:
+                failed += 1
+                print('FAIL %s %d bytes per write: %s' %
+                      (gamepad_class.__name__, limit, ', '.join(failures)))
+    os.unlink(path)
+    os.rmdir(os.path.dirname(path))
+    print('%d failed' % failed)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Per touch cost and memory of the pdtouch.py cell state.
+
+Sets up pdtouch.py headless (SDL_VIDEODRIVER=dummy, loop:// port with writes
+dropped) and times handle_touch for taps on every button cell, ten finger
+chords and slider sweeps, each inside one gamepad batch so serial writes
+are left out. The best of REPEATS runs is printed. Memory is sys.getsizeof
+over the cells, the objects they hold and the per cell state arrays.
+Surfaces, fonts and the touch areas themselves are not counted.
+
+python3 bench/cells.py
+python3 bench/cells.py --console=ps4 --slider=normal
+"""
+
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.join(BENCH_DIR, '..')
+ROUNDS = 200
+REPEATS = 7
+
+def cell_bytes(pdtouch):
+    """ Bytes held by the cells of all touch areas """
+    seen = set()
+    def size(obj):
+        """ Size of obj and what it holds, each object counted once """
+        if id(obj) in seen or isinstance(obj, (pdtouch.pygame.Surface, pdtouch.TouchAreas)):
+            return 0
+        seen.add(id(obj))
+        total = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            total += sum(size(key) + size(value) for key, value in obj.items())
+        elif isinstance(obj, (list, tuple)):
+            total += sum(size(value) for value in obj)
+        elif hasattr(obj, '__slots__'):
+            total += sum(size(getattr(obj, name, None)) for name in obj.__slots__)
+        return total
+    total = 0
+    for touch_area in pdtouch.touch_areas:
+        total += size(touch_area.cells)
+    for name in ('press_counts', 'buttons', 'owners'):
+        column = getattr(pdtouch.TouchAreas, name, None)
+        if column is not None:
+            total += size(column)
+    return total
+
+def main():
+    """ Set up pdtouch, print heap size and us per touch for each pattern """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    os.chdir(TOP_DIR)
+    sys.path.insert(0, TOP_DIR)
+    import pdtouch
+    pygame = pdtouch.pygame
+    pdtouch.setup(['--port=loop://', '--log-level=off', '--no-layout-cache',
+                   '--no-feedback'] + sys.argv[1:])
+
+    class NullPort:
+        """ Drop writes """
+        def write(self, data):
+            """ Discard """
+            return len(data)
+        def close(self):
+            """ Nothing to close """
+            return
+    pdtouch.Gamepad.ser_port = NullPort()
+
+    width = pdtouch.screen_width_max
+    height = pdtouch.screen_height_max
+    def centers(touch_area):
+        """ Normalized centers of all cells of an area """
+        return [(x / width, y / height) for x, y in
+                (cell.button_center for cell in touch_area.cells)]
+    buttons = centers(pdtouch.gamepad_buttons) + centers(pdtouch.Buttons)
+    slider = centers(pdtouch.Slider)
+    taps = []
+    for x, y in buttons:
+        taps.append((pygame.FINGERDOWN, 1, x, y))
+        taps.append((pygame.FINGERUP, 1, x, y))
+    chord = [(pygame.FINGERDOWN, finger, x, y) for finger, (x, y) in enumerate(buttons[:10])]
+    chord += [(pygame.FINGERUP, finger, x, y) for finger, (x, y) in enumerate(buttons[:10])]
+    sweep = [(pygame.FINGERDOWN, 1) + slider[0]]
+    sweep += [(pygame.FINGERMOTION, 1) + xy for xy in slider[1:]]
+    sweep += [(pygame.FINGERUP, 1) + slider[-1]]
+
+    num_cells = len(buttons) + len(slider)
+    state_bytes = cell_bytes(pdtouch)
+    print('cell state %8d bytes  %6.0f bytes/cell' % (state_bytes, state_bytes / num_cells))
+    handle_touch = pdtouch.handle_touch
+    for name, touches in (('taps', taps), ('chord10', chord), ('sweep', sweep)):
+        best = None
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                with pdtouch.Gamepad.batch():
+                    for touch_type, finger_id, x, y in touches:
+                        handle_touch(touch_type, finger_id, x, y, 0)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        seconds = best
+        print('%-8s %6d touches  %6.2f us/touch' %
+              (name, len(touches) * ROUNDS, seconds * 1e6 / (len(touches) * ROUNDS)))
+    pdtouch.Gamepad.end()
+    pdtouch.LOG.stop()
+
+if __name__ == "__main__":
+    main()
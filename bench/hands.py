@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Check slidehands.find_hands against the bit by bit state machine formerly in
+SlideBar.find_hands, then compare their speed.
+
+python3 bench/hands.py
+"""
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from slidehands import find_hands
+
+def find_hands_bitwise(slider_bits):
+    """ The original SlideBar.find_hands, returning tuples """
+    mask = 1 << 31
+    hand = {}
+    hand_state = 0
+    hands = []
+    for b in range(31, -1, -1):
+        if hand_state == 0:
+            if slider_bits & mask:
+                hand['start'] = b
+                hand_state = 1
+        elif hand_state == 1:
+            if (slider_bits & mask) == 0:
+                hand_state = 2
+        elif hand_state == 2:
+            if (slider_bits & mask) == 0:
+                hand_state = 3
+        elif hand_state == 3:
+            if (slider_bits & mask) == 0:
+                hand_state = 4
+        elif hand_state == 4:
+            if (slider_bits & mask) == 0:
+                hand['end'] = b+4
+                hand_state = 0
+                hands.append(hand)
+                hand = {}
+        mask = mask >> 1
+    if hand_state == 1:
+        hand['end'] = 0
+        hands.append(hand)
+    elif hand_state == 2:
+        hand['end'] = 1
+        hands.append(hand)
+    elif hand_state == 3:
+        hand['end'] = 2
+        hands.append(hand)
+    elif hand_state == 4:
+        hand['end'] = 3
+        hands.append(hand)
+    return [(hand['start'], hand['end']) for hand in hands]
+
+def masks():
+    """ Every single run and every pair of runs, plus random masks """
+    runs = [((1 << length) - 1) << shift
+            for length in range(1, 33) for shift in range(0, 33 - length)]
+    yield 0
+    yield from runs
+    for first in runs:
+        for second in runs:
+            yield first | second
+    random.seed(1)
+    for _ in range(200000):
+        yield random.getrandbits(32)
+
+def check():
+    """ Exit with an error if the two implementations ever differ """
+    count = 0
+    for slider_bits in masks():
+        if find_hands(slider_bits) != find_hands_bitwise(slider_bits):
+            print('MISMATCH %08x' % slider_bits, find_hands(slider_bits),
+                  find_hands_bitwise(slider_bits))
+            sys.exit(1)
+        count += 1
+    print('find_hands matches the state machine on %d masks' % count)
+
+def bench():
+    """ Time both implementations on typical slider masks """
+    random.seed(2)
+    samples = []
+    for _ in range(10000):
+        # One or two hands of 1..6 cells
+        slider_bits = 0
+        for _ in range(random.randint(1, 2)):
+            length = random.randint(1, 6)
+            slider_bits |= ((1 << length) - 1) << random.randint(0, 32 - length)
+        samples.append(slider_bits)
+    for name, function in (('state machine', find_hands_bitwise),
+                           ('table driven', find_hands)):
+        seconds = timeit.timeit(lambda: [function(m) for m in samples], number=10)
+        print('  %-14s %6.2f us/mask' % (name, seconds * 1e6 / (10 * len(samples))))
+
+if __name__ == "__main__":
+    check()
+    bench()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: HitMap.lookup versus calling touchToCell on every touch area
+as pdtouch.py used to do. Uses the pdtouch.py layout geometry.
+
+python3 bench/hittest.py
+"""
+
+import os
+import sys
+import random
+import timeit
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pygame
+from touchareas import TouchAreas, HitMap
+
+TOUCHES = 100000
+
+def make_areas(displaysurf):
+    """ Same geometry as pdtouch.py, no properties so nothing is rendered """
+    (screen_width, screen_height) = displaysurf.get_size()
+    screen_width_max = screen_width - 1
+    screen_height_max = screen_height - 1
+    TouchAreas.clearCells()
+    gamepad_buttons = TouchAreas([0, 0], [screen_width_max, (screen_height / 16) - 1],
+            1, 14, False, (128, 128, 128), None, None, displaysurf)
+    slider = TouchAreas([0, (screen_height / 16)], [screen_width_max, (screen_height - screen_width / 4) - 1],
+            1, 32, False, (192, 192, 192), None, None, displaysurf)
+    buttons = TouchAreas([0, screen_height - screen_width / 4], [screen_width_max, screen_height_max],
+            1, 4, False, (128, 128, 128), None, None, displaysurf)
+    areas = (slider, buttons, gamepad_buttons)
+    for touch_area in areas:
+        touch_area.draw()
+    return areas
+
+def loop_lookup(areas, x, y):
+    """ The per area scan formerly in pdtouch.py main() """
+    for touch_area in areas:
+        cell_id = touch_area.touchToCell(x, y)
+        if cell_id:
+            return cell_id
+    return 0
+
+def run(width, height):
+    """ Benchmark one screen size """
+    displaysurf = pygame.Surface((width, height))
+    areas = make_areas(displaysurf)
+    random.seed(1)
+    touches = [(random.randint(0, width - 1), random.randint(0, height - 1))
+               for _ in range(TOUCHES)]
+    print('%dx%d, %d touches' % (width, height, TOUCHES))
+
+    seconds = timeit.timeit(lambda: [loop_lookup(areas, x, y) for x, y in touches], number=1)
+    print('  touchToCell loop   %7.3f us/touch' % (seconds * 1e6 / TOUCHES))
+    for shift in (0, 1, 2, 3):
+        hitmap = HitMap(width, height, shift)
+        for touch_area in areas:
+            hitmap.add(touch_area)
+        build = timeit.timeit(hitmap.build, number=1)
+        lookup = hitmap.lookup
+        seconds = timeit.timeit(lambda: [lookup(x, y) for x, y in touches], number=1)
+        if shift == 0:
+            mismatch = sum(1 for x, y in touches if lookup(x, y) != loop_lookup(areas, x, y))
+        else:
+            mismatch = '-'
+        print('  HitMap shift=%d     %7.3f us/touch  build %6.1f ms  table %5d KB  mismatches %s' %
+              (shift, seconds * 1e6 / TOUCHES, build * 1000,
+               hitmap.table.itemsize * len(hitmap.table) // 1024, mismatch))
+
+def main():
+    """ 1080p and 4K """
+    pygame.display.init()
+    run(1920, 1080)
+    run(3840, 2160)
+
+if __name__ == "__main__":
+    main()
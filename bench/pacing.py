@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Reports sent, tick error and touch to write latency with and without
+ReportPacer, for the same stream of gamepad state changes.
+
+The stream is bursts of button and slider changes like a dense Project
+Diva chart: a burst every 20 ms on average with 1 to 6 changes 0.1 to
+2 ms apart. Writes go to a port that only counts bytes.
+
+python3 bench/pacing.py
+python3 bench/pacing.py --seconds=5 --spin-us=100
+"""
+
+import os
+import sys
+import getopt
+import random
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nsgpadserial import NSGamepadSerial
+from latency import LatencyRecorder
+
+class CountingPort:
+    """Count the bytes written"""
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        """Count"""
+        self.bytes_written += len(data)
+        return len(data)
+
+    def close(self):
+        """Nothing to close"""
+        return
+
+def make_stream(seconds):
+    """ Return (time s, buttons) changes """
+    random.seed(21)
+    stream = []
+    when = 0.0
+    buttons = 0
+    while when < seconds:
+        when += random.expovariate(1 / 0.020)
+        at = when
+        for _ in range(random.randint(1, 6)):
+            at += random.uniform(0.0001, 0.002)
+            buttons ^= 1 << random.randrange(14)
+            stream.append((at, buttons))
+    return stream
+
+def run(stream, seconds, pace, immediate, spin):
+    """ Play the stream into one gamepad, return its result line """
+    port = CountingPort()
+    gamepad = NSGamepadSerial()
+    latency = LatencyRecorder(('touch',))
+    gamepad.latency = latency
+    gamepad.begin(port, threaded=not pace, pace=pace, pace_immediate=immediate,
+                  pace_spin=spin)
+    pacer = gamepad.writer
+    start = time.monotonic()
+    for at, buttons in stream:
+        delay = start + at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        with gamepad.thread_lock:
+            latency.mark('touch', time.monotonic_ns())
+            gamepad.buttons(buttons)
+    gamepad.end()
+    histogram = latency.histograms['touch']
+    if pace:
+        name = 'pace %g ms%s' % (pace * 1000, '' if immediate else ' on tick')
+        tick_error = '%8d %8d %8d' % (pacer.jitter.percentile(50) // 1000,
+                                      pacer.jitter.percentile(99) // 1000,
+                                      pacer.jitter.max_ns // 1000)
+    else:
+        name = 'unpaced writer'
+        tick_error = '%8s %8s %8s' % ('-', '-', '-')
+    return '%-20s %8.0f %8.0f %s %8.3f %8.3f' % (
+        name, pacer.reports_written / seconds, port.bytes_written / seconds, tick_error,
+        histogram.percentile(50) / 1e6, histogram.percentile(99) / 1e6)
+
+def main():
+    """ Parse options, run every mode """
+    seconds = 3.0
+    spin_us = 0
+    opts, _ = getopt.getopt(sys.argv[1:], '', ['seconds=', 'spin-us='])
+    for o, a in opts:
+        if o == '--seconds':
+            seconds = float(a)
+        elif o == '--spin-us':
+            spin_us = int(a)
+    stream = make_stream(seconds)
+    print('%d state changes in %g s, spin %d us' % (len(stream), seconds, spin_us))
+    # err: write time minus tick time, lat: state change to write
+    print('%-20s %8s %8s %8s %8s %8s %8s %8s' % ('mode', 'rep/s', 'bytes/s', 'err50us',
+                                                 'err99us', 'errmaxus', 'lat50ms', 'lat99ms'))
+    for pace, immediate in ((0, True), (0.001, True), (0.001, False),
+                            (0.008, True), (0.008, False)):
+        print(run(stream, seconds, pace, immediate, spin_us / 1e6), flush=True)
+
+if __name__ == "__main__":
+    main()
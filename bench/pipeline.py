@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Headless benchmark of the whole pdtouch.py touch -> serial report pipeline.
+
+Runs the real pdtouch.py with SDL_VIDEODRIVER=dummy and a pyserial loop://
+port whose writes are counted and dropped. A feeder thread posts synthetic FINGER events with pygame.event.post
+and the normal pdtouch.run() loop handles them. Every scenario runs in its
+own process for each console and slider mode.
+
+Columns: events posted, events handled per second, serial reports written
+per event, bytes written, process CPU time per event, CPU use as a percent
+of one core and touch to report latency percentiles over all touch areas.
+Latency is timed from when the feeder posts the event so it includes the
+event loop wake up time.
+
+python3 bench/pipeline.py
+python3 bench/pipeline.py --scenario=sweep --console=ps4 --extra=--serial-thread
+"""
+
+import os
+import sys
+import getopt
+import json
+import random
+import subprocess
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.join(BENCH_DIR, '..')
+
+SCENARIOS = ('taps', 'chord10', 'sweep', 'diva')
+CONSOLES = ('switch', 'ps4')
+SLIDERS = ('normal', 'dedicated')
+
+class NullPort:
+    """
+    Serial port wrapper counting writes and bytes then dropping them.
+    Nothing reads the loop:// port and it blocks once its queue is full.
+    """
+    def __init__(self, port):
+        self.port = port
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, data):
+        """ Count and discard """
+        self.writes += 1
+        self.bytes += len(data)
+        return len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+class Touches:
+    """ Builds a list of (time, [event, ...]) groups in screen co-ordinates """
+    def __init__(self, pdtouch):
+        self.pygame = pdtouch.pygame
+        self.pdtouch = pdtouch
+        self.groups = []
+
+    def event(self, event_type, finger_id, x, y):
+        """ One FINGER event at pixel x, y """
+        return self.pygame.event.Event(event_type, touch_id=0, finger_id=finger_id,
+                x=x / self.pdtouch.screen_width_max, y=y / self.pdtouch.screen_height_max,
+                dx=0.0, dy=0.0, pressure=1.0)
+
+    def add(self, when, events):
+        """ Events posted together at time when (seconds) """
+        self.groups.append((when, events))
+
+    def center(self, touch_area, index):
+        """ Pixel center of a cell """
+        return touch_area.cells[index].button_center
+
+    def tap(self, when, finger_id, touch_area, index, hold=0.03):
+        """ Finger down then up on one cell """
+        x, y = self.center(touch_area, index)
+        self.add(when, [self.event(self.pygame.FINGERDOWN, finger_id, x, y)])
+        self.add(when + hold, [self.event(self.pygame.FINGERUP, finger_id, x, y)])
+
+    def slide(self, when, finger_id, y, x_from, x_to, duration, steps):
+        """ Finger down, motion across the slider, up """
+        pygame = self.pygame
+        self.add(when, [self.event(pygame.FINGERDOWN, finger_id, x_from, y)])
+        for step in range(1, steps + 1):
+            x = x_from + (x_to - x_from) * step / steps
+            self.add(when + duration * step / steps,
+                     [self.event(pygame.FINGERMOTION, finger_id, x, y)])
+        self.add(when + duration + 0.001, [self.event(pygame.FINGERUP, finger_id, x_to, y)])
+
+def scenario_taps(touches, pdtouch):
+    """ Single taps alternating big buttons and top row gamepad buttons """
+    for i in range(400):
+        if i % 2:
+            touch_area, index = pdtouch.Buttons, i % 4
+        else:
+            touch_area, index = pdtouch.gamepad_buttons, i % 14
+        touches.tap(i * 0.05, 1, touch_area, index)
+
+def scenario_chord10(touches, pdtouch):
+    """ Ten fingers down together, held, then up together """
+    pygame = pdtouch.pygame
+    cells = [(pdtouch.Buttons, i) for i in range(4)] + \
+            [(pdtouch.Slider, i * 5 + 2) for i in range(6)]
+    for i in range(100):
+        when = i * 0.1
+        down = []
+        up = []
+        for finger_id, (touch_area, index) in enumerate(cells):
+            x, y = touches.center(touch_area, index)
+            down.append(touches.event(pygame.FINGERDOWN, finger_id, x, y))
+            up.append(touches.event(pygame.FINGERUP, finger_id, x, y))
+        touches.add(when, down)
+        touches.add(when + 0.05, up)
+
+def scenario_sweep(touches, pdtouch):
+    """ Fast full width slider sweeps, alternating direction """
+    slider = pdtouch.Slider
+    y = slider.cells[0].button_center[1]
+    right = pdtouch.screen_width_max - 1
+    for i in range(100):
+        if i % 2:
+            touches.slide(i * 0.1, 1, y, right, 1, 0.08, 64)
+        else:
+            touches.slide(i * 0.1, 1, y, 1, right, 0.08, 64)
+
+def scenario_diva(touches, pdtouch):
+    """ Dense Project Diva chart: double notes, holds and slider flicks """
+    random.seed(39)
+    slider = pdtouch.Slider
+    y = slider.cells[0].button_center[1]
+    width = pdtouch.screen_width_max
+    when = 0.0
+    for _ in range(400):
+        note = random.random()
+        if note < 0.6:
+            touches.tap(when, 1, pdtouch.Buttons, random.randrange(4), hold=0.02)
+        elif note < 0.8:
+            # Double note, two fingers at once
+            first, second = random.sample(range(4), 2)
+            x1, y1 = touches.center(pdtouch.Buttons, first)
+            x2, y2 = touches.center(pdtouch.Buttons, second)
+            pygame = pdtouch.pygame
+            touches.add(when, [touches.event(pygame.FINGERDOWN, 2, x1, y1),
+                               touches.event(pygame.FINGERDOWN, 3, x2, y2)])
+            touches.add(when + 0.02, [touches.event(pygame.FINGERUP, 2, x1, y1),
+                                      touches.event(pygame.FINGERUP, 3, x2, y2)])
+        else:
+            # Short slider flick
+            start = random.uniform(0.1, 0.9) * width
+            touches.slide(when, 5, y, start, start + random.choice((-1, 1)) * width / 8, 0.03, 8)
+        when += random.choice((0.04, 0.06, 0.08, 0.12))
+    touches.groups.sort(key=lambda group: group[0])
+
+def merged_percentiles(latency):
+    """ p50, p95, p99, max in ms over all areas """
+    histograms = list(latency.histograms.values())
+    count = sum(h.count for h in histograms)
+    result = []
+    for percent in (50, 95, 99):
+        if count == 0:
+            result.append(0.0)
+            continue
+        wanted = count * percent / 100.0
+        seen = 0
+        for bucket in range(len(histograms[0].counts)):
+            seen += sum(h.counts[bucket] for h in histograms)
+            if seen >= wanted:
+                result.append((bucket + 1) * histograms[0].bucket_ns / 1e6)
+                break
+    result.append(max(h.max_ns for h in histograms) / 1e6)
+    return result
+
+def run_one(console, slider, scenario, speed, extra):
+    """ Import pdtouch.py in this process, feed it one scenario, print a RESULT line """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    os.chdir(TOP_DIR)
+    sys.path.insert(0, TOP_DIR)
+    import pdtouch
+    pdtouch.setup(['--console=' + console, '--slider=' + slider,
+                   '--port=loop://', '--latency-report', '--log-level=off'] + extra)
+    pygame = pdtouch.pygame
+    port = NullPort(pdtouch.Gamepad.ser_port)
+    pdtouch.Gamepad.ser_port = port
+    startup_writes = port.writes
+
+    touches = Touches(pdtouch)
+    globals()['scenario_' + scenario](touches, pdtouch)
+    num_events = sum(len(events) for _, events in touches.groups)
+
+    def feeder():
+        """ Post each group at its time divided by speed, 0 = no waiting """
+        start = time.perf_counter()
+        for when, events in touches.groups:
+            if speed > 0:
+                delay = start + when / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            # SDL style time stamp (ms since init) so latency starts here
+            timestamp = (time.monotonic_ns() - pdtouch.sdl_epoch_ns) / 1e6
+            for event in events:
+                event.timestamp = timestamp
+                pygame.event.post(event)
+        # Let the loop drain before quitting
+        time.sleep(0.05)
+        pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+    pygame.event.clear()
+    thread = threading.Thread(target=feeder, daemon=True)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    thread.start()
+    pdtouch.run()
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    thread.join()
+
+    writes = port.writes - startup_writes
+    p50, p95, p99, pmax = merged_percentiles(pdtouch.LATENCY)
+    print('RESULT ' + json.dumps({
+        'console': console, 'slider': slider, 'scenario': scenario,
+        'events': num_events, 'wall_s': wall,
+        'events_per_s': num_events / wall,
+        'reports': writes, 'reports_per_event': writes / num_events,
+        'bytes': port.bytes, 'cpu_us_per_event': cpu * 1e6 / num_events,
+        'cpu_percent': cpu * 100.0 / wall,
+        'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'max_ms': pmax}))
+
+def usage():
+    """ Print command line help """
+    print(__doc__)
+    print('options: --scenario=%s --console=%s --slider=%s --speed=N --extra=ARG'
+          % ('|'.join(SCENARIOS), '|'.join(CONSOLES), '|'.join(SLIDERS)))
+
+def main():
+    """ Run every selected combination in a child process and print a table """
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "h",
+                ["help", "one", "scenario=", "console=", "slider=", "speed=", "extra="])
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        sys.exit(2)
+    one = False
+    scenarios = SCENARIOS
+    consoles = CONSOLES
+    sliders = SLIDERS
+    speed = 4.0
+    extra = []
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o == "--one":
+            one = True
+        elif o == "--scenario":
+            scenarios = a.split(',')
+        elif o == "--console":
+            consoles = a.split(',')
+        elif o == "--slider":
+            sliders = a.split(',')
+        elif o == "--speed":
+            # Time compression of the scenario timeline, 0 = as fast as possible
+            speed = float(a)
+        elif o == "--extra":
+            # Extra pdtouch.py option, may be repeated
+            extra.append(a)
+    if one:
+        run_one(consoles[0], sliders[0], scenarios[0], speed, extra)
+        return
+
+    print('%-7s %-9s %-8s %7s %9s %8s %8s %8s %6s %8s %8s %8s' %
+          ('console', 'slider', 'scenario', 'events', 'events/s', 'rep/evt',
+           'bytes', 'cpu us', 'cpu %', 'p50 ms', 'p95 ms', 'p99 ms'), flush=True)
+    for console in consoles:
+        for slider in sliders:
+            for scenario in scenarios:
+                command = [sys.executable, os.path.abspath(__file__), '--one',
+                           '--console=' + console, '--slider=' + slider,
+                           '--scenario=' + scenario, '--speed=%g' % speed]
+                command += ['--extra=' + arg for arg in extra]
+                output = subprocess.run(command, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True).stdout
+                results = [line[7:] for line in output.splitlines() if line.startswith('RESULT ')]
+                if not results:
+                    print('%-7s %-9s %-8s failed' % (console, slider, scenario), flush=True)
+                    continue
+                r = json.loads(results[-1])
+                print('%-7s %-9s %-8s %7d %9.0f %8.2f %8d %8.1f %6.1f %8.3f %8.3f %8.3f' %
+                      (console, slider, scenario, r['events'], r['events_per_s'],
+                       r['reports_per_event'], r['bytes'], r['cpu_us_per_event'],
+                       r['cpu_percent'], r['p50_ms'], r['p95_ms'], r['p99_ms']), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Unplug and replug the gadget with pty pairs and check SerialConnection.
+
+A symlink stands in for the gadget device, like a /dev/serial/by-id link.
+It points at the slave of a pty pair whose master plays the gadget. The
+master is closed to unplug and a new pair is linked to replug. Checks that
+setters never wait while unplugged and that the full state is resent
+after the reconnect, with and without the writer thread, for both
+consoles.
+
+python3 bench/reconnect.py
+"""
+
+import os
+import sys
+import pty
+import select
+import tempfile
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nsgpadserial import NSGamepadSerial
+from ds4gpadserial import DS4GamepadSerial
+from serialconnection import SerialConnection
+
+class Gadget:
+    """Master side of a pty pair, keeps the last report read"""
+    def __init__(self, link, report_size):
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        name = os.ttyname(slave)
+        # The connection opens the slave by name
+        os.close(slave)
+        if os.path.lexists(link):
+            os.unlink(link)
+        os.symlink(name, link)
+        self.report_size = report_size
+        self.reports = 0
+        self.last = None
+        self.got_report = threading.Event()
+        self.plugged = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Read reports until unplugged"""
+        data = b''
+        while self.plugged:
+            if not select.select([self.master], [], [], 0.01)[0]:
+                continue
+            try:
+                chunk = os.read(self.master, 4096)
+            except OSError:
+                # EIO until the connection opens the slave
+                time.sleep(0.01)
+                continue
+            data += chunk
+            while len(data) >= self.report_size:
+                self.last = data[:self.report_size]
+                data = data[self.report_size:]
+                self.reports += 1
+                self.got_report.set()
+
+    def unplug(self):
+        """Close the master, writes to the slave fail from now on"""
+        self.plugged = False
+        self.thread.join()
+        os.close(self.master)
+
+def check(gamepad_class, threaded, link):
+    """ One unplug and replug cycle, return the result line """
+    gamepad = gamepad_class()
+    report_size = gamepad.report_struct.size
+    gadget = Gadget(link, report_size)
+    # As pdtouch.py, writes from the setter's thread never wait
+    connection = SerialConnection([link], retry_interval=0.05,
+                                  write_timeout=0.1 if threaded else 0)
+    if not connection.connect():
+        return 'cannot open %s' % link
+    gamepad.begin(connection, threaded=threaded)
+    connection.start(lambda name: gamepad.resend())
+    gamepad.press(1)
+    gadget.got_report.wait(1)
+    gadget.unplug()
+
+    # Unplugged: every setter must return at once
+    slowest = 0
+    for button in range(2, 12):
+        start = time.perf_counter()
+        gamepad.press(button)
+        slowest = max(slowest, time.perf_counter() - start)
+        time.sleep(0.01)
+    with gamepad.thread_lock:
+        expected = bytes(gamepad.encode())
+
+    replug_start = time.perf_counter()
+    gadget = Gadget(link, report_size)
+    resent = gadget.got_report.wait(2)
+    reconnect_ms = (time.perf_counter() - replug_start) * 1000
+    time.sleep(0.05)
+    stats = connection.stats()
+    gamepad.end()
+    return '%-18s %-8s %9.3f %9.1f %8s %8d %8d %8d' % (
+        gamepad_class.__name__, 'writer' if threaded else 'direct', slowest * 1000,
+        reconnect_ms, 'yes' if resent and gadget.last == expected else 'NO',
+        stats['connects'], stats['write_errors'], stats['dropped'])
+
+def main():
+    """ Every console and writer mode """
+    print('%-18s %-8s %9s %9s %8s %8s %8s %8s' % ('gamepad', 'mode', 'setter ms', 'replug ms',
+                                                  'resent', 'connects', 'errors', 'dropped'))
+    with tempfile.TemporaryDirectory() as directory:
+        link = os.path.join(directory, 'gadget')
+        for gamepad_class in (NSGamepadSerial, DS4GamepadSerial):
+            for threaded in (False, True):
+                print(check(gamepad_class, threaded, link), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Touch to gadget latency of pdtouch.py in one process and with
+--render-process, with and without a heavy drawing load.
+
+pdtouch.py reads touches from a FIFO with --evdev and writes to a
+GadgetEmulator at 2,000,000 baud. A finger slides across the 32 slide bar
+cells, one cell per touch frame, so each frame gives one new slide bar
+state. Latency is from writing a frame to the FIFO to the time the
+gadget received the report with its state. The drawing load is a busy
+loop in Python of --draw-ms before every TouchAreas.flushDisplay, standing
+in for heavy blits and display updates that hold the GIL. With
+--render-process it runs in the render process.
+
+python3 bench/split.py
+python3 bench/split.py --rate=500 --seconds=5 --draw-ms=0,2,8
+"""
+
+import os
+import sys
+import getopt
+import subprocess
+import tempfile
+import time
+from struct import Struct
+
+TOP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, TOP_DIR)
+
+from touchareas import TouchAreas
+
+# struct input_event: struct timeval time, __u16 type, __u16 code, __s32 value
+INPUT_EVENT = Struct('@llHHi')
+EV_SYN = 0x00
+EV_ABS = 0x03
+ABS_MT_SLOT = 0x2f
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+# SDL dummy video driver screen
+WIDTH = 1024
+HEIGHT = 768
+SLIDER_CELLS = 32
+
+# Set in the pdtouch.py processes this script starts, the render process
+# started by --render-process imports this file again and gets it too
+DRAW_MS = float(os.environ.get('SPLIT_BENCH_DRAW_MS', '0'))
+if DRAW_MS:
+    flush_display = TouchAreas.flushDisplay
+
+    def heavy_flush(merge=False, lock=None):
+        """ Hold the GIL for DRAW_MS, then draw """
+        end = time.perf_counter() + DRAW_MS / 1000.0
+        while time.perf_counter() < end:
+            pass
+        flush_display(merge, lock)
+    TouchAreas.flushDisplay = staticmethod(heavy_flush)
+
+def event(ev_type, code, value):
+    """ One input_event, the time stamp is taken by the reader """
+    return INPUT_EVENT.pack(0, 0, ev_type, code, value)
+
+def cell_x(cell):
+    """ Screen x of a slide bar cell center """
+    return int((cell + 0.5) * (WIDTH - 1) / SLIDER_CELLS)
+
+def cell_axes(cell):
+    """ --slider=dedicated axes (left x, left y, right x, right y) of one cell pressed """
+    value = (1 << (31 - cell)) ^ 0x80808080
+    return (value & 0xff, (value >> 8) & 0xff, (value >> 16) & 0xff, (value >> 24) & 0xff)
+
+def run(split, draw_ms, rate, seconds, fifo):
+    """ One pdtouch.py run, return its result line """
+    # pylint: disable=too-many-locals
+    from gadgetemu import GadgetEmulator
+    from latency import LatencyHistogram
+    emulator = GadgetEmulator(2000000)
+    emulator.start()
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy',
+               SPLIT_BENCH_DRAW_MS=str(draw_ms))
+    args = [sys.executable, os.path.abspath(__file__), '--child',
+            '--port=' + emulator.path, '--evdev=' + fifo, '--slider=dedicated',
+            '--log-level=off']
+    if split:
+        args.append('--render-process')
+    child = subprocess.Popen(args, cwd=TOP_DIR, env=env, stdout=subprocess.DEVNULL)
+    # Blocks until pdtouch.py opens the FIFO
+    touch_fd = os.open(fifo, os.O_WRONLY)
+    # Let the layout, and with --render-process the other process, finish
+    time.sleep(2)
+    y = HEIGHT // 2
+    os.write(touch_fd, event(EV_ABS, ABS_MT_SLOT, 0) + event(EV_ABS, ABS_MT_TRACKING_ID, 1) +
+             event(EV_ABS, ABS_MT_POSITION_X, cell_x(0)) + event(EV_ABS, ABS_MT_POSITION_Y, y) +
+             event(EV_SYN, 0, 0))
+    time.sleep(0.1)
+    # Start matching after the report of the first touch
+    index = len(emulator.states)
+    # (write time ns, expected axes) per frame
+    sent = []
+    frames = int(rate * seconds)
+    start = time.monotonic()
+    for frame in range(1, frames + 1):
+        delay = start + frame / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        cell = frame % SLIDER_CELLS
+        # Before the write, the report can arrive before os.write returns
+        sent.append((time.monotonic_ns(), cell_axes(cell)))
+        os.write(touch_fd, event(EV_ABS, ABS_MT_POSITION_X, cell_x(cell)) + event(EV_SYN, 0, 0))
+    os.write(touch_fd, event(EV_ABS, ABS_MT_TRACKING_ID, -1) + event(EV_SYN, 0, 0))
+    # End of input quits pdtouch.py
+    os.close(touch_fd)
+    child.wait(30)
+    time.sleep(0.05)
+    emulator.stop()
+
+    latency = LatencyHistogram(bucket_ns=10000, buckets=100000)
+    states = emulator.states
+    missed = 0
+    # Every frame gives one report, in order. Latency can be longer than
+    # one trip across the slide bar so reports are matched by order.
+    for sent_ns, axes in sent:
+        first = index
+        while index < len(states) and (states[index].left_x, states[index].left_y,
+                                       states[index].right_x, states[index].right_y) != axes:
+            index += 1
+        if index == len(states):
+            missed += 1
+            index = first
+            continue
+        latency.add(states[index].time_ns - sent_ns)
+        index += 1
+    return '%-8s %8g %8d %8d %9.3f %9.3f %9.3f %8d' % (
+        'split' if split else 'single', draw_ms, frames, emulator.stats()['frames'],
+        latency.percentile(50) / 1e6, latency.percentile(99) / 1e6,
+        latency.max_ns / 1e6, missed)
+
+def main():
+    """ Parse options, run each mode and load """
+    rate = 250.0
+    seconds = 4.0
+    draw_loads = (0.0, 2.0, 8.0)
+    opts, _ = getopt.getopt(sys.argv[1:], '', ['rate=', 'seconds=', 'draw-ms='])
+    for o, a in opts:
+        if o == '--rate':
+            rate = float(a)
+        elif o == '--seconds':
+            seconds = float(a)
+        elif o == '--draw-ms':
+            draw_loads = tuple(float(v) for v in a.split(','))
+    print('%g touch frames/s for %g s' % (rate, seconds))
+    print('%-8s %8s %8s %8s %9s %9s %9s %8s' % ('mode', 'draw ms', 'touches', 'reports',
+                                                'p50 ms', 'p99 ms', 'max ms', 'missed'))
+    with tempfile.TemporaryDirectory() as directory:
+        fifo = os.path.join(directory, 'touches')
+        os.mkfifo(fifo)
+        for draw_ms in draw_loads:
+            for split in (False, True):
+                print(run(split, draw_ms, rate, seconds, fifo), flush=True)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--child']:
+        os.chdir(TOP_DIR)
+        import pdtouch
+        pdtouch.main(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Check that a tap shorter than one report reaches the gadget: a press and
+release inside one batch, and quicker than the writer thread or the pacer
+tick, must give a report with the press and then one with the release.
+
+Runs every console with no writer thread, with --serial-thread and with
+--pace. Exits with status 1 if a tap was lost.
+
+python3 bench/taps.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nsgpadserial import NSGamepadSerial, NSButton, NSDPad
+from ds4gpadserial import DS4GamepadSerial, DS4Button, DS4DPad
+from gadgetemu import FrameParser
+
+class ListPort:
+    """Keep the written bytes"""
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        """Keep"""
+        self.data += data
+        return len(data)
+
+    def close(self):
+        """Nothing to close"""
+        return
+
+def states(gamepad_class, mode, taps):
+    """ Play taps into a new gamepad, return (buttons, dpad) of each report """
+    port = ListPort()
+    gamepad = gamepad_class()
+    gamepad.begin(port, threaded=(mode == 'thread'), pace=(0.004 if mode == 'pace' else 0.0))
+    gamepad.suppressDuplicates()
+    # Leave out the idle report of begin()
+    time.sleep(0.02)
+    start = len(port.data)
+    for tap in taps:
+        tap(gamepad)
+        time.sleep(0.02)
+    gamepad.end()
+    return [(state.buttons, state.dpad) for state in FrameParser().feed(bytes(port.data[start:]), 0)]
+
+def main():
+    """ Run the checks, print the failures """
+    # pylint: disable=too-many-locals
+    failed = 0
+    # DS4GamepadSerial centers the dpad with 15 like NSGamepadSerial
+    centered = NSDPad.CENTERED
+    for gamepad_class, button, dpad in ((NSGamepadSerial, NSButton.A, NSDPad.UP),
+                                        (DS4GamepadSerial, DS4Button.CROSS, DS4DPad.UP)):
+        def button_tap(gamepad):
+            with gamepad.batch():
+                gamepad.press(button)
+                gamepad.release(button)
+
+        def dpad_tap(gamepad):
+            with gamepad.batch():
+                gamepad.dPad(dpad)
+                gamepad.dPad(centered)
+
+        def slide(gamepad):
+            # Right then up right in one batch is one report
+            with gamepad.batch():
+                gamepad.dPadXAxis(255)
+                gamepad.dPadYAxis(0)
+            gamepad.dPad(centered)
+
+        def unbatched_tap(gamepad):
+            gamepad.press(button)
+            gamepad.release(button)
+
+        def double_tap(gamepad):
+            with gamepad.batch():
+                for _ in range(2):
+                    gamepad.press(button)
+                    gamepad.release(button)
+
+        expected_tap = [(1 << button, centered), (0, centered)]
+        checks = (('button tap', [button_tap], expected_tap),
+                  ('dpad tap', [dpad_tap], [(0, dpad), (0, centered)]),
+                  ('dpad slide', [slide], [(0, NSDPad.UP_RIGHT), (0, centered)]),
+                  ('unbatched tap', [unbatched_tap], expected_tap),
+                  ('double tap', [double_tap], expected_tap * 2))
+        for mode in ('direct', 'thread', 'pace'):
+            for name, taps, expected in checks:
+                got = states(gamepad_class, mode, taps)
+                if got != expected:
+                    failed += 1
+                    print('FAIL %s %s %s: got %s, expected %s' %
+                          (gamepad_class.__name__, mode, name, got, expected))
+    print('%d failed' % failed)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
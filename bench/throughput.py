@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Serial throughput and state to gadget latency through the gadget emulator.
+
+NSGamepadSerial writes to a GadgetEmulator pty limited to a baud rate.
+Every state change sets the buttons to a new value so each frame the
+gadget decodes tells which change it carries. Latency is from the setter
+call to the time the frame's last byte arrived on the emulated line, for
+the changes that reached the gadget. final tells if the last one did.
+Modes: direct writes, the SerialWriter thread, the writer with the queue
+monitor coalescing above 24 queued bytes, and ReportPacer at 1 and 8 ms.
+
+python3 bench/throughput.py
+python3 bench/throughput.py --baud=2000000 --rate=5000
+"""
+
+import os
+import sys
+import getopt
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nsgpadserial import NSGamepadSerial
+from queuemonitor import QueueMonitor
+from latency import LatencyHistogram
+from gadgetemu import GadgetEmulator
+
+MODES = (
+    ('direct', {}),
+    ('writer', {'threaded': True}),
+    ('writer+queue', {'threaded': True, 'queue': 24}),
+    ('pace 1 ms', {'pace': 0.001}),
+    ('pace 8 ms', {'pace': 0.008}),
+)
+
+def run(name, options, baud, rate, seconds):
+    """ One mode, return its result line """
+    emulator = GadgetEmulator(baud)
+    emulator.start()
+    port = emulator.open_port()
+    gamepad = NSGamepadSerial()
+    if 'queue' in options:
+        gamepad.queue_monitor = QueueMonitor(options['queue'])
+    gamepad.begin(port, threaded=options.get('threaded', False),
+                  pace=options.get('pace', 0.0))
+    # Setter time of each buttons value
+    set_ns = {}
+    changes = min(int(rate * seconds), 0x3fff)
+    start = time.monotonic()
+    for change in range(1, changes + 1):
+        delay = start + change / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        set_ns[change] = time.monotonic_ns()
+        gamepad.buttons(change)
+    elapsed = time.monotonic() - start
+    gamepad.end()
+    # Let the emulated line drain
+    deadline = time.monotonic() + 10
+    while emulator.backlog() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    emulator.stop()
+    latency = LatencyHistogram(bucket_ns=10000, buckets=100000)
+    for state in emulator.states:
+        if state.buttons in set_ns:
+            latency.add(state.time_ns - set_ns[state.buttons])
+    stats = emulator.stats()
+    last = emulator.states[-1].buttons if emulator.states else -1
+    return '%-14s %8.0f %8d %8.2f %9.2f %9.2f %8d %6d %5s' % (
+        name, changes / elapsed, stats['frames'], stats['frames'] / elapsed,
+        latency.percentile(50) / 1e6, latency.percentile(99) / 1e6,
+        stats['max_backlog'], stats['bad_frames'], 'yes' if last == changes else 'NO')
+
+def main():
+    """ Parse options, run every mode """
+    baud = 115200
+    rate = 1000
+    seconds = 2.0
+    opts, _ = getopt.getopt(sys.argv[1:], '', ['baud=', 'rate=', 'seconds='])
+    for o, a in opts:
+        if o == '--baud':
+            baud = int(a)
+        elif o == '--rate':
+            rate = float(a)
+        elif o == '--seconds':
+            seconds = float(a)
+    print('baud %d, line carries %d reports/s, %g changes/s for %g s' %
+          (baud, baud // 10 // NSGamepadSerial.report_struct.size, rate, seconds))
+    print('%-14s %8s %8s %8s %9s %9s %8s %6s %5s' % ('mode', 'chg/s', 'frames', 'frm/s',
+                                                     'lat50 ms', 'lat99 ms', 'backlog',
+                                                     'bad', 'final'))
+    for name, options in MODES:
+        print(run(name, options, baud, rate, seconds), flush=True)
+
+if __name__ == "__main__":
+    main()
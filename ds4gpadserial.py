@@ -24,10 +24,15 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-from struct import pack
+from struct import Struct
+from contextlib import contextmanager
 import array
+import collections
 import threading
+import time
 from enum import IntEnum
+from serialwriter import SerialWriter
+from reportpacer import ReportPacer
 
 # Direction pad names
 class DS4DPad(IntEnum):
@@ -71,16 +76,45 @@ class DPadButton(IntEnum):
 class DS4GamepadSerial:
     """Dual Shock 4 Gamepad Serial Interface"""
     # pylint: disable=too-many-instance-attributes
+    report_struct = Struct('<BBBBBBBBBBBBBB')
     compass_dir_x = array.array('B', \
             [0, 0, 128, 255, 255, 255, 128, 0, \
             128, 128, 128, 128, 128, 128, 128, 128, 128])
     compass_dir_y = array.array('B', \
             [128, 255, 255, 255, 128, 0, 0, 0,\
             128, 128, 128, 128, 128, 128, 128, 128, 128])
+    # Directions in each dpad position, up 1, right 2, down 4, left 8
+    compass_dir_bits = array.array('B', \
+            [1, 3, 2, 6, 4, 12, 8, 9, \
+            0, 0, 0, 0, 0, 0, 0, 0, 0])
+    # Most states sendChanges() queues for the writer thread, more changes
+    # are merged as before
+    taps_max = 4
 
     def __init__(self):
-        self.thread_lock = threading.Lock()
+        self.thread_lock = threading.RLock()
+        self.batch_depth = 0
+        self.batch_dirty = False
         self.ser_port = 0
+        self.writer = None
+        # Optional latency.LatencyRecorder
+        self.latency = None
+        # Optional queuemonitor.QueueMonitor
+        self.queue_monitor = None
+        self.report = bytearray(self.report_struct.size)
+        self.report_view = memoryview(self.report)
+        self.last_report = bytearray(self.report_struct.size)
+        self.last_report_time = 0.0
+        # Buttons and dpad directions changed since the last report was
+        # packed, see keepChanges()
+        self.changed_buttons = 0
+        self.changed_dirs = 0
+        # (report, latency marks) of states from sendChanges(), the writer
+        # thread sends these before the pending state
+        self.taps = collections.deque()
+        self.suppress_duplicates = False
+        self.keepalive = 0.0
+        self.reports_suppressed = 0
         self.left_x_axis = 128
         self.left_y_axis = 128
         self.right_x_axis = 128
@@ -92,10 +126,22 @@ class DS4GamepadSerial:
         self.dpad_x_axis = 128
         self.dpad_y_axis = 128
 
-    def begin(self, serial_port):
-        """Start DS4Gamepad"""
+    def begin(self, serial_port, threaded=False, pace=0.0, pace_immediate=True,
+              pace_spin=0.0):
+        """
+        Start DS4Gamepad. If threaded is True, reports are sent by a background
+        SerialWriter thread so setters never block on the serial port.
+        If pace is > 0, reports are sent by a ReportPacer thread at most
+        once every pace seconds instead, see reportpacer.py.
+        """
         with self.thread_lock:
             self.ser_port = serial_port
+            if pace > 0 and self.writer is None:
+                self.writer = ReportPacer(self, pace, pace_immediate, pace_spin)
+                self.writer.start()
+            elif threaded and self.writer is None:
+                self.writer = SerialWriter(self)
+                self.writer.start()
             self.left_x_axis = 128
             self.left_y_axis = 128
             self.right_x_axis = 128
@@ -109,30 +155,201 @@ class DS4GamepadSerial:
 
     def end(self):
         """End DS4Gamepad"""
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
         self.ser_port.close()
         return
 
     def write(self):
-        """Send DS4Gamepad state"""
-        self.ser_port.write(
-            pack('<BBBBBBBBBBBBBB',
-                 2,  # STX
-                 11, # data len + 1
-                 3,  # report type
-                 1,  # report ID
-                 self.left_x_axis, self.left_y_axis,
-                 self.right_x_axis, self.right_y_axis,
-                 ((self.my_buttons & 0x0f) << 4) | self.d_pad,
-                 (self.my_buttons >> 4) & 0xff,
-                 self.my_buttons >> 12,
-                 self.left_trigger,
-                 self.right_trigger,
-                 3)) # ETX
+        """Send DS4Gamepad state, or defer it until the open batch ends"""
+        if self.batch_depth:
+            self.batch_dirty = True
+            return
+        marks = self.latency.take() if self.latency is not None else None
+        if self.writer is not None:
+            self.writer.post(marks)
+        else:
+            self.send(marks)
+        return
+
+    def send(self, marks=None, reports=1):
+        """
+        Encode and write DS4Gamepad state now, unless the queue monitor holds it
+        back. Caller holds thread_lock.
+        """
+        monitor = self.queue_monitor
+        if monitor is not None:
+            if monitor.hold(self.ser_port, reports, marks):
+                return
+            marks = monitor.release(marks)
+        report = self.encode()
+        if report is not None:
+            self.ser_port.write(report)
+            if monitor is not None:
+                monitor.written(len(report))
+            if marks:
+                self.latency.record(marks, time.monotonic_ns())
+        return
+
+    def sendHeld(self):
+        """
+        Send the state held back by the queue monitor if the serial output
+        queue has drained. Return True while it is still held and needs
+        another call. The writer thread retries by itself.
+        """
+        with self.thread_lock:
+            monitor = self.queue_monitor
+            if monitor is None or not monitor.held or self.writer is not None:
+                return False
+            if not self.batch_depth:
+                self.send(reports=0)
+            return monitor.held
+
+    def suppressDuplicates(self, enable=True, keepalive=0.0):
+        """
+        Skip sending a report identical to the last one sent. If keepalive
+        is > 0, the state is sent again when keepalive seconds have passed
+        since the last report, by the writer thread or, without one, by
+        sendKeepalive() calls.
+        """
+        with self.thread_lock:
+            self.suppress_duplicates = enable
+            self.keepalive = keepalive
+            self.last_report_time = 0.0
+        return
+
+    def keepaliveDue(self):
+        """
+        Seconds until an unchanged report is due again, None if keepalive is
+        off. Caller holds thread_lock.
+        """
+        if not self.suppress_duplicates or self.keepalive <= 0:
+            return None
+        return self.last_report_time + self.keepalive - time.monotonic()
+
+    def sendKeepalive(self):
+        """
+        Send the unchanged state again if keepalive seconds have passed since
+        the last report. Return the seconds until the next one is due, None
+        if keepalive is off. The writer thread resends by itself.
+        """
+        with self.thread_lock:
+            due = self.keepaliveDue()
+            if due is None or self.writer is not None:
+                return None
+            if due <= 0 and not self.batch_depth:
+                self.write()
+                due = self.keepaliveDue()
+            return max(due, 0.0)
+
+    def resend(self):
+        """
+        Send the full current state even if unchanged, for example to a
+        gadget that was reconnected or reset
+        """
+        with self.thread_lock:
+            # No real report is all zero bytes
+            self.last_report[:] = bytes(len(self.last_report))
+            self.write()
+        return
+
+    def pack(self, buffer):
+        """Pack DS4Gamepad state into buffer. Caller holds thread_lock."""
+        self.report_struct.pack_into(buffer, 0,
+                                     2,  # STX
+                                     11, # data len + 1
+                                     3,  # report type
+                                     1,  # report ID
+                                     self.left_x_axis, self.left_y_axis,
+                                     self.right_x_axis, self.right_y_axis,
+                                     ((self.my_buttons & 0x0f) << 4) | self.d_pad,
+                                     (self.my_buttons >> 4) & 0xff,
+                                     self.my_buttons >> 12,
+                                     self.left_trigger,
+                                     self.right_trigger,
+                                     3) # ETX
+        self.changed_buttons = 0
+        self.changed_dirs = 0
         return
 
+    def keepChanges(self, buttons, d_pad):
+        """
+        Called by setters before they change the buttons to buttons or the
+        dpad to d_pad. If that undoes a button or dpad direction change not
+        sent yet, the current state is sent first so a tap inside one
+        batch, or quicker than the writer thread, is not lost. Caller holds
+        thread_lock.
+        """
+        dir_bits = self.compass_dir_bits
+        toggled_buttons = self.my_buttons ^ buttons
+        toggled_dirs = dir_bits[self.d_pad] ^ dir_bits[d_pad]
+        if ((toggled_buttons & self.changed_buttons) or (toggled_dirs & self.changed_dirs)) \
+                and len(self.taps) < self.taps_max:
+            self.sendChanges()
+        self.changed_buttons |= toggled_buttons
+        self.changed_dirs |= toggled_dirs
+        return
+
+    def sendChanges(self):
+        """
+        Send the current state ahead of the pending one, see keepChanges().
+        Caller holds thread_lock.
+        """
+        marks = self.latency.take() if self.latency is not None else None
+        if self.writer is None:
+            self.send(marks)
+            return
+        report = bytearray(self.report_struct.size)
+        self.pack(report)
+        if self.suppress_duplicates:
+            self.last_report[:] = report
+            self.last_report_time = time.monotonic()
+        # The setter's own write() wakes the writer for it
+        self.taps.append((report, marks))
+        return
+
+    def encode(self):
+        """
+        Pack DS4Gamepad state into the report buffer and return a memoryview of
+        it, or None if it is a suppressed duplicate of the last report.
+        """
+        self.pack(self.report)
+
+        if self.suppress_duplicates:
+            now = time.monotonic()
+            if self.report == self.last_report and \
+                    (self.keepalive <= 0 or
+                     now - self.last_report_time < self.keepalive):
+                self.reports_suppressed += 1
+                return None
+            self.last_report[:] = self.report
+            self.last_report_time = now
+        return self.report_view
+
+    @contextmanager
+    def batch(self):
+        """
+        Apply many changes under one lock and send one report at the end.
+
+        with gamepad.batch():
+            gamepad.dPadXAxis(255)
+            gamepad.dPadYAxis(0)
+        """
+        with self.thread_lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if self.batch_depth == 0 and self.batch_dirty:
+                    self.batch_dirty = False
+                    self.write()
+
     def press(self, button_number):
         """Press button 0..13"""
         with self.thread_lock:
+            self.keepChanges(self.my_buttons | (1<<button_number), self.d_pad)
             self.my_buttons |= (1<<button_number)
             self.write()
         return
@@ -140,6 +357,7 @@ class DS4GamepadSerial:
     def release(self, button_number):
         """Release button 0..13"""
         with self.thread_lock:
+            self.keepChanges(self.my_buttons & ~(1<<button_number), self.d_pad)
             self.my_buttons &= ~(1<<button_number)
             self.write()
         return
@@ -147,6 +365,7 @@ class DS4GamepadSerial:
     def releaseAll(self):
         """Release all buttons"""
         with self.thread_lock:
+            self.keepChanges(0, self.d_pad)
             self.my_buttons = 0
             self.write()
         return
@@ -154,6 +373,7 @@ class DS4GamepadSerial:
     def buttons(self, buttons):
         """Set all buttons 0..13"""
         with self.thread_lock:
+            self.keepChanges(buttons, self.d_pad)
             self.my_buttons = buttons
             self.write()
         return
@@ -236,8 +456,10 @@ class DS4GamepadSerial:
         if (position < 0 or position > 255):
             position = 128
         with self.thread_lock:
+            d_pad = self.map_dpad_xy(position, self.dpad_y_axis)
+            self.keepChanges(self.my_buttons, d_pad)
             self.dpad_x_axis = position
-            self.d_pad = self.map_dpad_xy(self.dpad_x_axis, self.dpad_y_axis)
+            self.d_pad = d_pad
             self.write()
         return
 
@@ -246,8 +468,10 @@ class DS4GamepadSerial:
         if (position < 0 or position > 255):
             position = 128
         with self.thread_lock:
+            d_pad = self.map_dpad_xy(self.dpad_x_axis, position)
+            self.keepChanges(self.my_buttons, d_pad)
             self.dpad_y_axis = position
-            self.d_pad = self.map_dpad_xy(self.dpad_x_axis, self.dpad_y_axis)
+            self.d_pad = d_pad
             self.write()
         return
 
@@ -256,12 +480,33 @@ class DS4GamepadSerial:
         if position < 0 or position > 7:
             position = 15
         with self.thread_lock:
+            self.keepChanges(self.my_buttons, position)
             self.d_pad = position
             self.dpad_x_axis = self.compass_dir_x[position]
             self.dpad_y_axis = self.compass_dir_y[position]
             self.write()
         return
 
+    def setState(self, buttons=None, axes=None, dpad=None,
+                 left_trigger=None, right_trigger=None):
+        """
+        Change buttons, all axes (uint32_t as for allAxes), directional pad
+        (0..7, 15) and triggers in one call. Fields left as None are not
+        changed. Only one report is sent.
+        """
+        with self.batch():
+            if buttons is not None:
+                self.buttons(buttons)
+            if axes is not None:
+                self.allAxes(axes)
+            if dpad is not None:
+                self.dPad(dpad)
+            if left_trigger is not None:
+                self.leftTrigger(left_trigger)
+            if right_trigger is not None:
+                self.rightTrigger(right_trigger)
+        return
+
 def main():
     """ test DS4GamepadSerial class """
     import sys
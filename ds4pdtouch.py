@@ -100,11 +100,11 @@ if pygame.font:
 
 class GamepadButtons(TouchAreas):
     """ PS4/DS4 buttons """
-    def buttonOn(self, gridcell):
+    def buttonOn(self, cell_id):
         """ Button touched/pressed """
-        if TouchAreas.buttonOn(self, gridcell):
-            self.drawCell(gridcell, (0, 128, 128))
-            button = gridcell['button']
+        if TouchAreas.buttonOn(self, cell_id):
+            self.drawCell(cell_id, (0, 128, 128))
+            button = TouchAreas.buttons[cell_id]
             if button == DPadButton.UP:
                 DS4G.dPadYAxis(0)
             elif button == DPadButton.DOWN:
@@ -114,23 +114,19 @@ class GamepadButtons(TouchAreas):
             elif button == DPadButton.RIGHT:
                 DS4G.dPadXAxis(255)
             else:
-                DS4G.press(gridcell['button'])
+                DS4G.press(button)
 
-    def buttonOff(self, gridcell):
+    def buttonOff(self, cell_id):
         """ Button released """
-        if TouchAreas.buttonOff(self, gridcell):
-            if gridcell.get('color'):
-                color = gridcell.get('color')
-            else:
-                color = self.bgcolor
-            self.drawCell(gridcell, color)
-            button = gridcell['button']
+        if TouchAreas.buttonOff(self, cell_id):
+            self.drawCell(cell_id)
+            button = TouchAreas.buttons[cell_id]
             if button == DPadButton.UP or button == DPadButton.DOWN:
                 DS4G.dPadYAxis(128)
             elif button == DPadButton.LEFT or button == DPadButton.RIGHT:
                 DS4G.dPadXAxis(128)
             else:
-                DS4G.release(gridcell['button'])
+                DS4G.release(button)
 
 class SlideBar(TouchAreas):
     """ Project Diva slide bar """
@@ -140,23 +136,23 @@ class SlideBar(TouchAreas):
         self.hands = []
         self.handsOld = []
 
-    def buttonOn(self, gridcell):
+    def buttonOn(self, cell_id):
         """ Button touched/pressed """
-        if TouchAreas.buttonOn(self, gridcell):
-            self.drawCell(gridcell, (0, 128, 128))
+        if TouchAreas.buttonOn(self, cell_id):
+            self.drawCell(cell_id, (0, 128, 128))
             self.update()
 
-    def buttonOff(self, gridcell):
+    def buttonOff(self, cell_id):
         """ Button released """
-        if TouchAreas.buttonOff(self, gridcell):
-            self.drawCell(gridcell, self.bgcolor)
+        if TouchAreas.buttonOff(self, cell_id):
+            self.drawCell(cell_id, self.bgcolor)
             self.update()
 
-    def fingerMove(self, gridcell, gridcell_new):
-        if TouchAreas.buttonOn(self, gridcell_new):
-            self.drawCell(gridcell_new, (0, 128, 128))
-        if TouchAreas.buttonOff(self, gridcell):
-            self.drawCell(gridcell, self.bgcolor)
+    def fingerMove(self, cell_id, cell_id_new):
+        if TouchAreas.buttonOn(self, cell_id_new):
+            self.drawCell(cell_id_new, (0, 128, 128))
+        if TouchAreas.buttonOff(self, cell_id):
+            self.drawCell(cell_id, self.bgcolor)
         self.update()
 
     def update(self):
@@ -169,8 +165,8 @@ class SlideBar(TouchAreas):
         #entry_ticks = pygame.time.get_ticks()
         slider_bits = 0
         bit_count = 31
-        for gridcell in self.cells:
-            buttonDown = gridcell['buttonDown']
+        for cell in self.cells:
+            buttonDown = TouchAreas.press_counts[cell.cell_id]
             if buttonDown > 0:
                 slider_bits |= (1 << bit_count)
             bit_count -= 1
@@ -274,17 +270,17 @@ class SlideBar(TouchAreas):
 
 class BigButtons(TouchAreas):
     """ Big buttons """
-    def buttonOn(self, gridcell):
+    def buttonOn(self, cell_id):
         """ Button touched/pressed """
-        if TouchAreas.buttonOn(self, gridcell):
-            DS4G.press(gridcell['button'])
-            self.drawCell(gridcell, (255, 255, 255))
+        if TouchAreas.buttonOn(self, cell_id):
+            DS4G.press(TouchAreas.buttons[cell_id])
+            self.drawCell(cell_id, (255, 255, 255))
 
-    def buttonOff(self, gridcell):
+    def buttonOff(self, cell_id):
         """ Button released """
-        if TouchAreas.buttonOff(self, gridcell):
-            DS4G.release(gridcell['button'])
-            self.drawCell(gridcell, gridcell['color'])
+        if TouchAreas.buttonOff(self, cell_id):
+            DS4G.release(TouchAreas.buttons[cell_id])
+            self.drawCell(cell_id)
 
 nsbutton_props = [
     {"label": "ZL", "button": NSButton.LEFT_THROTTLE},
@@ -408,35 +404,36 @@ def main():
                 cell_x = int(event.x*screen_width_max)
                 cell_y = int(event.y*screen_height_max)
                 for touch_area in (gamepad_buttons, Slider, Buttons):
-                    gridcell = touch_area.touchToCell(cell_x, cell_y)
-                    if gridcell != -1:
-                        gridcell['myself'].buttonOn(gridcell)
-                        fingers[event.finger_id] = gridcell
+                    cell_id = touch_area.touchToCell(cell_x, cell_y)
+                    if cell_id:
+                        touch_area.buttonOn(cell_id)
+                        fingers[event.finger_id] = cell_id
                         break
             elif event.type == pygame.FINGERUP:
                 cell_x = int(event.x*screen_width_max)
                 cell_y = int(event.y*screen_height_max)
                 for touch_area in (gamepad_buttons, Slider, Buttons):
-                    gridcell = touch_area.touchToCell(cell_x, cell_y)
-                    if gridcell != -1:
-                        gridcell['myself'].buttonOff(gridcell)
-                        fingers[event.finger_id] = gridcell
+                    cell_id = touch_area.touchToCell(cell_x, cell_y)
+                    if cell_id:
+                        touch_area.buttonOff(cell_id)
+                        fingers[event.finger_id] = cell_id
                         break
             elif event.type == pygame.FINGERMOTION:
                 cell_x = int(event.x*screen_width_max)
                 cell_y = int(event.y*screen_height_max)
                 for touch_area in (gamepad_buttons, Slider, Buttons):
-                    gridcell_new = touch_area.touchToCell(cell_x, cell_y)
-                    if gridcell_new != -1:
-                        gridcell = fingers[event.finger_id]
-                        if gridcell != -1:
-                            if gridcell_new != gridcell:
-                                if gridcell['myself'] == Slider and gridcell['myself'] == Slider:
-                                    gridcell['myself'].fingerMove(gridcell, gridcell_new)    
+                    cell_id_new = touch_area.touchToCell(cell_x, cell_y)
+                    if cell_id_new:
+                        cell_id = fingers.get(event.finger_id, 0)
+                        if cell_id:
+                            if cell_id_new != cell_id:
+                                old_area = TouchAreas.areas[TouchAreas.owners[cell_id]]
+                                if old_area is Slider and touch_area is Slider:
+                                    Slider.fingerMove(cell_id, cell_id_new)
                                 else:
-                                    gridcell['myself'].buttonOff(gridcell)
-                                    gridcell_new['myself'].buttonOn(gridcell_new)
-                                fingers[event.finger_id] = gridcell_new
+                                    old_area.buttonOff(cell_id)
+                                    touch_area.buttonOn(cell_id_new)
+                                fingers[event.finger_id] = cell_id_new
                                 break
             else:
                 if event.type != pygame.VIDEOEXPOSE and event.type != pygame.MULTIGESTURE:
@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+"""
+Linux evdev multitouch input for pdtouch.py, bypassing SDL.
+
+Reads struct input_event records from a touch panel /dev/input/event* node
+(multitouch protocol B: ABS_MT_SLOT, ABS_MT_TRACKING_ID, ABS_MT_POSITION_X/Y
+and SYN_REPORT) in its own thread. At each SYN_REPORT the changed contacts
+are passed to a callback as FINGERDOWN, FINGERUP and FINGERMOTION touches
+with x and y scaled to 0..1 and the kernel time stamp.
+
+The path may also be a file or FIFO of recorded input_event structs, for
+example captured with "cat /dev/input/event0 > touches.bin".
+
+After SYN_DROPPED the kernel lost events. Everything up to the next
+SYN_REPORT is ignored and the slots are read back from the device with
+EVIOCGMTSLOTS, then the differences are passed on so no finger stays down.
+A file or FIFO cannot be read back: every contact that was down is passed
+as FINGERUP and the ones the events say are still down as FINGERDOWN.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import array
+import fcntl
+import threading
+import time
+from struct import Struct
+from touchrecord import FINGERDOWN, FINGERUP, FINGERMOTION
+
+# struct input_event: struct timeval time, __u16 type, __u16 code, __s32 value
+INPUT_EVENT = Struct('@llHHi')
+# struct input_absinfo: value, minimum, maximum, fuzz, flat, resolution
+INPUT_ABSINFO = Struct('@6i')
+# x and y are rounded to float like SDL's so recorded sessions replay exactly
+XY = Struct('@ff')
+
+EV_SYN = 0x00
+EV_ABS = 0x03
+SYN_REPORT = 0
+SYN_DROPPED = 3
+ABS_MT_SLOT = 0x2f
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+
+CLOCK_MONOTONIC = 1
+
+def EVIOCGABS(axis):
+    """ioctl number to read the input_absinfo of an axis"""
+    return (2 << 30) | (INPUT_ABSINFO.size << 16) | (ord('E') << 8) | (0x40 + axis)
+
+def EVIOCGMTSLOTS(length):
+    """ioctl number to read one ABS_MT code of every slot, length in bytes"""
+    return (2 << 30) | (length << 16) | (ord('E') << 8) | 0x0a
+
+# ioctl number to choose the clock of the event time stamps
+EVIOCSCLOCKID = (1 << 30) | (4 << 16) | (ord('E') << 8) | 0xa0
+# ioctl number to take the device away from other readers such as SDL
+EVIOCGRAB = (1 << 30) | (4 << 16) | (ord('E') << 8) | 0x90
+
+class Contact:
+    """One multitouch slot"""
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('tracking_id', 'old_id', 'x', 'y', 'down', 'up', 'moved')
+
+    def __init__(self):
+        self.tracking_id = -1
+        self.old_id = -1
+        self.x = 0
+        self.y = 0
+        self.down = False
+        self.up = False
+        self.moved = False
+
+class EvdevTouch:
+    """Multitouch protocol B reader thread"""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, path, on_frame, on_eof=None, x_range=None, y_range=None,
+                 grab=True):
+        """
+        on_frame(touches) is called from the reader thread at each SYN_REPORT
+        with a list of (touch type, finger id, x, y, time ns) tuples.
+        on_eof() is called if the input ends. x_range and y_range are the
+        (minimum, maximum) raw panel co-ordinates. They are read from the
+        device if not given.
+        """
+        self.path = path
+        self.on_frame = on_frame
+        self.on_eof = on_eof
+        self.fd = os.open(path, os.O_RDONLY)
+        self.kernel_clock = False
+        try:
+            fcntl.ioctl(self.fd, EVIOCSCLOCKID, Struct('@i').pack(CLOCK_MONOTONIC))
+            self.kernel_clock = True
+            if grab:
+                fcntl.ioctl(self.fd, EVIOCGRAB, 1)
+        except OSError:
+            # Not an input device, time stamps are taken when read
+            pass
+        self.x_min, self.x_max = x_range or self.axis_range(ABS_MT_POSITION_X)
+        self.y_min, self.y_max = y_range or self.axis_range(ABS_MT_POSITION_Y)
+        self.contacts = [Contact() for _ in range(16)]
+        self.slot = 0
+        # Number of device slots for EVIOCGMTSLOTS, 0 if not a device
+        self.slots = 0
+        if self.kernel_clock:
+            try:
+                self.slots = self.axis_range(ABS_MT_SLOT)[1] + 1
+            except OSError:
+                pass
+        self.dropped = False
+        # (tracking id, x, y) of each contact when events were dropped
+        self.before_drop = None
+        self.resyncs = 0
+        self.frames = 0
+        self.thread = None
+
+    def axis_range(self, axis):
+        """Return (minimum, maximum) of a device axis"""
+        info = bytearray(INPUT_ABSINFO.size)
+        fcntl.ioctl(self.fd, EVIOCGABS(axis), info)
+        _, minimum, maximum, _, _, _ = INPUT_ABSINFO.unpack(info)
+        return (minimum, maximum)
+
+    def start(self):
+        """Start the reader thread"""
+        self.thread = threading.Thread(target=self.run, name='EvdevTouch',
+                                       daemon=True)
+        self.thread.start()
+        return
+
+    def contact(self, slot):
+        """Return the Contact for a slot"""
+        while slot >= len(self.contacts):
+            self.contacts.append(Contact())
+        return self.contacts[slot]
+
+    def event(self, sec, usec, ev_type, code, value):
+        """Handle one input_event"""
+        if self.dropped and self.slots and not (ev_type == EV_SYN and code == SYN_REPORT):
+            # Incomplete, the slots are read back at the SYN_REPORT
+            return
+        if ev_type == EV_ABS:
+            if code == ABS_MT_SLOT:
+                self.slot = value
+                return
+            contact = self.contact(self.slot)
+            if code == ABS_MT_POSITION_X:
+                contact.x = value
+                contact.moved = True
+            elif code == ABS_MT_POSITION_Y:
+                contact.y = value
+                contact.moved = True
+            elif code == ABS_MT_TRACKING_ID:
+                if contact.tracking_id != -1:
+                    contact.old_id = contact.tracking_id
+                    contact.up = True
+                contact.tracking_id = value
+                if value != -1:
+                    contact.down = True
+        elif ev_type == EV_SYN:
+            if code == SYN_REPORT:
+                if self.kernel_clock:
+                    t_ns = sec * 1000000000 + usec * 1000
+                else:
+                    t_ns = time.monotonic_ns()
+                if self.dropped:
+                    self.resync(t_ns)
+                else:
+                    self.report(t_ns)
+            elif code == SYN_DROPPED and not self.dropped:
+                # Events were lost
+                self.dropped = True
+                self.before_drop = [(contact.tracking_id, contact.x, contact.y)
+                                    for contact in self.contacts]
+        return
+
+    def readSlots(self):
+        """Read the slots and current slot back from the device into the contacts"""
+        values = {}
+        for code in (ABS_MT_TRACKING_ID, ABS_MT_POSITION_X, ABS_MT_POSITION_Y):
+            # __u32 code, __s32 values[slots]
+            request = array.array('i', [code] + [0] * self.slots)
+            fcntl.ioctl(self.fd, EVIOCGMTSLOTS(request.itemsize * len(request)), request)
+            values[code] = request[1:]
+        info = bytearray(INPUT_ABSINFO.size)
+        fcntl.ioctl(self.fd, EVIOCGABS(ABS_MT_SLOT), info)
+        self.slot = INPUT_ABSINFO.unpack(info)[0]
+        for slot in range(self.slots):
+            contact = self.contact(slot)
+            contact.tracking_id = values[ABS_MT_TRACKING_ID][slot]
+            contact.x = values[ABS_MT_POSITION_X][slot]
+            contact.y = values[ABS_MT_POSITION_Y][slot]
+        return
+
+    def resync(self, t_ns):
+        """
+        Pass the changes since the SYN_DROPPED as touches, from the device
+        slots or, if they cannot be read, by lifting and putting down again
+        every contact
+        """
+        exact = False
+        if self.slots:
+            try:
+                self.readSlots()
+                exact = True
+            except OSError:
+                pass
+        touches = []
+        x_scale = 1.0 / ((self.x_max - self.x_min) or 1)
+        y_scale = 1.0 / ((self.y_max - self.y_min) or 1)
+        before = self.before_drop
+        for slot, contact in enumerate(self.contacts):
+            old_id, old_x, old_y = before[slot] if slot < len(before) else (-1, 0, 0)
+            new_id = contact.tracking_id
+            if old_id != -1 and (old_id != new_id or not exact):
+                x, y = self.scale(old_x, old_y, x_scale, y_scale)
+                touches.append((FINGERUP, old_id, x, y, t_ns))
+            if new_id != -1:
+                x, y = self.scale(contact.x, contact.y, x_scale, y_scale)
+                if old_id != new_id or not exact:
+                    touches.append((FINGERDOWN, new_id, x, y, t_ns))
+                elif (contact.x, contact.y) != (old_x, old_y):
+                    touches.append((FINGERMOTION, new_id, x, y, t_ns))
+            contact.down = contact.up = contact.moved = False
+        self.dropped = False
+        self.before_drop = None
+        self.resyncs += 1
+        self.frames += 1
+        if touches:
+            self.on_frame(touches)
+        return
+
+    def scale(self, raw_x, raw_y, x_scale, y_scale):
+        """Panel co-ordinates to 0..1 rounded to float"""
+        return XY.unpack(XY.pack(min(max((raw_x - self.x_min) * x_scale, 0.0), 1.0),
+                                 min(max((raw_y - self.y_min) * y_scale, 0.0), 1.0)))
+
+    def report(self, t_ns):
+        """Pass the contacts changed since the last SYN_REPORT to on_frame"""
+        touches = []
+        x_scale = 1.0 / ((self.x_max - self.x_min) or 1)
+        y_scale = 1.0 / ((self.y_max - self.y_min) or 1)
+        for contact in self.contacts:
+            if not (contact.down or contact.up or contact.moved):
+                continue
+            x, y = self.scale(contact.x, contact.y, x_scale, y_scale)
+            if contact.up:
+                touches.append((FINGERUP, contact.old_id, x, y, t_ns))
+            if contact.down:
+                touches.append((FINGERDOWN, contact.tracking_id, x, y, t_ns))
+            elif contact.moved and contact.tracking_id != -1:
+                touches.append((FINGERMOTION, contact.tracking_id, x, y, t_ns))
+            contact.down = contact.up = contact.moved = False
+        self.frames += 1
+        if touches:
+            self.on_frame(touches)
+        return
+
+    def run(self):
+        """Reader thread main loop"""
+        size = INPUT_EVENT.size
+        pending = b''
+        while True:
+            try:
+                data = os.read(self.fd, size * 64)
+            except OSError:
+                data = b''
+            if not data:
+                break
+            data = pending + data
+            end = len(data) - len(data) % size
+            for event in INPUT_EVENT.iter_unpack(data[:end]):
+                self.event(*event)
+            pending = data[end:]
+        os.close(self.fd)
+        if self.on_eof is not None:
+            self.on_eof()
@@ -0,0 +1,343 @@
+#!/usr/bin/python3
+"""
+Software stand-in for the NSGadget and DS4Gadget Trinket M0 firmware.
+
+GadgetEmulator listens on the master side of a pty pair. The gamepad
+classes open the slave, or a symlink to it, as their serial port. Frames
+are parsed, checked and decoded into GadgetState records with the time
+their last byte arrived.
+
+    STX (2), length, type, length - 1 bytes, ETX (3)
+
+    type 2  NSGadget, length 9:  buttons (H), dpad, left x, left y,
+            right x, right y, 0
+    type 3  DS4Gadget, length 11: report id 1, left x, left y, right x,
+            right y, dpad | buttons << 4, buttons >> 4, buttons >> 12,
+            left trigger, right trigger
+
+Frames byte for byte the same as the one before are counted as redundant.
+Bytes before an STX and frames with a wrong length, type or ETX are
+counted and skipped, the parser resynchronizes on the next STX.
+
+With a baud rate the emulator reads no faster than an 8N1 UART at that
+rate would deliver and time stamps each byte by that line clock. Unread
+bytes stay in the pty, which blocks the writer when full, like a real
+output buffer. A pty slave always reports out_waiting 0, so open_port()
+returns a port whose out_waiting is the emulator backlog instead, for
+queue monitor benchmarks. --capture writes the bytes read to a
+serialcapture.py capture file.
+
+python3 gadgetemu.py --link=/tmp/gadget --baud=115200 --capture=gadget.cap
+python3 pdtouch.py --port=/tmp/gadget
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import fcntl
+import getopt
+import pty
+import select
+import struct
+import sys
+import termios
+import threading
+import time
+import tty
+import serial
+
+STX = 2
+ETX = 3
+NS_TYPE = 2
+DS4_TYPE = 3
+# Length byte of each frame type
+FRAME_LENGTHS = {NS_TYPE: 9, DS4_TYPE: 11}
+NS_FRAME = struct.Struct('<BBBHBBBBBBB')
+DS4_FRAME = struct.Struct('<BBBBBBBBBBBBBB')
+
+class GadgetState:
+    """Decoded gamepad state of one frame"""
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    __slots__ = ('time_ns', 'console', 'buttons', 'dpad', 'left_x', 'left_y',
+                 'right_x', 'right_y', 'left_trigger', 'right_trigger')
+
+    def __init__(self, time_ns, console, buttons, dpad, axes, triggers=(0, 0)):
+        self.time_ns = time_ns
+        self.console = console
+        self.buttons = buttons
+        self.dpad = dpad
+        (self.left_x, self.left_y, self.right_x, self.right_y) = axes
+        (self.left_trigger, self.right_trigger) = triggers
+
+    def __repr__(self):
+        return ('GadgetState(%s buttons=%04x dpad=%d axes=%d,%d,%d,%d triggers=%d,%d)' %
+                (self.console, self.buttons, self.dpad, self.left_x, self.left_y,
+                 self.right_x, self.right_y, self.left_trigger, self.right_trigger))
+
+def decode(frame, time_ns):
+    """Decode one checked frame into a GadgetState"""
+    if frame[2] == NS_TYPE:
+        (_, _, _, buttons, dpad, left_x, left_y, right_x, right_y,
+         _, _) = NS_FRAME.unpack(frame)
+        return GadgetState(time_ns, 'switch', buttons, dpad,
+                           (left_x, left_y, right_x, right_y))
+    (_, _, _, _, left_x, left_y, right_x, right_y, low, middle, high,
+     left_trigger, right_trigger, _) = DS4_FRAME.unpack(frame)
+    return GadgetState(time_ns, 'ps4', (low >> 4) | (middle << 4) | (high << 12),
+                       low & 0x0f, (left_x, left_y, right_x, right_y),
+                       (left_trigger, right_trigger))
+
+class FrameParser:
+    """Split a byte stream into checked, decoded frames"""
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.bad_frames = 0
+        self.skipped_bytes = 0
+        # Frames byte for byte the same as the one before
+        self.redundant_frames = 0
+        self.last_frame = None
+
+    def feed(self, data, time_ns):
+        """
+        Add received bytes, return the GadgetState of each frame they
+        complete. time_ns is the arrival time of the last byte.
+        """
+        buffer = self.buffer
+        buffer += data
+        states = []
+        while buffer:
+            if buffer[0] != STX:
+                start = buffer.find(STX)
+                if start == -1:
+                    start = len(buffer)
+                self.skipped_bytes += start
+                del buffer[:start]
+                continue
+            if len(buffer) < 3:
+                break
+            length = buffer[1]
+            if FRAME_LENGTHS.get(buffer[2]) != length:
+                # Not a frame start, look for the next STX
+                self.bad_frames += 1
+                self.skipped_bytes += 1
+                del buffer[:1]
+                continue
+            size = length + 3
+            if len(buffer) < size:
+                break
+            if buffer[size - 1] != ETX or (buffer[2] == DS4_TYPE and buffer[3] != 1):
+                self.bad_frames += 1
+                self.skipped_bytes += 1
+                del buffer[:1]
+                continue
+            frame = bytes(buffer[:size])
+            if frame == self.last_frame:
+                self.redundant_frames += 1
+            self.last_frame = frame
+            states.append(decode(frame, time_ns))
+            self.frames += 1
+            del buffer[:size]
+        return states
+
+class GadgetEmulator:
+    """Pty stand-in for the gadget, reads and decodes frames in a thread"""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, baud=0, link=None, on_frame=None, keep=True, capture=None):
+        """
+        baud 0 reads as fast as frames come. link is a symlink made to the
+        pty slave. on_frame(state) is called from the reader thread for
+        each frame. keep keeps every GadgetState in states. capture is a
+        serialcapture.SerialCapture for the bytes read.
+        """
+        # pylint: disable=too-many-arguments
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        # Kept open so the master never sees a hang up between writers
+        self.slave_name = os.ttyname(self.slave)
+        self.link = link
+        if link is not None:
+            if os.path.lexists(link):
+                os.unlink(link)
+            os.symlink(self.slave_name, link)
+        self.baud = baud
+        # 8N1: 10 bits on the line per byte
+        self.byte_ns = 10 * 1000000000 // baud if baud else 0
+        self.on_frame = on_frame
+        self.keep = keep
+        self.capture = capture
+        self.parser = FrameParser()
+        self.states = []
+        self.state = None
+        self.bytes_received = 0
+        self.max_backlog = 0
+        # Line clock: when the last byte read finished arriving
+        self.line_ns = 0
+        self.running = False
+        self.thread = None
+
+    @property
+    def path(self):
+        """The name to open: the link if there is one, else the pty slave"""
+        return self.link if self.link is not None else self.slave_name
+
+    def start(self):
+        """Start the reader thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='GadgetEmulator',
+                                       daemon=True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        """Stop the reader thread and close the pty"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master)
+        os.close(self.slave)
+        if self.link is not None and os.path.islink(self.link):
+            os.unlink(self.link)
+        return
+
+    def backlog(self):
+        """Bytes written to the pty but not read yet by the emulated UART"""
+        count = bytearray(4)
+        fcntl.ioctl(self.master, termios.FIONREAD, count)
+        return struct.unpack('@i', count)[0]
+
+    def open_port(self):
+        """A pyserial port on the pty slave whose out_waiting is the backlog"""
+        port = EmulatorPort(self.slave_name, 2000000, timeout=0)
+        port.emulator = self
+        return port
+
+    def stats(self):
+        """Return the emulator counters as a dict"""
+        return {'bytes': self.bytes_received,
+                'frames': self.parser.frames,
+                'bad_frames': self.parser.bad_frames,
+                'redundant_frames': self.parser.redundant_frames,
+                'skipped_bytes': self.parser.skipped_bytes,
+                'max_backlog': self.max_backlog}
+
+    def run(self):
+        """Reader thread main loop"""
+        # Read about 1 ms of line time at once
+        chunk = max(16, self.baud // 10000) if self.baud else 4096
+        while self.running:
+            if not select.select([self.master], [], [], 0.05)[0]:
+                continue
+            busy = False
+            if self.baud:
+                backlog = self.backlog()
+                if backlog > self.max_backlog:
+                    self.max_backlog = backlog
+                # Bytes already waiting when the last chunk ended follow it
+                # back to back, sleeping late does not idle the line
+                busy = backlog and time.monotonic_ns() - self.line_ns < 1000000
+            try:
+                data = os.read(self.master, chunk)
+            except OSError:
+                continue
+            now_ns = time.monotonic_ns()
+            self.bytes_received += len(data)
+            if not self.baud:
+                self.received(data, now_ns)
+                continue
+            # Bytes arrive one byte time apart once the line is busy
+            offset = 0
+            while offset < len(data):
+                start_ns = self.line_ns if busy else max(self.line_ns, now_ns)
+                busy = True
+                # Up to the end of the next frame, so it gets its own time
+                end = data.find(ETX, offset) + 1 or len(data)
+                self.line_ns = start_ns + (end - offset) * self.byte_ns
+                self.received(data[offset:end], self.line_ns)
+                offset = end
+            delay_ns = self.line_ns - time.monotonic_ns()
+            if delay_ns > 0:
+                time.sleep(delay_ns / 1e9)
+
+    def received(self, data, time_ns):
+        """Parse bytes that arrived by time_ns"""
+        if self.capture is not None:
+            self.capture.record(data, time_ns)
+        for state in self.parser.feed(data, time_ns):
+            self.state = state
+            if self.keep:
+                self.states.append(state)
+            if self.on_frame is not None:
+                self.on_frame(state)
+        return
+
+class EmulatorPort(serial.Serial):
+    """pyserial port on the emulator pty, out_waiting is the emulator backlog"""
+    emulator = None
+
+    @property
+    def out_waiting(self):
+        return self.emulator.backlog()
+
+def main():
+    """ Run an emulator, print each frame or once a second a summary """
+    baud = 0
+    link = None
+    quiet = False
+    capture_path = None
+    opts, _ = getopt.getopt(sys.argv[1:], 'hq', ['help', 'baud=', 'link=', 'quiet',
+                                                 'capture='])
+    for o, a in opts:
+        if o in ('-h', '--help'):
+            print(__doc__.split('MIT License')[0].strip())
+            return
+        if o == '--baud':
+            baud = int(a)
+        elif o == '--link':
+            link = a
+        elif o in ('-q', '--quiet'):
+            quiet = True
+        elif o == '--capture':
+            capture_path = a
+    capture = None
+    if capture_path is not None:
+        from serialcapture import SerialCapture
+        capture = SerialCapture(capture_path, baud, 'gadget')
+    emulator = GadgetEmulator(baud, link, None if quiet else print, keep=False,
+                              capture=capture)
+    emulator.start()
+    print('Gadget on', emulator.path, 'baud', baud or 'unlimited', flush=True)
+    try:
+        while True:
+            time.sleep(1)
+            if quiet:
+                print(emulator.stats(), emulator.state, flush=True)
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+    if capture is not None:
+        capture.close()
+
+if __name__ == "__main__":
+    main()
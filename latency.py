@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+"""
+Touch to serial report latency measurement.
+
+The event loop marks each touch with its start time and the touch area it
+hit. The gamepad serial class takes the pending marks when it sends a report
+and records the time from each mark until ser_port.write returned. Times are
+kept per area in fixed bucket histograms so recording never allocates.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import array
+import time
+
+class LatencyHistogram:
+    """Fixed bucket histogram of nanosecond durations"""
+    def __init__(self, bucket_ns=10000, buckets=10000):
+        # Default 10 us buckets up to 100 ms, longer times go in the last one
+        self.bucket_ns = bucket_ns
+        self.counts = array.array('L', [0]) * buckets
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, duration_ns):
+        """Record one duration"""
+        bucket = duration_ns // self.bucket_ns
+        if bucket >= len(self.counts):
+            bucket = len(self.counts) - 1
+        elif bucket < 0:
+            bucket = 0
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        return
+
+    def percentile(self, percent):
+        """Return the upper edge in ns of the bucket holding percent"""
+        if self.count == 0:
+            return 0
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return min((bucket + 1) * self.bucket_ns, self.max_ns)
+        return self.max_ns
+
+    def clear(self):
+        """Forget all recorded durations"""
+        self.counts[:] = array.array('L', [0]) * len(self.counts)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        return
+
+class LatencyRecorder:
+    """Per touch area touch to report latency"""
+    def __init__(self, area_names):
+        self.histograms = {}
+        for name in area_names:
+            self.histograms[name] = LatencyHistogram()
+        self.marks = []
+
+    def mark(self, area_name, start_ns):
+        """A touch on area_name started at time.monotonic_ns() start_ns"""
+        self.marks.append((area_name, start_ns))
+        return
+
+    def take(self):
+        """
+        Return and clear the pending marks. Called by the gamepad with its
+        thread_lock held when it sends a report.
+        """
+        marks = self.marks
+        self.marks = []
+        return marks
+
+    def discard(self):
+        """Drop marks for touches that did not change the report"""
+        if self.marks:
+            self.marks = []
+        return
+
+    def record(self, marks, done_ns):
+        """The report for marks finished writing at done_ns"""
+        for area_name, start_ns in marks:
+            self.histograms[area_name].add(done_ns - start_ns)
+        return
+
+    def report(self):
+        """Return the latency summary as text"""
+        lines = ['%-16s %8s %9s %9s %9s %9s' %
+                 ('area', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')]
+        for name, histogram in self.histograms.items():
+            lines.append('%-16s %8d %9.3f %9.3f %9.3f %9.3f' %
+                         (name, histogram.count,
+                          histogram.percentile(50) / 1e6,
+                          histogram.percentile(95) / 1e6,
+                          histogram.percentile(99) / 1e6,
+                          histogram.max_ns / 1e6))
+        return '\n'.join(lines)
+
+def now_ns():
+    """Clock used for all latency time stamps"""
+    return time.monotonic_ns()
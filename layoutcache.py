@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+"""
+On-disk cache of the rendered pdtouch.py layout.
+
+One file holds the fully drawn screen and the idle and pressed sprites of
+every cell, zlib compressed. It is named by a hash of everything the
+drawing depends on: display size and depth, console, layout, the cell
+properties, the asset files and the pygame version. A startup with a
+cached layout reads one file instead of loading fonts and pictures and
+rendering every cell.
+
+File: HEADER, then zlib compressed
+    background      width * height RGB bytes
+    per touch area  cell count (H)
+    per cell        sprite count (B)
+    per sprite      x (H), y (H), width (H), height (H), color (BBB),
+                    in background (B), RGB bytes if not in background
+
+A sprite identical to the background at its cell, usually the idle one,
+is not stored again but cut from the background when loaded.
+
+Hashing the asset files means reading all of them. The hash is kept in
+assets.hash in the cache directory with the names, sizes and modification
+times it was made for, and only made again when one of those changes.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import hashlib
+import zlib
+import struct
+from struct import Struct
+import pygame
+
+MAGIC = b'PDLAYC01'
+# Bump when the drawing code changes what ends up on the screen
+VERSION = 2
+# magic, width, height
+HEADER = Struct('<8sHH')
+COUNT = Struct('<H')
+SPRITE = Struct('<HHHHBBBB')
+
+def default_dir():
+    """$XDG_CACHE_HOME/pdtouch or ~/.cache/pdtouch"""
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                        os.path.expanduser('~/.cache'), 'pdtouch')
+
+def asset_hash(asset_dir, cache_dir):
+    """
+    Return the hex hash of the asset files, from assets.hash in cache_dir
+    if their names, sizes and modification times are unchanged
+    """
+    names = sorted(os.listdir(asset_dir))
+    stats = []
+    for name in names:
+        stat = os.stat(os.path.join(asset_dir, name))
+        stats.append((name, stat.st_size, stat.st_mtime_ns))
+    stat_key = hashlib.sha1(repr(stats).encode()).hexdigest()
+    memo_path = os.path.join(cache_dir, 'assets.hash')
+    try:
+        with open(memo_path) as memo:
+            memo_key, content_key = memo.read().split()
+        if memo_key == stat_key:
+            return content_key
+    except (OSError, ValueError):
+        pass
+    key = hashlib.sha1()
+    for name in names:
+        key.update(name.encode())
+        with open(os.path.join(asset_dir, name), 'rb') as asset:
+            key.update(asset.read())
+    content_key = key.hexdigest()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = memo_path + '.tmp'
+        with open(temp_path, 'w') as memo:
+            memo.write('%s %s\n' % (stat_key, content_key))
+        os.replace(temp_path, memo_path)
+    except OSError:
+        # Read only cache directory, hash the files every time
+        pass
+    return content_key
+
+def cache_key(size, depth, names, properties, asset_dir, cache_dir):
+    """
+    Return the hex hash naming the cache file. names are strings such as
+    the console and layout. properties are the cell property lists, their
+    repr is hashed.
+    """
+    key = hashlib.sha1()
+    key.update(repr((VERSION, pygame.version.ver, tuple(size), depth,
+                     tuple(names), properties)).encode())
+    key.update(asset_hash(asset_dir, cache_dir).encode())
+    return key.hexdigest()
+
+def save(path, background, touch_areas):
+    """Write the background surface and the sprites of every cell"""
+    width, height = background.get_size()
+    chunks = [pygame.image.tobytes(background, 'RGB')]
+    for touch_area in touch_areas:
+        chunks.append(COUNT.pack(len(touch_area.cells)))
+        for cell in touch_area.cells:
+            sprites = cell.sprites or {}
+            chunks.append(bytes((len(sprites),)))
+            rect = cell.rect
+            for color, sprite in sprites.items():
+                pixels = pygame.image.tobytes(sprite, 'RGB')
+                in_background = (sprite.get_size() == rect.size and
+                                 background.get_rect().contains(rect) and
+                                 pixels == pygame.image.tobytes(background.subsurface(rect), 'RGB'))
+                chunks.append(SPRITE.pack(rect.x, rect.y, sprite.get_width(),
+                                          sprite.get_height(), *color[:3], in_background))
+                if not in_background:
+                    chunks.append(pixels)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as cache_file:
+        cache_file.write(HEADER.pack(MAGIC, width, height))
+        cache_file.write(zlib.compress(b''.join(chunks), 1))
+    os.replace(temp_path, path)
+
+def load(path, size):
+    """
+    Return (background, sprites) or None if there is no usable cache file.
+    sprites has a list per touch area of a {color: surface} dict per cell.
+    Surfaces are converted to the display format.
+    """
+    try:
+        with open(path, 'rb') as cache_file:
+            data = cache_file.read()
+        magic, width, height = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or (width, height) != tuple(size):
+            return None
+        return parse(memoryview(zlib.decompress(data[HEADER.size:])), width, height)
+    except (OSError, zlib.error, ValueError, struct.error, IndexError, pygame.error):
+        # Missing, cut short or corrupt, render the layout again
+        return None
+
+def parse(body, width, height):
+    """Return (background, sprites) from the decompressed body of a cache file"""
+    offset = width * height * 3
+    if len(body) < offset:
+        raise ValueError('background cut short')
+    background = pygame.image.frombuffer(body[:offset], (width, height), 'RGB').convert()
+    sprites = []
+    while offset < len(body):
+        num_cells, = COUNT.unpack_from(body, offset)
+        offset += COUNT.size
+        cells = []
+        for _ in range(num_cells):
+            num_sprites = body[offset]
+            offset += 1
+            cell_sprites = {}
+            for _ in range(num_sprites):
+                (x, y, sprite_width, sprite_height, red, green, blue,
+                 in_background) = SPRITE.unpack_from(body, offset)
+                offset += SPRITE.size
+                if in_background:
+                    sprite = background.subsurface((x, y, sprite_width, sprite_height))
+                else:
+                    end = offset + sprite_width * sprite_height * 3
+                    if len(body) < end:
+                        raise ValueError('sprite cut short')
+                    sprite = pygame.image.frombuffer(
+                        body[offset:end], (sprite_width, sprite_height), 'RGB').convert()
+                    offset = end
+                cell_sprites[(red, green, blue)] = sprite
+            cells.append(cell_sprites)
+        sprites.append(cells)
+    return (background, sprites)
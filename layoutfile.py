@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+"""
+Declarative pdtouch.py layouts.
+
+A layout is a JSON file in layouts/ listing touch areas in hit-test order,
+the first area wins where areas overlap. Each area has a type (SlideBar,
+BigButtons or GamepadButtons), its edges as expressions of the screen
+width w and height h, for example "h-w/4-1", rows, columns, gridlines, an
+idle color, a font size and its cells. cells is a list, or a dict of lists
+by console. A cell may have a label, a color, a picture in assets/ and a
+button: a console button name such as "X" or "L2", or DPAD_UP, DPAD_DOWN,
+DPAD_LEFT or DPAD_RIGHT.
+
+A layout is compiled for one console, screen size and hit-test resolution
+into flat tables: area records, per cell arrays of rects, centers, button
+codes and colors, and the hit-test table. Compiled layouts are cached in
+a compiled/ directory next to the layout file.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import ast
+import array
+import hashlib
+import json
+import operator
+import pickle
+import pygame
+from touchareas import HitMap
+
+LAYOUT_DIR = 'layouts'
+DEFAULT_LAYOUT = 'diva'
+# Bump when compile_layout output changes
+VERSION = 2
+
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+def evaluate(expression, names):
+    """Value of a number or an expression of + - * / numbers and names"""
+    if isinstance(expression, (int, float)):
+        return expression
+    def value(node):
+        if isinstance(node, ast.Expression):
+            return value(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.Name) and node.id in names:
+            return names[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](value(node.left), value(node.right))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -value(node.operand)
+        raise ValueError('bad layout expression %r' % expression)
+    return value(ast.parse(expression, mode='eval'))
+
+def layout_path(name):
+    """A layout name such as diva is layouts/diva.json, a path is used as is"""
+    if os.sep in name or name.endswith('.json'):
+        return name
+    return os.path.join(LAYOUT_DIR, name + '.json')
+
+class CompiledLayout:
+    """Flat tables of one layout for one console and screen size"""
+    # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    def __init__(self, key, width, height, shift):
+        self.key = key
+        self.width = width
+        self.height = height
+        self.shift = shift
+        # One dict per area: type, topLeft, bottomRight, rows, columns,
+        # gridlines, bgcolor, font, first cell, cell count
+        self.areas = []
+        # Per cell, cell n is at [n], [2n] or [4n]. Cell ids in the
+        # hit-test table are n + 1.
+        self.rects = array.array('H')
+        # Text centers as TouchAreas.draw() had them, fractional for
+        # fractional area edges
+        self.centers = array.array('d')
+        self.buttons = array.array('h')
+        self.colors = array.array('B')
+        self.labels = []
+        self.pictures = []
+        self.hit_table = None
+
+    def properties(self, area):
+        """TouchAreas cell properties for an area, used when drawing"""
+        props = []
+        for cell in range(area['first'], area['first'] + area['count']):
+            cell_props = {'buttonColor': list(self.colors[cell*3:cell*3+3]),
+                          'rect': tuple(self.rects[cell*4:cell*4+4]),
+                          'center': tuple(self.centers[cell*2:cell*2+2])}
+            if self.labels[cell] is not None:
+                cell_props['label'] = self.labels[cell]
+            if self.pictures[cell] is not None:
+                cell_props['picture'] = self.pictures[cell]
+            if self.buttons[cell] != -1:
+                cell_props['button'] = self.buttons[cell]
+            props.append(cell_props)
+        return props
+
+def button_code(name, buttons, dpad_buttons):
+    """Button code of a layout button name"""
+    if name.startswith('DPAD_'):
+        return int(dpad_buttons[name[5:]])
+    return int(buttons[name])
+
+def compile_layout(source, key, console, buttons, dpad_buttons, size, shift):
+    """
+    Compile a parsed layout file. buttons and dpad_buttons are the console
+    button and DPadButton enums.
+    """
+    # pylint: disable=too-many-locals,too-many-arguments
+    width, height = size
+    names = {'w': width, 'h': height}
+    layout = CompiledLayout(key, width, height, shift)
+    hitmap = HitMap(width, height, shift)
+    for spec in source['areas']:
+        topLeft = [evaluate(spec['left'], names), evaluate(spec['top'], names)]
+        bottomRight = [evaluate(spec['right'], names), evaluate(spec['bottom'], names)]
+        rows = spec.get('rows', 1)
+        columns = spec.get('columns', 1)
+        bgcolor = tuple(spec.get('color', (128, 128, 128)))
+        cells = spec.get('cells', [])
+        if isinstance(cells, dict):
+            cells = cells.get(console, [])
+        # Same geometry as TouchAreas.draw()
+        cell_width = (bottomRight[0] - topLeft[0]) / columns
+        cell_height = (bottomRight[1] - topLeft[1]) / rows
+        first = len(layout.buttons)
+        for index in range(rows * columns):
+            y, x = divmod(index, columns)
+            rect = pygame.Rect(topLeft[0] + x*cell_width, topLeft[1] + y*cell_height,
+                               cell_width, cell_height)
+            layout.rects.extend(rect)
+            layout.centers.extend((topLeft[0] + int(x * cell_width + cell_width/2),
+                                   topLeft[1] + int(y * cell_height + cell_height/2)))
+            props = cells[index] if index < len(cells) else {}
+            button = props.get('button')
+            layout.buttons.append(-1 if button is None else
+                                  button_code(button, buttons, dpad_buttons))
+            layout.colors.extend(props.get('color', bgcolor))
+            layout.labels.append(props.get('label'))
+            layout.pictures.append(props.get('picture'))
+        count = len(layout.buttons) - first
+        layout.areas.append({
+            'type': spec['type'], 'topLeft': topLeft, 'bottomRight': bottomRight,
+            'rows': rows, 'columns': columns, 'gridlines': spec.get('gridlines', False),
+            'bgcolor': bgcolor, 'font': spec.get('font', 36),
+            'first': first, 'count': count})
+        hitmap.addGrid(topLeft, bottomRight, rows, columns,
+                       list(range(first + 1, first + count + 1)))
+    hitmap.build()
+    layout.hit_table = hitmap.table
+    return layout
+
+def load(name, console, buttons, dpad_buttons, size, shift):
+    """
+    Return the CompiledLayout for a layout name or path, from the compiled
+    cache next to the layout file if it is there.
+    """
+    # pylint: disable=too-many-arguments
+    path = layout_path(name)
+    with open(path, 'rb') as layout_file:
+        text = layout_file.read()
+    key = hashlib.sha1(repr((VERSION, text, console, tuple(size), shift)).encode()).hexdigest()
+    compiled_path = os.path.join(os.path.dirname(path) or '.', 'compiled',
+                                 '%s.%s.pickle' % (os.path.splitext(os.path.basename(path))[0], key[:16]))
+    try:
+        with open(compiled_path, 'rb') as compiled_file:
+            layout = pickle.load(compiled_file)
+        if isinstance(layout, CompiledLayout) and layout.key == key:
+            return layout
+    except Exception:    # pylint: disable=broad-except
+        # Missing, stale or damaged, unpickling garbage can raise almost
+        # anything. Compile it again.
+        pass
+    layout = compile_layout(json.loads(text), key, console, buttons, dpad_buttons, size, shift)
+    try:
+        os.makedirs(os.path.dirname(compiled_path), exist_ok=True)
+        temp_path = compiled_path + '.tmp'
+        with open(temp_path, 'wb') as compiled_file:
+            pickle.dump(layout, compiled_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, compiled_path)
+    except OSError:
+        # Read only layout directory, compile every time
+        pass
+    return layout
@@ -30,88 +30,382 @@ SOFTWARE.
 """
 
 import sys
+import array
 import getopt
+import multiprocessing
 import os
+import signal
+import stat
+import threading
+import time
 import pygame
 from pygame.locals import *
-import serial
-from touchareas import TouchAreas
-from ds4gpadserial import DS4GamepadSerial, DS4Button, DPadButton
-from nsgpadserial import NSGamepadSerial, NSButton
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], "hslc", ["help", "slider=", "layout=", "console="])
-except getopt.GetoptError as err:
-    print(err)
-    #usage()
-    sys.exit(2)
-layout = 2
+from touchareas import TouchAreas, HitMap
+import layoutcache
+import layoutfile
+from slidehands import find_hands
+from ringlog import RingLog, LEVEL_NAMES, WARNING
+from latency import LatencyRecorder, now_ns
+from queuemonitor import QueueMonitor
+from sharedcells import SharedCells
+import touchrecord
+from touchrecord import SessionRecorder, RecordingPort, CapturePort, Session, \
+        diff_reports, REPORT_TYPE, BURST
+
+# Nothing is opened, initialized or drawn at import time. main() calls
+# setup() which parses the options, opens the serial port, the display and
+# the touch input it needs, then run(). The console backend, pyserial and
+# evdevtouch are imported only when used.
+
+# Command line options, see parse_options()
+layout = layoutfile.DEFAULT_LAYOUT
 slider = "dedicated"
 console = "switch"
-for o, a in opts:
-    if o in ("-h", "--help"):
+serial_thread = False
+keepalive_ms = None
+hitmap_shift = 0
+log_level = WARNING
+latency_report = False
+port_url = None
+record_path = None
+capture_path = None
+replay_path = None
+replay_fast = False
+merge_rects = False
+feedback = True
+fps = 0
+poll_ms = 0
+busy_poll = False
+evdev_path = None
+evdev_max = None
+startup_timing = False
+layout_cache = True
+layout_cache_dir = None
+queue_limit = None
+pace_ms = 0.0
+pace_immediate = True
+pace_spin_us = 0
+render_process = False
+
+# Set up by setup()
+LOG = None
+Gamepad = None
+DPadButton = None
+NS_SERIAL = None
+CONNECTION = None
+RECORDER = None
+CAPTURE = None
+LATENCY = None
+QUEUE = None
+PACER = None
+EVDEV = None
+# --render-process: the display process and the press counts shared with it
+RENDER = None
+SHARED = None
+DISPLAYSURF = None
+# The screen with every cell idle, for full redraws
+BACKGROUND = None
+screen_width = screen_height = 0
+screen_width_max = screen_height_max = 0
+sdl_epoch_ns = 0
+LAYOUT = None
+touch_areas = []
+gamepad_buttons = None
+Slider = None
+Buttons = None
+hitmap = None
+frame_ns = 0
+
+# Cell id under each finger, up to 10 touches/fingers
+fingers = {}
+
+# Posted by the evdev reader thread when it has queued cells to draw
+EVDEV_DRAW = pygame.USEREVENT
+evdev_draw_posted = False
+# Set instead with --render-process, there is no event queue to post to
+RENDER_WAKE = threading.Event()
+# Render process poll interval when --fps is not given
+RENDER_POLL_MS = 1
+
+# (stage, time ns) marks for --startup-timing
+startup_marks = []
+
+def parse_options(argv):
+    """ Set the option globals from the command line """
+    global layout, slider, console, serial_thread, keepalive_ms, hitmap_shift
+    global log_level, latency_report, port_url, record_path, capture_path, replay_path
+    global replay_fast, merge_rects, feedback, fps, poll_ms, busy_poll
+    global evdev_path, evdev_max, startup_timing, layout_cache, layout_cache_dir
+    global queue_limit, pace_ms, pace_immediate, pace_spin_us, render_process
+    try:
+        opts, args = getopt.getopt(argv, "hslc", ["help", "slider=", "layout=", "console=", "serial-thread", "suppress-duplicates=", "hitmap-shift=", "log-level=", "latency-report", "port=", "record=", "capture=", "replay=", "replay-fast", "merge-rects", "no-feedback", "fps=", "poll-ms=", "busy-poll", "evdev=", "evdev-max=", "startup-timing", "layout-cache=", "no-layout-cache", "queue-limit=", "pace-ms=", "pace-on-tick", "pace-spin-us=", "render-process"])
+    except getopt.GetoptError as err:
+        print(err)
+        #usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            #usage()
+            sys.exit()
+        elif o in ("-s","--slider"):
+            if a in ("n", "normal"):
+                slider = "normal"
+            elif a in ("d", "dedicated"):
+                slider = "dedicated"
+        elif o in ("-c","--console"):
+            if a in ("p", "ps4"):
+                console = "ps4"
+        elif o in ("-l","--layout"):
+            # Layout name in layouts/ or path of a layout file. The old
+            # numbered layouts are all the default layout.
+            if a not in ("2", "3"):
+                layout = a
+        elif o == "--serial-thread":
+            serial_thread = True
+        elif o == "--suppress-duplicates":
+            # Skip unchanged reports but resend the state every this many
+            # ms even if nothing changed, 0 = never
+            keepalive_ms = int(a)
+        elif o == "--hitmap-shift":
+            # Hit-test table resolution is 1 / (1 << hitmap_shift) of the
+            # screen, default 0 is exact. 1 or more trades accuracy on cell
+            # edges for a smaller table.
+            hitmap_shift = int(a)
+        elif o == "--log-level":
+            # debug, info, warning, error or off
+            if a not in LEVEL_NAMES:
+                print("--log-level must be one of", ", ".join(LEVEL_NAMES))
+                sys.exit(2)
+            log_level = LEVEL_NAMES[a]
+        elif o == "--latency-report":
+            latency_report = True
+        elif o == "--port":
+            # Serial devices or pyserial URLs such as loop:// for testing,
+            # comma separated, the first one that opens is used
+            port_url = a
+        elif o == "--record":
+            # Record touches and reports to a session file
+            record_path = a
+        elif o == "--capture":
+            # Write the raw serial bytes to a capture file for serialcapture.py
+            capture_path = a
+        elif o == "--replay":
+            # Replay a session file instead of reading the touchscreen
+            replay_path = a
+        elif o == "--replay-fast":
+            # Replay without waiting for the recorded times
+            replay_fast = True
+        elif o == "--merge-rects":
+            # Combine overlapping cell rects before updating the screen
+            merge_rects = True
+        elif o == "--no-feedback":
+            # Draw the layout once but do not show touches
+            feedback = False
+        elif o == "--fps":
+            # Cap touch feedback drawing at this many frames/sec, 0 = no cap
+            fps = int(a)
+        elif o == "--poll-ms":
+            # Keep polling this long after the last event before blocking
+            poll_ms = int(a)
+        elif o == "--busy-poll":
+            # Never block waiting for events, uses a whole CPU core
+            busy_poll = True
+        elif o == "--evdev":
+            # Read touches from this /dev/input/event* node instead of SDL
+            evdev_path = a
+        elif o == "--evdev-max":
+            # Panel X,Y maximum if it cannot be read from the device
+            evdev_max = tuple(int(v) for v in a.split(','))
+        elif o == "--startup-timing":
+            # Print how long it took to send the first report and draw the screen
+            startup_timing = True
+        elif o == "--layout-cache":
+            # Directory for rendered layout cache files
+            layout_cache_dir = a
+        elif o == "--no-layout-cache":
+            # Always render the layout, do not read or write the cache
+            layout_cache = False
+        elif o == "--queue-limit":
+            # Hold back reports while more bytes wait in the serial output buffer
+            queue_limit = int(a)
+        elif o == "--pace-ms":
+            # Send reports on a fixed schedule, off by default. Use 1, the
+            # fastest gadget USB poll interval. Each tap, a change undone
+            # before it was sent, takes a tick of its own so the gadget
+            # sees it, and newer states wait behind up to 4 of them: with
+            # 8, bench/pacing.py has a p99 touch latency of 40 ms, 2 ms
+            # with 1.
+            pace_ms = float(a)
+        elif o == "--pace-on-tick":
+            # A press after idle waits for the next tick instead of going
+            # out at once
+            pace_immediate = False
+        elif o == "--pace-spin-us":
+            # Busy wait this long before each tick for less tick error
+            pace_spin_us = int(a)
+        elif o == "--render-process":
+            # Draw the screen in a second process so drawing never holds
+            # up touch handling and serial reports
+            render_process = True
+        else:
+            assert False, "unhandled option"
+    if render_process and (evdev_path is None or replay_path is not None):
+        # SDL only gives touches to the process that owns the window
+        print("--render-process needs --evdev touch input and cannot --replay")
+        sys.exit(2)
+    print("console=", console, "slider=", slider)
+
+def startup_mark(stage):
+    """ Note the time a startup stage finished """
+    startup_marks.append((stage, now_ns()))
+
+def process_age_ms():
+    """ ms since this process started, None if unknown """
+    try:
+        with open('/proc/self/stat') as stat_file:
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        start_ns = int(fields[19]) * 1000000000 // os.sysconf('SC_CLK_TCK')
+        return (time.clock_gettime_ns(time.CLOCK_BOOTTIME) - start_ns) / 1e6
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def startup_report(main_ns, age_ms):
+    """ Return the --startup-timing report as text """
+    lines = []
+    if age_ms is not None:
+        lines.append('process start to main() %9.1f ms' % age_ms)
+    for stage, t_ns in startup_marks:
+        lines.append('%-23s %9.1f ms' % (stage, (t_ns - main_ns) / 1e6))
+    return '\n'.join(lines)
+
+def open_gamepad():
+    """
+    Import the console backend, open the serial port and send the first,
+    neutral report.
+    """
+    global Gamepad, DPadButton, NS_SERIAL, CONNECTION, RECORDER, CAPTURE, LATENCY, QUEUE
+    global PACER
+    global serial_thread, pace_ms
+    if console == "ps4":
+        from ds4gpadserial import DS4GamepadSerial
+        from ds4gpadserial import DPadButton as dpad_button
+        Gamepad = DS4GamepadSerial()
+    elif console == "switch":
+        from nsgpadserial import NSGamepadSerial
+        from nsgpadserial import DPadButton as dpad_button
+        Gamepad = NSGamepadSerial()
+    else:
         #usage()
         sys.exit()
-    elif o in ("-s","--slider"):
-        if a in ("n", "normal"):
-            slider = "normal"
-        elif a in ("d", "dedicated"):
-            slider = "dedicated"
-    elif o in ("-c","--console"):
-        if a in ("p", "ps4"):
-            console = "ps4"
-    elif o in ("-l","--layout"):
-        if a == "3":
-            layout = 3
+    DPadButton = dpad_button
+
+    CONNECTION = None
+    if replay_path is not None:
+        # Reports are compared with the recording, not sent
+        NS_SERIAL = CapturePort()
+        serial_thread = False
+        pace_ms = 0.0
     else:
-        assert False, "unhandled option"
-print("console=", console, "slider=", slider)
-
-if console == "ps4":
-    Gamepad = DS4GamepadSerial()
-elif console == "switch":
-    Gamepad = NSGamepadSerial()
-else:
-    #usage()
-    sys.exit()
-
-try:
-    # Raspberry Pi UART on pins 14,15
-    NS_SERIAL = serial.Serial('/dev/ttyAMA0', 2000000, timeout=0)
-    print("Found ttyAMA0")
-except:
-    try:
-        # CP210x is capable of 2,000,000 bits/sec
-        NS_SERIAL = serial.Serial('/dev/ttyUSB0', 2000000, timeout=0)
-        print("Found ttyUSB0")
-    except:
-        print("Gadget serial port not found")
-        sys.exit(1)
-Gamepad.begin(NS_SERIAL)
+        from serialconnection import SerialConnection
+        if port_url is not None:
+            candidates = port_url.split(',')
+        else:
+            # Raspberry Pi UART on pins 14,15, then a CP210x USB serial
+            # adapter, both capable of 2,000,000 bits/sec
+            candidates = ['/dev/ttyAMA0', '/dev/ttyUSB0']
+        # Opened once here, reopened by a background thread if it goes away.
+        # Writes from the input handling thread must never wait.
+        threaded = serial_thread or pace_ms > 0
+        CONNECTION = SerialConnection(candidates, 2000000,
+                                      write_timeout=0.1 if threaded else 0)
+        if CONNECTION.connect():
+            print("Found", CONNECTION.name)
+        else:
+            print("Gadget serial port not found, looking for", ", ".join(candidates))
+        NS_SERIAL = CONNECTION
+    if capture_path is not None:
+        from serialcapture import SerialCapture, CaptureTee
+        CAPTURE = SerialCapture(capture_path, 2000000)
+        if CONNECTION is not None:
+            # Below the connection, so the end of a report the port took
+            # only part of is recorded when it is written
+            CONNECTION.capture = CAPTURE
+        else:
+            NS_SERIAL = CaptureTee(NS_SERIAL, CAPTURE)
+    else:
+        CAPTURE = None
+    if record_path is not None:
+        RECORDER = SessionRecorder(record_path, console, slider)
+        NS_SERIAL = RecordingPort(NS_SERIAL, RECORDER)
+    else:
+        RECORDER = None
+    if keepalive_ms is not None:
+        Gamepad.suppressDuplicates(True, keepalive_ms / 1000.0)
+    if queue_limit is not None:
+        QUEUE = QueueMonitor(queue_limit)
+        Gamepad.queue_monitor = QUEUE
+    else:
+        QUEUE = None
+    Gamepad.begin(NS_SERIAL, threaded=serial_thread, pace=pace_ms / 1000.0,
+                  pace_immediate=pace_immediate, pace_spin=pace_spin_us / 1e6)
+    PACER = Gamepad.writer if pace_ms > 0 else None
+    if CONNECTION is not None:
+        CONNECTION.start(serial_connected)
 
-if not pygame.font:
-    print("Warning, fonts disabled")
+    # Touch to serial report latency per touch area
+    if latency_report:
+        LATENCY = LatencyRecorder(('SlideBar', 'BigButtons', 'GamepadButtons'))
+        Gamepad.latency = LATENCY
+    else:
+        LATENCY = None
+    if LATENCY is not None or QUEUE is not None or PACER is not None:
+        signal.signal(signal.SIGUSR1, lambda signum, frame: print_stats())
 
-pygame.init()
+def serial_connected(name):
+    """ Called by the connection thread: the gadget is back, send it everything """
+    print("Found", name)
+    Gamepad.resend()
 
-#Create a display surface object
-DISPLAYSURF = pygame.display.set_mode((0, 0), pygame.FULLSCREEN | pygame.HWSURFACE | pygame.DOUBLEBUF)
-(screen_width, screen_height) = DISPLAYSURF.get_size()
-screen_width_max = screen_width - 1     # Max pixel co-ord
-screen_height_max = screen_height -1    # Max pixel co-ord
-pygame.mouse.set_visible(False)
-if pygame.font:
-    fontDefault = pygame.font.Font(None, 504)
-    fontSlider = pygame.font.Font(None, 120)
-    fontGamepadButton = pygame.font.Font(None, 36)
+def print_stats():
+    """ Print the latency, serial queue and pacing counters that are enabled """
+    if LATENCY is not None:
+        print(LATENCY.report())
+    if QUEUE is not None:
+        with Gamepad.thread_lock:
+            print(QUEUE.report())
+    if PACER is not None:
+        print(PACER.report())
+
+def open_display():
+    """ Start only the SDL video and font modules and set the display mode """
+    global DISPLAYSURF, screen_width, screen_height, screen_width_max, screen_height_max
+    global sdl_epoch_ns
+    pygame.display.init()
+    # Only queue the events the event loop handles
+    pygame.event.set_blocked(None)
+    if evdev_path is None:
+        pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.VIDEOEXPOSE,
+                                  pygame.FINGERDOWN, pygame.FINGERUP, pygame.FINGERMOTION])
+    else:
+        # Touches bypass SDL
+        pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.VIDEOEXPOSE, EVDEV_DRAW])
+    # SDL event time stamps are ms since SDL init
+    sdl_epoch_ns = now_ns() - pygame.time.get_ticks() * 1000000
+
+    #Create a display surface object
+    DISPLAYSURF = pygame.display.set_mode((0, 0), pygame.FULLSCREEN | pygame.HWSURFACE | pygame.DOUBLEBUF)
+    (screen_width, screen_height) = DISPLAYSURF.get_size()
+    screen_width_max = screen_width - 1     # Max pixel co-ord
+    screen_height_max = screen_height -1    # Max pixel co-ord
+    pygame.mouse.set_visible(False)
 
 class GamepadButtons(TouchAreas):
     """ PS4/DS4 buttons """
-    def buttonOn(self, gridcell):
+    def buttonOn(self, cell_id):
         """ Button touched/pressed """
-        if TouchAreas.buttonOn(self, gridcell):
-            self.drawCell(gridcell, (0, 128, 128))
-            button = gridcell['button']
+        if TouchAreas.buttonOn(self, cell_id):
+            self.drawCell(cell_id, self.pressed_color)
+            button = TouchAreas.buttons[cell_id]
             if button == DPadButton.UP:
                 Gamepad.dPadYAxis(0)
             elif button == DPadButton.DOWN:
@@ -121,19 +415,19 @@ class GamepadButtons(TouchAreas):
             elif button == DPadButton.RIGHT:
                 Gamepad.dPadXAxis(255)
             else:
-                Gamepad.press(gridcell['button'])
+                Gamepad.press(button)
 
-    def buttonOff(self, gridcell):
+    def buttonOff(self, cell_id):
         """ Button released """
-        if TouchAreas.buttonOff(self, gridcell):
-            self.drawCell(gridcell, gridcell['color'])
-            button = gridcell['button']
+        if TouchAreas.buttonOff(self, cell_id):
+            self.drawCell(cell_id)
+            button = TouchAreas.buttons[cell_id]
             if button == DPadButton.UP or button == DPadButton.DOWN:
                 Gamepad.dPadYAxis(128)
             elif button == DPadButton.LEFT or button == DPadButton.RIGHT:
                 Gamepad.dPadXAxis(128)
             else:
-                Gamepad.release(gridcell['button'])
+                Gamepad.release(button)
 
 class SlideBar(TouchAreas):
     """ Project Diva slide bar """
@@ -142,59 +436,63 @@ class SlideBar(TouchAreas):
         TouchAreas.__init__(self, topLeft, bottomRight, rows, columns, gridlines, bgcolor, font, properties, displaysurf)
         self.hands = []
         self.handsOld = []
+        # Bit 31 is the left most cell. Kept up to date as cells are
+        # touched and released.
+        self.slider_bits = 0
+        # Slider bit of each cell, indexed by cell id - self.first
+        self.bits = array.array('L')
+
+    def draw(self, sprites=None):
+        """ Draw the slider and give every cell its slider bit """
+        TouchAreas.draw(self, sprites)
+        self.bits = array.array('L', [1 << (31 - index) for index in range(len(self.cells))])
 
-    def buttonOn(self, gridcell):
+    def buttonOn(self, cell_id):
         """ Button touched/pressed """
-        if TouchAreas.buttonOn(self, gridcell):
-            self.drawCell(gridcell, (0, 128, 128))
+        if TouchAreas.buttonOn(self, cell_id):
+            self.slider_bits |= self.bits[cell_id - self.first]
+            self.drawCell(cell_id, self.pressed_color)
             self.update()
 
-    def buttonOff(self, gridcell):
+    def buttonOff(self, cell_id):
         """ Button released """
-        if TouchAreas.buttonOff(self, gridcell):
-            self.drawCell(gridcell, self.bgcolor)
+        if TouchAreas.buttonOff(self, cell_id):
+            self.slider_bits &= ~self.bits[cell_id - self.first]
+            self.drawCell(cell_id, self.bgcolor)
             self.update()
 
-    def fingerMove(self, gridcell, gridcell_new):
-        if TouchAreas.buttonOn(self, gridcell_new):
-            self.drawCell(gridcell_new, (0, 128, 128))
-        if TouchAreas.buttonOff(self, gridcell):
-            self.drawCell(gridcell, self.bgcolor)
+    def fingerMove(self, cell_id, cell_id_new):
+        """ Finger slid from one slider cell to another, one update """
+        if TouchAreas.buttonOn(self, cell_id_new):
+            self.slider_bits |= self.bits[cell_id_new - self.first]
+            self.drawCell(cell_id_new, self.pressed_color)
+        if TouchAreas.buttonOff(self, cell_id):
+            self.slider_bits &= ~self.bits[cell_id - self.first]
+            self.drawCell(cell_id, self.bgcolor)
         self.update()
 
     def update(self):
         """
-        Update the screen for all changed(modified) cells. Also send slider
-        bits out to Switch.
-        TBD: updating the screen might be increasing latency. Maybe add
-        command line option to draw grid but not update screen on touches.
+        Send slider bits out to the console. Changed cells are drawn later
+        by the event loop, see the --fps and --no-feedback options.
         """
         #entry_ticks = pygame.time.get_ticks()
-        slider_bits = 0
-        bit_count = 31
-        for gridcell in self.cells:
-            buttonDown = gridcell['buttonDown']
-            if buttonDown > 0:
-                slider_bits |= (1 << bit_count)
-            bit_count -= 1
-
-        #rect_ticks = pygame.time.get_ticks()
-        #print('update_rec', pygame.time.get_ticks() - rect_ticks)
-        print('%08x' % (slider_bits))
-        #print('update ms', pygame.time.get_ticks() - entry_ticks)
+        slider_bits = self.slider_bits
+        LOG.debug('%08x', slider_bits)
+        #LOG.debug('update ms %d', pygame.time.get_ticks() - entry_ticks)
         # Code for tracking hands and hand motion no longer useful but
         # this might be useful for the PS4.
         if slider == "dedicated":
             Gamepad.allAxes(slider_bits ^ 0x80808080)
         else:
             num_hands = self.find_hands(slider_bits)
-            print('hands', num_hands, self.hands)
+            LOG.debug('hands %d %s', num_hands, self.hands)
             if num_hands == 0:
                 Gamepad.leftXAxis(128)
                 Gamepad.rightXAxis(128)
             elif num_hands == 1 and len(self.handsOld) > 0:
                 moved = self.detect_motion(self.hands[0], self.handsOld[0])
-                print('hand=1, moved=', moved)
+                LOG.debug('hand=1, moved= %d', moved)
                 if moved > 0:
                     Gamepad.rightXAxis(255)
                 elif moved < 0:
@@ -204,7 +502,7 @@ class SlideBar(TouchAreas):
                     Gamepad.rightXAxis(128)
             elif num_hands == 2 and len(self.handsOld) > 1:
                 moved = self.detect_motion(self.hands[0], self.handsOld[0])
-                print('hand=2, left moved=', moved)
+                LOG.debug('hand=2, left moved= %d', moved)
                 if moved > 0:
                     Gamepad.leftXAxis(255)
                 elif moved < 0:
@@ -212,7 +510,7 @@ class SlideBar(TouchAreas):
                 else:
                     Gamepad.leftXAxis(128)
                 moved = self.detect_motion(self.hands[1], self.handsOld[1])
-                print('hand=2, right moved=', moved)
+                LOG.debug('hand=2, right moved= %d', moved)
                 if moved > 0:
                     Gamepad.rightXAxis(255)
                 elif moved < 0:
@@ -222,11 +520,10 @@ class SlideBar(TouchAreas):
             self.handsOld = self.hands
 
     def detect_motion(self, handsNew, handsOld):
-        print(handsNew, handsOld)
-        centerNew = ((handsNew['start'] - handsNew['end']) / 2.0) + handsNew['end']
-        centerOld = ((handsOld['start'] - handsOld['end']) / 2.0) + handsOld['end']
-        print(centerNew, centerOld)
-        move = centerOld - centerNew
+        """ Return 1, -1 or 0 as the hand center moved left, right or not """
+        LOG.debug('%s %s', handsNew, handsOld)
+        # Compare centers times 2 to stay in integers
+        move = (handsOld[0] + handsOld[1]) - (handsNew[0] + handsNew[1])
         if move > 0:
             return 1
         elif move < 0:
@@ -235,215 +532,568 @@ class SlideBar(TouchAreas):
             return 0
 
     def find_hands(self, slider_bits):
-        mask = 1 << 31
-        hand = {}
-        hand_state = 0
-        self.hands = []
-        for b in range(31, -1, -1):
-            if hand_state == 0:
-                if slider_bits & mask:
-                    hand['start'] = b
-                    hand_state = 1
-            elif hand_state == 1:
-                if (slider_bits & mask) == 0:
-                    hand_state = 2
-            elif hand_state == 2:
-                if (slider_bits & mask) == 0:
-                    hand_state = 3
-            elif hand_state == 3:
-                if (slider_bits & mask) == 0:
-                    hand_state = 4
-            elif hand_state == 4:
-                if (slider_bits & mask) == 0:
-                    hand['end'] = b+4
-                    hand_state = 0
-                    self.hands.append(hand)
-                    hand = {}
-
-            mask = mask >> 1
-        if hand_state == 1:
-            hand['end'] = 0
-            self.hands.append(hand)
-        elif hand_state == 2:
-            hand['end'] = 1
-            self.hands.append(hand)
-        elif hand_state == 3:
-            hand['end'] = 2
-            self.hands.append(hand)
-        elif hand_state == 4:
-            hand['end'] = 3
-            self.hands.append(hand)
+        """ Find (start, end) of each hand on the slider. Return hand count. """
+        self.hands = find_hands(slider_bits)
         return len(self.hands)
 
 class BigButtons(TouchAreas):
     """ Big buttons """
-    def buttonOn(self, gridcell):
+    pressed_color = (255, 255, 255)
+
+    def buttonOn(self, cell_id):
         """ Button touched/pressed """
-        if TouchAreas.buttonOn(self, gridcell):
-            Gamepad.press(gridcell['button'])
-            self.drawCell(gridcell, (255, 255, 255))
+        if TouchAreas.buttonOn(self, cell_id):
+            Gamepad.press(TouchAreas.buttons[cell_id])
+            self.drawCell(cell_id, self.pressed_color)
 
-    def buttonOff(self, gridcell):
+    def buttonOff(self, cell_id):
         """ Button released """
-        if TouchAreas.buttonOff(self, gridcell):
-            Gamepad.release(gridcell['button'])
-            self.drawCell(gridcell, gridcell['color'])
-
-nsbutton_props = [
-    {"label": "ZL", "button": NSButton.LEFT_THROTTLE},
-    {"label": "L", "button": NSButton.LEFT_TRIGGER},
-    {"label": "LSB/L3", "button": NSButton.LEFT_STICK},
-    {"label": "Up", "buttonColor": [0, 128, 128], "button": DPadButton.UP},
-    {"label": "Down", "buttonColor": [0, 128, 128], "button": DPadButton.DOWN},
-    {"label": "Left", "buttonColor": [0, 128, 128], "button": DPadButton.LEFT},
-    {"label": "Right", "buttonColor": [0, 128, 128], "button": DPadButton.RIGHT},
-    {"label": "-", "button": NSButton.MINUS},
-    {"label": "Capture", "button": NSButton.CAPTURE},
-    {"label": "Home", "button": NSButton.HOME},
-    {"label": "+", "button": NSButton.PLUS},
-    {"label": "RSB/R3", "button": NSButton.RIGHT_STICK},
-    {"label": "R", "button": NSButton.RIGHT_TRIGGER},
-    {"label": "ZR", "button": NSButton.RIGHT_THROTTLE}
-]
-ps4button_props = [
-    {"label": "L2", "button": DS4Button.L2},
-    {"label": "L1", "button": DS4Button.L1},
-    {"label": "L3", "button": DS4Button.L3},
-    {"label": "Up", "buttonColor": [0, 128, 128], "button": DPadButton.UP},
-    {"label": "Down", "buttonColor": [0, 128, 128], "button": DPadButton.DOWN},
-    {"label": "Left", "buttonColor": [0, 128, 128], "button": DPadButton.LEFT},
-    {"label": "Right", "buttonColor": [0, 128, 128], "button": DPadButton.RIGHT},
-    {"label": "Share", "button": DS4Button.SHARE},
-    {"label": "Logo", "button": DS4Button.LOGO},
-    {"label": "TPad", "button": DS4Button.TPAD},
-    {"label": "Options", "button": DS4Button.OPTIONS},
-    {"label": "R3", "button": DS4Button.R3},
-    {"label": "R1", "button": DS4Button.R1},
-    {"label": "R2", "button": DS4Button.R2}
-]
-
-if console == 'ps4':
-    props = ps4button_props
-elif console == 'switch':
-    props = nsbutton_props
-else:
-    props = None
-
-gamepad_buttons = GamepadButtons([0,0], [screen_width_max, (screen_height / 16) - 1], 1, 14, False, (128,128,128), fontGamepadButton, props, DISPLAYSURF)
-gamepad_buttons.draw()
-
-# Properties for every cell, that is, 32
-SliderProps = [
-        {'label': '<'},
-        {'label': 'L'},
-        {'label': ' '},
-        {'label': ' '},
-        {'label': 'T'},
-        {'label': ' '},
-        {'label': 'O'},
-        {'label': ' '},
-        {'label': 'U'},
-        {'label': ' '},
-        {'label': 'C'},
-        {'label': ' '},
-        {'label': 'H'},
-        {'label': ' '},
-        {'label': ' '},
-        {'label': ' '},
-        {'label': ' '},
-        {'label': 'S'},
-        {'label': ' '},
-        {'label': 'L'},
-        {'label': ' '},
-        {'label': 'I'},
-        {'label': ' '},
-        {'label': 'D'},
-        {'label': ' '},
-        {'label': 'E'},
-        {'label': ' '},
-        {'label': 'R'},
-        {'label': ' '},
-        {'label': ' '},
-        {'label': 'R'},
-        {'label': '>'},
-]
-Slider = SlideBar([0,(screen_height/16)], [screen_width_max, (screen_height-screen_width/4)-1], 1, 32, False, (192,192,192), fontSlider, SliderProps, DISPLAYSURF)
-Slider.draw()
-
-ps4bigbutton_properties = [
-    {'buttonColor': [180,201,132], 'button': DS4Button.TRIANGLE, 'picture': 'triangle.png'},
-    {'buttonColor': [225,178,212], 'button': DS4Button.SQUARE, 'picture': 'square.png'},
-    {'buttonColor': [143,181,220], 'button': DS4Button.CROSS, 'picture': 'cross.png'},
-    {'buttonColor': [213, 62, 31], 'button': DS4Button.CIRCLE, 'picture': 'circle.png'}
-]
-nsbigbutton_properties = [
-    {'label': 'X', 'buttonColor': [180,201,132], 'button': NSButton.X, 'picture': 'triangle.png'},
-    {'label': 'Y', 'buttonColor': [225,178,212], 'button': NSButton.Y, 'picture': 'square.png'},
-    {'label': 'B', 'buttonColor': [143,181,220], 'button': NSButton.B, 'picture': 'cross.png'},
-    {'label': 'A', 'buttonColor': [213, 62, 31], 'button': NSButton.A, 'picture': 'circle.png'}
-]
-if console == "ps4":
-    props = ps4bigbutton_properties
-elif console == "switch":
-    props = nsbigbutton_properties
-else:
-    props = None
-Buttons = BigButtons([0,screen_height-screen_width/4], [screen_width_max, screen_height_max], 1, 4, False, (128,128,128), fontGamepadButton, props, DISPLAYSURF)
-Buttons.draw()
-
-# Up to 10 touches/fingers
-fingers = {}
+        if TouchAreas.buttonOff(self, cell_id):
+            Gamepad.release(TouchAreas.buttons[cell_id])
+            self.drawCell(cell_id)
+
+# Layout file area types
+AREA_TYPES = {
+    'SlideBar': SlideBar,
+    'BigButtons': BigButtons,
+    'GamepadButtons': GamepadButtons,
+}
+
+def load_layout(size):
+    """ Compile the layout for a screen size, or load it from its compiled cache """
+    global LAYOUT
+    if console == "ps4":
+        from ds4gpadserial import DS4Button as console_buttons
+    else:
+        from nsgpadserial import NSButton as console_buttons
+    try:
+        LAYOUT = layoutfile.load(layout, console, console_buttons, DPadButton,
+                                 size, hitmap_shift)
+    except (OSError, ValueError, KeyError) as err:
+        print("Layout", layout, "not loaded:", repr(err))
+        sys.exit(1)
+    startup_mark('layout compiled')
+
+def make_touch_areas(surface, fonts, sprites):
+    """
+    Make and draw the touch areas of LAYOUT on surface and load the
+    hit-test table. sprites holds the cached sprites of each area, None
+    for areas to render.
+    """
+    global touch_areas, gamepad_buttons, Slider, Buttons, hitmap
+    TouchAreas.clearCells()
+    fingers.clear()
+    touch_areas = []
+    gamepad_buttons = Slider = Buttons = None
+    for area, area_sprites in zip(LAYOUT.areas, sprites):
+        touch_area = AREA_TYPES[area['type']](area['topLeft'], area['bottomRight'],
+                area['rows'], area['columns'], area['gridlines'], area['bgcolor'],
+                fonts.get(area['font']), LAYOUT.properties(area), surface)
+        touch_area.draw(area_sprites)
+        touch_areas.append(touch_area)
+        if isinstance(touch_area, GamepadButtons) and gamepad_buttons is None:
+            gamepad_buttons = touch_area
+        elif isinstance(touch_area, SlideBar) and Slider is None:
+            Slider = touch_area
+        elif isinstance(touch_area, BigButtons) and Buttons is None:
+            Buttons = touch_area
+
+    # Touch co-ordinates to cell id lookup table, compiled with the layout
+    hitmap = HitMap(screen_width, screen_height, hitmap_shift)
+    for touch_area in touch_areas:
+        hitmap.add(touch_area)
+    hitmap.load(LAYOUT.hit_table)
+    startup_mark('layout')
+
+def build_layout():
+    """
+    Compile or load the layout, draw all touch areas, set up the hit-test
+    table and show the screen. The drawing comes from the layout cache if
+    it has this layout.
+    """
+    global frame_ns, BACKGROUND
+    load_layout(DISPLAYSURF.get_size())
+    cache_path = None
+    cached = None
+    if layout_cache:
+        cache_dir = layout_cache_dir or layoutcache.default_dir()
+        key = layoutcache.cache_key(DISPLAYSURF.get_size(), DISPLAYSURF.get_bitsize(),
+                                    (console, LAYOUT.key), (), 'assets', cache_dir)
+        cache_path = os.path.join(cache_dir, key + '.cache')
+        cached = layoutcache.load(cache_path, DISPLAYSURF.get_size())
+        if cached is not None and len(cached[1]) != len(LAYOUT.areas):
+            cached = None
+    fonts = {}
+    if cached is None:
+        sprites = [None] * len(LAYOUT.areas)
+        if pygame.font:
+            pygame.font.init()
+            for area in LAYOUT.areas:
+                if area['font'] not in fonts:
+                    fonts[area['font']] = pygame.font.Font(None, area['font'])
+        else:
+            print("Warning, fonts disabled")
+        startup_mark('fonts')
+    else:
+        BACKGROUND, sprites = cached
+        DISPLAYSURF.blit(BACKGROUND, (0, 0))
+        startup_mark('layout cache read')
+    make_touch_areas(DISPLAYSURF, fonts, sprites)
+
+    # Update the screen
+    pygame.display.update()
+    startup_mark('first frame')
+    if cached is None:
+        BACKGROUND = DISPLAYSURF.copy()
+        if cache_path is not None:
+            try:
+                layoutcache.save(cache_path, BACKGROUND, touch_areas)
+            except OSError as err:
+                print("Layout cache not saved:", err)
+    # From now on drawCell only queues cells. The event loop draws them after
+    # the reports are sent, at most fps times a second.
+    TouchAreas.dirty_rects.clear()
+    TouchAreas.defer_updates = True
+    TouchAreas.feedback = feedback
+    frame_ns = 1000000000 // fps if fps > 0 else 0
+
+def build_hit_layout(size):
+    """
+    The --render-process input side of build_layout: touch areas and the
+    hit-test table for a screen size, nothing drawn
+    """
+    global screen_width, screen_height, screen_width_max, screen_height_max
+    (screen_width, screen_height) = size
+    screen_width_max = screen_width - 1
+    screen_height_max = screen_height - 1
+    load_layout(size)
+    # Only the surface size is used, an empty sprites list renders nothing
+    make_touch_areas(pygame.Surface(size), {}, [[] for _ in LAYOUT.areas])
+    # Cells are drawn by the render process from the shared press counts
+    TouchAreas.defer_updates = True
+    TouchAreas.feedback = False
+
+# pygame FINGER event types to session record types and back
+RECORD_TYPES = {
+    pygame.FINGERDOWN: touchrecord.FINGERDOWN,
+    pygame.FINGERUP: touchrecord.FINGERUP,
+    pygame.FINGERMOTION: touchrecord.FINGERMOTION,
+}
+REPLAY_TYPES = dict((record_type, event_type) for event_type, record_type in RECORD_TYPES.items())
+
+def touch_start_ns(event, received_ns):
+    """ Time of the touch event: its SDL time stamp if it has one """
+    timestamp = getattr(event, 'timestamp', None)
+    if timestamp is None:
+        return received_ns
+    return sdl_epoch_ns + int(timestamp * 1000000)
+
+def handle_touch(touch_type, finger_id, x, y, start_ns):
+    """
+    Hit-test one touch then press, release or move the touched cell.
+    touch_type is pygame.FINGERDOWN, FINGERUP or FINGERMOTION. x and y are
+    0..1 as in SDL FINGER events.
+    """
+    cell_x = int(x*screen_width_max)
+    cell_y = int(y*screen_height_max)
+    if touch_type == pygame.FINGERDOWN:
+        cell_id = hitmap.lookup(cell_x, cell_y)
+        if cell_id:
+            touch_area = TouchAreas.areas[TouchAreas.owners[cell_id]]
+            if LATENCY is not None:
+                LATENCY.mark(touch_area.name, start_ns)
+            touch_area.buttonOn(cell_id)
+            fingers[finger_id] = cell_id
+    elif touch_type == pygame.FINGERUP:
+        cell_id = hitmap.lookup(cell_x, cell_y)
+        if cell_id:
+            touch_area = TouchAreas.areas[TouchAreas.owners[cell_id]]
+            if LATENCY is not None:
+                LATENCY.mark(touch_area.name, start_ns)
+            touch_area.buttonOff(cell_id)
+            fingers[finger_id] = cell_id
+    elif touch_type == pygame.FINGERMOTION:
+        cell_id_new = hitmap.lookup(cell_x, cell_y)
+        if cell_id_new:
+            cell_id = fingers.get(finger_id, 0)
+            if cell_id and cell_id_new != cell_id:
+                areas = TouchAreas.areas
+                touch_area = areas[TouchAreas.owners[cell_id]]
+                touch_area_new = areas[TouchAreas.owners[cell_id_new]]
+                if LATENCY is not None:
+                    LATENCY.mark(touch_area_new.name, start_ns)
+                if touch_area is Slider and touch_area_new is Slider:
+                    touch_area.fingerMove(cell_id, cell_id_new)
+                else:
+                    touch_area.buttonOff(cell_id)
+                    touch_area_new.buttonOn(cell_id_new)
+                fingers[finger_id] = cell_id_new
+
+def evdev_frame(touches):
+    """
+    Called by the evdev reader thread for each SYN_REPORT with the changed
+    touches. One report per frame, like one per burst of SDL events.
+    """
+    global evdev_draw_posted
+    with Gamepad.batch():
+        for (touch_type, finger_id, x, y, start_ns) in touches:
+            if RECORDER is not None:
+                RECORDER.touch(touch_type, finger_id, x, y, start_ns)
+            handle_touch(REPLAY_TYPES[touch_type], finger_id, x, y, start_ns)
+        # Also wake it to retry a report held back by the serial queue monitor
+        wake = bool(TouchAreas.pending_cells or (QUEUE is not None and QUEUE.held)) \
+            and not evdev_draw_posted
+        evdev_draw_posted = evdev_draw_posted or wake
+    if LATENCY is not None:
+        LATENCY.discard()
+    if RECORDER is not None:
+        RECORDER.burst()
+    if SHARED is not None:
+        # The render process redraws from the shared press counts
+        SHARED.publish()
+        if wake:
+            RENDER_WAKE.set()
+    elif wake:
+        # Wake the main thread to draw the touched cells
+        pygame.event.post(pygame.event.Event(EVDEV_DRAW))
+
+def evdev_eof():
+    """ The evdev input ended, for example a recorded file was all read """
+    if SHARED is not None:
+        SHARED.requestQuit()
+        RENDER_WAKE.set()
+    else:
+        pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+def open_evdev():
+    """ Open the evdev touch input, it is started by run() """
+    global EVDEV, evdev_max
+    if evdev_path is None:
+        EVDEV = None
+        return
+    from evdevtouch import EvdevTouch
+    try:
+        if evdev_max is None and not stat.S_ISCHR(os.stat(evdev_path).st_mode):
+            # Recorded input_event file, co-ordinates are screen pixels
+            evdev_max = (screen_width_max, screen_height_max)
+        EVDEV = EvdevTouch(evdev_path, evdev_frame, evdev_eof,
+                           (0, evdev_max[0]) if evdev_max else None,
+                           (0, evdev_max[1]) if evdev_max else None)
+    except OSError as err:
+        print(err)
+        sys.exit(1)
+
+def redraw_screen():
+    """ Full redraw: the background in one blit then the touched cells """
+    DISPLAYSURF.blit(BACKGROUND, (0, 0))
+    if TouchAreas.feedback:
+        for touch_area in touch_areas:
+            for cell in touch_area.cells:
+                if TouchAreas.press_counts[cell.cell_id]:
+                    touch_area.paintCell(cell, touch_area.pressed_color)
+    TouchAreas.dirty_rects.clear()
+    pygame.display.update()
 
-# Update the screen
-pygame.display.update()
+def replay(path, fast):
+    """
+    Feed a recorded session through handle_touch, one batch per recorded
+    burst, and compare the reports sent with the recorded reports.
+    Return 0 if they match.
+    """
+    session = Session(path)
+    if session.console != console or session.slider != slider:
+        print("Warning: session recorded with console=", session.console,
+              "slider=", session.slider)
+    burst = []
+    first_ns = None
+    start_ns = now_ns()
+    num_touches = 0
+    for record in session.records():
+        if record[0] == REPORT_TYPE:
+            continue
+        if record[0] != BURST:
+            burst.append(record)
+            continue
+        if not burst:
+            continue
+        if not fast:
+            # Wait until the original time of the first touch of the burst
+            if first_ns is None:
+                first_ns = burst[0][1]
+            delay_ns = start_ns + burst[0][1] - first_ns - now_ns()
+            if delay_ns > 0:
+                time.sleep(delay_ns / 1e9)
+        with Gamepad.batch():
+            for (touch_type, t_ns, finger_id, x, y) in burst:
+                handle_touch(REPLAY_TYPES[touch_type], finger_id, x, y, now_ns())
+        if LATENCY is not None:
+            LATENCY.discard()
+        TouchAreas.flushDisplay(merge_rects)
+        num_touches += len(burst)
+        burst = []
+    recorded = session.reports()
+    session.close()
+    Gamepad.end()
+    if CAPTURE is not None:
+        CAPTURE.close()
+    produced = NS_SERIAL.reports
+    differences = diff_reports(recorded, produced)
+    print("Replayed", num_touches, "touches,", len(produced), "reports,",
+          len(recorded), "recorded,", len(differences), "differences")
+    for line in differences[:20]:
+        print(line)
+    print_stats()
+    LOG.stop()
+    return 1 if differences else 0
 
-def main():
+# Longest wait for an event when there is nothing to draw
+IDLE_WAIT_MS = 500
+
+def next_events(block_ms):
+    """
+    Return the queued events. If there are none wait up to block_ms for
+    one. The wait sleeps in SDL so an idle controller uses no CPU.
+    """
+    events = pygame.event.get()
+    if events or block_ms <= 0:
+        return events
+    event = pygame.event.wait(block_ms)
+    if event.type == pygame.NOEVENT:
+        return events
+    events = pygame.event.get()
+    events.insert(0, event)
+    return events
+
+def setup(argv):
+    """ Everything up to the event loop. argv excludes the program name. """
+    global LOG
+    main_ns = now_ns()
+    age_ms = process_age_ms()
+    parse_options(argv)
+    startup_mark('options')
+    # Hot path logging goes through a ring buffer drained by a background thread
+    LOG = RingLog(log_level)
+    LOG.start()
+    # The serial port first so the console sees a neutral gamepad early
+    open_gamepad()
+    startup_mark('first serial report')
+    if render_process:
+        start_render_process(argv)
+    else:
+        open_display()
+        startup_mark('display')
+        build_layout()
+    open_evdev()
+    if startup_timing:
+        print(startup_report(main_ns, age_ms))
+
+def run():
+    """ The event loop, until quit or escape """
     mainLoop = True
+    global evdev_draw_posted
+    if EVDEV is not None:
+        EVDEV.start()
+        # Cells are queued by the reader thread while it holds the gamepad lock
+        draw_lock = Gamepad.thread_lock
+    else:
+        draw_lock = None
 
+    next_frame_ns = 0
+    last_event_ns = 0
+    poll_ns = poll_ms * 1000000
+    report_held = False
+    keepalive_due = Gamepad.sendKeepalive()
     while mainLoop:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                mainLoop = False
-            elif event.type == pygame.KEYDOWN:
-                if event.key == K_ESCAPE:
-                    mainLoop = False
-            elif event.type == pygame.FINGERDOWN:
-                cell_x = int(event.x*screen_width_max)
-                cell_y = int(event.y*screen_height_max)
-                for touch_area in (Slider, Buttons, gamepad_buttons):
-                    gridcell = touch_area.touchToCell(cell_x, cell_y)
-                    if gridcell != -1:
-                        gridcell['myself'].buttonOn(gridcell)
-                        fingers[event.finger_id] = gridcell
-                        break
-            elif event.type == pygame.FINGERUP:
-                cell_x = int(event.x*screen_width_max)
-                cell_y = int(event.y*screen_height_max)
-                for touch_area in (Slider, Buttons, gamepad_buttons):
-                    gridcell = touch_area.touchToCell(cell_x, cell_y)
-                    if gridcell != -1:
-                        gridcell['myself'].buttonOff(gridcell)
-                        fingers[event.finger_id] = gridcell
-                        break
-            elif event.type == pygame.FINGERMOTION:
-                cell_x = int(event.x*screen_width_max)
-                cell_y = int(event.y*screen_height_max)
-                for touch_area in (Slider, Buttons, gamepad_buttons):
-                    gridcell_new = touch_area.touchToCell(cell_x, cell_y)
-                    if gridcell_new != -1:
-                        gridcell = fingers[event.finger_id]
-                        if gridcell != -1:
-                            if gridcell_new != gridcell:
-                                if gridcell['myself'] == Slider and gridcell['myself'] == Slider:
-                                    gridcell['myself'].fingerMove(gridcell, gridcell_new)
-                                else:
-                                    gridcell['myself'].buttonOff(gridcell)
-                                    gridcell_new['myself'].buttonOn(gridcell_new)
-                                fingers[event.finger_id] = gridcell_new
-                                break
+        touched = False
+        exposed = False
+        if busy_poll:
+            block_ms = 0
+        elif report_held:
+            # Look at the serial output queue again soon
+            block_ms = 1
+        else:
+            idle_ns = now_ns()
+            if idle_ns - last_event_ns < poll_ns:
+                # Recent activity, poll for the lowest latency
+                block_ms = 0
+            elif TouchAreas.pending_cells:
+                # Wake up in time for the next frame
+                block_ms = max(1, (next_frame_ns - idle_ns + 999999) // 1000000)
             else:
-                if event.type != pygame.VIDEOEXPOSE and event.type != pygame.MULTIGESTURE:
-                    print(event)
+                block_ms = IDLE_WAIT_MS
+            if keepalive_due is not None:
+                # Wake up to resend the unchanged state
+                block_ms = min(block_ms, max(1, int(keepalive_due * 1000) + 1))
+        # Do not wait inside the batch, it holds the gamepad lock
+        events = next_events(block_ms)
+        received_ns = now_ns()
+        if events:
+            last_event_ns = received_ns
+        # One report per burst of events, not one per setter call
+        with Gamepad.batch():
+            for event in events:
+                if event.type == pygame.QUIT:
+                    mainLoop = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == K_ESCAPE:
+                        mainLoop = False
+                elif event.type == pygame.VIDEOEXPOSE:
+                    exposed = True
+                elif event.type == EVDEV_DRAW:
+                    evdev_draw_posted = False
+                elif event.type in RECORD_TYPES:
+                    start_ns = touch_start_ns(event, received_ns)
+                    if RECORDER is not None:
+                        RECORDER.touch(RECORD_TYPES[event.type], event.finger_id,
+                                       event.x, event.y, start_ns)
+                        touched = True
+                    handle_touch(event.type, event.finger_id, event.x, event.y, start_ns)
+                else:
+                    if event.type != pygame.MULTIGESTURE:
+                        LOG.debug('%s', event)
+        if LATENCY is not None:
+            # Touches that did not change the gamepad state
+            LATENCY.discard()
+        if QUEUE is not None:
+            report_held = Gamepad.sendHeld()
+        keepalive_due = Gamepad.sendKeepalive()
+        if exposed:
+            redraw_screen()
+        if TouchAreas.pending_cells:
+            frame_start_ns = now_ns()
+            if frame_start_ns >= next_frame_ns:
+                TouchAreas.flushDisplay(merge_rects, draw_lock)
+                next_frame_ns = frame_start_ns + frame_ns
+        if touched:
+            RECORDER.burst()
+    finish()
+
+def finish():
+    """ Send the last report, close the files and print the counters """
+    Gamepad.end()
+    if RECORDER is not None:
+        RECORDER.close()
+    if CAPTURE is not None:
+        CAPTURE.close()
+    print_stats()
+    LOG.stop()
+
+def start_render_process(argv):
+    """
+    Start the --render-process display process. It opens the display and
+    sends back the screen size, the touch areas here are set up for that
+    size with their press counts in a shared memory block it attaches to.
+    """
+    global RENDER, SHARED
+    # A fresh interpreter, not a fork of this one with its threads
+    context = multiprocessing.get_context('spawn')
+    connection, render_connection = context.Pipe()
+    RENDER = context.Process(target=render_main, args=(argv, render_connection),
+                             name='pdtouch render', daemon=True)
+    RENDER.start()
+    try:
+        size = connection.recv()
+    except EOFError:
+        print("Render process failed to start")
+        sys.exit(1)
+    startup_mark('display')
+    build_hit_layout(size)
+    SHARED = SharedCells(len(TouchAreas.press_counts))
+    TouchAreas.press_counts = SHARED.press_counts
+    connection.send(SHARED.name)
+
+def render_main(argv, connection):
+    """ The --render-process display process """
+    global LOG, DPadButton
+    parse_options(argv)
+    LOG = RingLog(log_level)
+    LOG.start()
+    if console == "ps4":
+        from ds4gpadserial import DPadButton as dpad_button
+    else:
+        from nsgpadserial import DPadButton as dpad_button
+    DPadButton = dpad_button
+    open_display()
+    connection.send(DISPLAYSURF.get_size())
+    build_layout()
+    shared = SharedCells(len(TouchAreas.press_counts), connection.recv())
+    # redraw_screen reads TouchAreas.press_counts
+    TouchAreas.press_counts = shared.press_counts
+    render_loop(shared)
+    TouchAreas.press_counts = array.array('h', shared.press_counts)
+    shared.close()
+    LOG.stop()
+
+def render_loop(shared):
+    """
+    Redraw the cells whose pressed state changed in the shared press
+    counts, at most fps times a second, until either process quits
+    """
+    press_counts = shared.press_counts
+    areas = TouchAreas.areas
+    owners = TouchAreas.owners
+    # Pressed state of each cell as last drawn
+    drawn = array.array('h', [0]) * len(press_counts)
+    generation = shared.generation
+    block_ms = 1000 // fps if fps > 0 else RENDER_POLL_MS
+    while not shared.quitRequested():
+        exposed = False
+        for event in next_events(block_ms):
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and
+                                             event.key == K_ESCAPE):
+                shared.requestQuit()
+            elif event.type == pygame.VIDEOEXPOSE:
+                exposed = True
+        if exposed:
+            redraw_screen()
+            drawn = array.array('h', (count > 0 for count in press_counts))
+        if shared.generation == generation:
+            continue
+        generation = shared.generation
+        for cell_id in range(1, len(press_counts)):
+            pressed = press_counts[cell_id] > 0
+            if pressed != drawn[cell_id]:
+                drawn[cell_id] = pressed
+                touch_area = areas[owners[cell_id]]
+                touch_area.drawCell(cell_id, touch_area.pressed_color if pressed else None)
+        TouchAreas.flushDisplay(merge_rects)
+
+def run_split():
+    """
+    The --render-process input loop. Touches are handled by the evdev
+    reader thread, this retries held reports until either process quits.
+    """
+    global evdev_draw_posted
+    EVDEV.start()
+    report_held = False
+    keepalive_due = Gamepad.sendKeepalive()
+    while not SHARED.quitRequested() and RENDER.is_alive():
+        # Set by evdev_frame when the serial queue monitor holds a report
+        timeout = 0.001 if report_held else 0.1
+        if keepalive_due is not None:
+            timeout = min(timeout, max(keepalive_due, 0.001))
+        RENDER_WAKE.wait(timeout)
+        RENDER_WAKE.clear()
+        evdev_draw_posted = False
+        if QUEUE is not None:
+            report_held = Gamepad.sendHeld()
+        keepalive_due = Gamepad.sendKeepalive()
+    SHARED.requestQuit()
+    RENDER.join(5)
+    with Gamepad.thread_lock:
+        # The evdev thread may still be running, it gets its own counts
+        TouchAreas.press_counts = array.array('h', SHARED.press_counts)
+        SHARED.close()
+    finish()
+
+def main(argv=None):
+    setup(sys.argv[1:] if argv is None else argv)
+    if replay_path is not None:
+        sys.exit(replay(replay_path, replay_fast))
+    if render_process:
+        run_split()
+    else:
+        run()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+"""
+Serial port output queue monitoring for NSGamepadSerial and DS4GamepadSerial.
+
+ser_port.write with timeout=0 only hands the report to the kernel. If the
+UART or USB serial adapter falls behind, reports pile up in the output
+buffer and the console gets each button state late. Before each write the
+gamepad asks the monitor, which reads ser_port.out_waiting. Above the limit
+the report is not queued, the state is held and sent as one fresh report
+when the queue has drained. All states changed meanwhile are coalesced into
+it and their touches are timed to that report.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+class QueueMonitor:
+    """Hold back reports while the serial output queue is over a limit"""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, limit, retry_interval=0.001):
+        """
+        limit is the most bytes waiting in the output buffer a report is
+        still written on top of, 0 to write only to an empty queue.
+        retry_interval is how often the writer thread looks at a backed up
+        queue, in seconds.
+        """
+        self.limit = limit
+        self.retry_interval = retry_interval
+        # The current state is waiting for the queue to drain
+        self.held = False
+        # Reports asked for while held, and their latency marks
+        self.held_reports = 0
+        self.marks = []
+        # Bytes in the output buffer at the last look and the most seen
+        self.queued = 0
+        self.max_queued = 0
+        self.bytes_written = 0
+        self.reports_written = 0
+        self.reports_coalesced = 0
+
+    def hold(self, port, reports=1, marks=None):
+        """
+        Return True if the report must not be written now because the port
+        output queue is over the limit. reports is how many state changes
+        the report stands for. Caller holds the gamepad lock.
+        """
+        queued = port.out_waiting
+        self.queued = queued
+        if queued > self.max_queued:
+            self.max_queued = queued
+        if queued <= self.limit:
+            return False
+        self.held = True
+        self.held_reports += reports
+        if marks:
+            self.marks.extend(marks)
+        return True
+
+    def release(self, marks=None):
+        """
+        The queue has room, the report is about to be written. Return its
+        latency marks including those of the held states.
+        """
+        if self.held:
+            self.held = False
+            self.reports_coalesced += self.held_reports
+            self.held_reports = 0
+            if self.marks:
+                if marks:
+                    self.marks.extend(marks)
+                marks = self.marks
+                self.marks = []
+        return marks
+
+    def written(self, num_bytes):
+        """Count a report written to the port"""
+        self.bytes_written += num_bytes
+        self.reports_written += 1
+        return
+
+    def stats(self):
+        """Return the counters as a dict"""
+        return {'queued': self.queued,
+                'max_queued': self.max_queued,
+                'bytes_written': self.bytes_written,
+                'written': self.reports_written,
+                'coalesced': self.reports_coalesced,
+                'held': self.held}
+
+    def report(self):
+        """Return the counters as text"""
+        return ('serial queue limit %d: %d bytes queued, max %d, %d reports, '
+                '%d bytes written, %d coalesced' %
+                (self.limit, self.queued, self.max_queued,
+                 self.reports_written, self.bytes_written,
+                 self.reports_coalesced))
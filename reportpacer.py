@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+"""
+Paced report thread for NSGamepadSerial and DS4GamepadSerial.
+
+Without pacing a report goes out whenever a setter changes the state, so
+report timing follows the touch events. The gadget only passes the newest
+state to the console at each USB HID poll (1 ms or 8 ms on the Trinket M0),
+reports in between use UART time and add jitter. The pacer sends the newest
+state at most once per tick of a fixed schedule. Ticks with no change send
+nothing, after one of them the pacer is idle and sleeps until the next
+change. That change is sent at once (immediate) or at the next tick of the
+old schedule.
+
+A change undone before it was sent, a tap queued by sendChanges(), takes
+a tick of its own and the pending state goes out at the next one. Sent
+together in one tick they would reach the gadget inside one USB poll and
+only the last would get to the console. So queued taps delay the newer
+state by a tick each, up to 5 ticks with taps_max 4: 40 ms at 8 ms, 5 ms at
+1 ms. Pace at 1 ms unless the gadget polls slower.
+
+The difference between the scheduled tick and the actual write is kept in
+a histogram. time.sleep wakes up late by tens of microseconds, spin is how
+long before a tick to stop sleeping and busy wait instead.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import threading
+import time
+from latency import LatencyHistogram
+
+class ReportPacer:
+    """Send the newest gamepad state on a fixed schedule from a background thread"""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, gamepad, interval, immediate=True, spin=0.0):
+        """ interval and spin are in seconds """
+        self.gamepad = gamepad
+        # Shares the gamepad lock so state changes and posts are atomic
+        self.report_ready = threading.Condition(gamepad.thread_lock)
+        self.interval_ns = int(interval * 1e9)
+        self.immediate = immediate
+        self.spin_ns = int(spin * 1e9)
+        self.pending = 0
+        # Latency marks of the touches in the pending state
+        self.marks = []
+        self.running = False
+        self.thread = None
+        # A tick of the schedule, the next ones are interval_ns apart
+        self.origin_ns = 0
+        self.reports_posted = 0
+        self.reports_written = 0
+        self.reports_superseded = 0
+        self.reports_immediate = 0
+        self.ticks_missed = 0
+        # Write time minus tick time of scheduled reports, 1 us buckets
+        self.jitter = LatencyHistogram(bucket_ns=1000, buckets=10000)
+
+    def start(self):
+        """Start the pacer thread"""
+        with self.report_ready:
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name='ReportPacer',
+                                       daemon=True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        """Send the last pending state then stop the pacer thread"""
+        with self.report_ready:
+            self.running = False
+            self.report_ready.notify()
+        self.thread.join()
+        return
+
+    def post(self, marks=None):
+        """Signal a state change. Caller must hold gamepad.thread_lock."""
+        if marks:
+            self.marks.extend(marks)
+        self.pending += 1
+        self.reports_posted += 1
+        self.report_ready.notify()
+        return
+
+    def stats(self):
+        """Return the pacer counters as a dict"""
+        with self.report_ready:
+            return {'posted': self.reports_posted,
+                    'written': self.reports_written,
+                    'superseded': self.reports_superseded,
+                    'immediate': self.reports_immediate,
+                    'missed': self.ticks_missed,
+                    'pending': self.pending}
+
+    def report(self):
+        """Return the schedule error summary as text"""
+        jitter = self.jitter
+        return ('pacing %.3f ms: %d reports, %d immediate, %d superseded, %d ticks missed\n'
+                'tick error us  p50 %d  p95 %d  p99 %d  max %d' %
+                (self.interval_ns / 1e6, self.reports_written, self.reports_immediate,
+                 self.reports_superseded, self.ticks_missed,
+                 jitter.percentile(50) // 1000, jitter.percentile(95) // 1000,
+                 jitter.percentile(99) // 1000, jitter.max_ns // 1000))
+
+    def sleepUntil(self, deadline_ns):
+        """Sleep then busy wait for the last spin_ns until deadline_ns"""
+        remaining_ns = deadline_ns - time.monotonic_ns() - self.spin_ns
+        if remaining_ns > 0:
+            time.sleep(remaining_ns / 1e9)
+        while time.monotonic_ns() < deadline_ns:
+            pass
+        return
+
+    def waiting(self, monitor):
+        """True if there is a state to send. Caller holds the lock."""
+        return self.pending or self.gamepad.taps or (monitor is not None and monitor.held)
+
+    def run(self):
+        """Pacer thread main loop"""
+        # pylint: disable=too-many-branches
+        tick_ns = 0
+        interval_ns = self.interval_ns
+        while True:
+            with self.report_ready:
+                monitor = self.gamepad.queue_monitor
+                if tick_ns == 0:
+                    # Idle, wait for a state change or the keepalive
+                    while self.running and not self.waiting(monitor):
+                        due = self.gamepad.keepaliveDue()
+                        if due is None:
+                            self.report_ready.wait()
+                        elif due > 0:
+                            self.report_ready.wait(due)
+                        else:
+                            self.pending += 1
+                    if not self.waiting(monitor):
+                        return
+                    now_ns = time.monotonic_ns()
+                    if self.immediate or self.origin_ns == 0:
+                        self.origin_ns = now_ns
+                    else:
+                        # Next tick of the old schedule
+                        ticks = -(-(now_ns - self.origin_ns) // interval_ns)
+                        tick_ns = self.origin_ns + ticks * interval_ns
+            if tick_ns:
+                # Setters run meanwhile, their states are superseded
+                self.sleepUntil(tick_ns)
+            with self.report_ready:
+                if not self.waiting(monitor):
+                    tick_ns = 0
+                    continue
+                taps = self.gamepad.taps
+                if monitor is not None and self.running and \
+                        monitor.hold(self.gamepad.ser_port, self.pending, self.marks):
+                    # Retry at the next tick
+                    self.pending = 0
+                    self.marks = []
+                    report = None
+                    # The states queued by sendChanges() are held back too
+                    while taps:
+                        monitor.hold(self.gamepad.ser_port, 1, taps.popleft()[1])
+                elif taps:
+                    # A change undone before it was sent takes this tick,
+                    # the pending state gets the next one
+                    report, marks = taps.popleft()
+                else:
+                    if self.pending:
+                        self.reports_superseded += self.pending - 1
+                    self.pending = 0
+                    marks = self.marks
+                    if marks:
+                        self.marks = []
+                    if monitor is not None:
+                        marks = monitor.release(marks)
+                    report = self.gamepad.encode()
+            if report is not None:
+                write_ns = time.monotonic_ns()
+                self.gamepad.ser_port.write(report)
+                self.reports_written += 1
+                if tick_ns:
+                    self.jitter.add(write_ns - tick_ns)
+                else:
+                    self.reports_immediate += 1
+                if monitor is not None:
+                    with self.report_ready:
+                        monitor.written(len(report))
+                if marks:
+                    self.gamepad.latency.record(marks, time.monotonic_ns())
+            if tick_ns:
+                self.origin_ns = tick_ns
+            next_ns = self.origin_ns + interval_ns
+            now_ns = time.monotonic_ns()
+            if next_ns <= now_ns:
+                # The write or the scheduler took longer than a tick
+                missed = (now_ns - next_ns) // interval_ns + 1
+                self.ticks_missed += missed
+                next_ns += missed * interval_ns
+            tick_ns = next_ns
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+"""
+Low overhead logging for the touch to serial report path.
+
+Log calls below the current level go to a no-op method so they cost one
+function call. Enabled records are stored unformatted in a preallocated
+ring buffer. A background thread formats and writes them to the stream so
+the caller never waits for stdout. When the ring is full the oldest record
+is overwritten and counted in dropped.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVEL_NAMES = {'debug': DEBUG, 'info': INFO, 'warning': WARNING,
+               'error': ERROR, 'off': OFF}
+
+class RingLog:
+    """Leveled logger writing through a ring buffer and a drain thread"""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, level=WARNING, size=4096, stream=None, interval=0.05):
+        self.size = size
+        # (monotonic time, level, format, args) per slot
+        self.records = [None] * size
+        self.head = 0   # Total records written
+        self.tail = 0   # Total records drained
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.stream = stream if stream is not None else sys.stdout
+        self.interval = interval
+        self.running = False
+        self.thread = None
+        self.start_time = time.monotonic()
+        self.level = OFF
+        self.setLevel(level)
+
+    def setLevel(self, level):
+        """Enable records at level and above"""
+        self.level = level
+        for name, method_level in (('debug', DEBUG), ('info', INFO),
+                                   ('warning', WARNING), ('error', ERROR)):
+            if method_level >= level:
+                setattr(self, name, getattr(self, '_' + name))
+            else:
+                setattr(self, name, self.nolog)
+        return
+
+    def isEnabledFor(self, level):
+        """True if records at level are kept"""
+        return level >= self.level
+
+    def nolog(self, fmt, *args):
+        """Log method used for disabled levels"""
+        return
+
+    def log(self, level, fmt, *args):
+        """Store a record. Formatting is done later by the drain thread."""
+        if level < self.level:
+            return
+        with self.lock:
+            if self.head - self.tail >= self.size:
+                self.tail += 1
+                self.dropped += 1
+            self.records[self.head % self.size] = (time.monotonic(), level, fmt, args)
+            self.head += 1
+        return
+
+    def _debug(self, fmt, *args):
+        self.log(DEBUG, fmt, *args)
+
+    def _info(self, fmt, *args):
+        self.log(INFO, fmt, *args)
+
+    def _warning(self, fmt, *args):
+        self.log(WARNING, fmt, *args)
+
+    def _error(self, fmt, *args):
+        self.log(ERROR, fmt, *args)
+
+    def start(self):
+        """Start the drain thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='RingLog',
+                                       daemon=True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        """Stop the drain thread and write out any remaining records"""
+        if self.thread is not None:
+            self.running = False
+            self.thread.join()
+            self.thread = None
+        self.drain()
+        return
+
+    def drain(self):
+        """Format and write all stored records"""
+        with self.lock:
+            pending = [self.records[i % self.size] for i in range(self.tail, self.head)]
+            self.tail = self.head
+            dropped = self.dropped
+            self.dropped = 0
+        if dropped:
+            self.stream.write('ringlog: %d records dropped\n' % dropped)
+        for (timestamp, _level, fmt, args) in pending:
+            try:
+                text = fmt % args if args else fmt
+            except (TypeError, ValueError) as err:
+                text = '%r %r (%s)' % (fmt, args, err)
+            self.stream.write('%10.6f %s\n' % (timestamp - self.start_time, text))
+        if pending or dropped:
+            self.stream.flush()
+        return
+
+    def run(self):
+        """Drain thread main loop"""
+        while self.running:
+            time.sleep(self.interval)
+            self.drain()
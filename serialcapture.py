@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+"""
+Serial capture files and a report rate, timing and state analyzer.
+
+A capture file holds the raw bytes sent to the gadget with their times:
+
+    header  magic (8s), baud (I), source (8s)
+    record  time ns (q), length (H), length bytes
+
+Times are nanoseconds from the start of the capture. SerialConnection,
+through its capture attribute, or CaptureTee wrapping any other gamepad
+serial port records the bytes the port took with the time of the write,
+source "port". GadgetEmulator records what it reads with the time the last
+byte arrived on its emulated line, source "gadget".
+
+The analyzer decodes the NSGadget and DS4Gadget frames and prints
+reports/sec, link use, the interval between reports, redundant reports
+(byte for byte the same as the one before), malformed frames and the time
+spent in each button and dpad state. Link use is the line time the bytes
+take at the baud rate. For a port capture it is what was offered, above
+100% bytes were piling up in the serial output buffer.
+
+python3 pdtouch.py --capture=session.cap
+python3 serialcapture.py session.cap
+python3 serialcapture.py --top=20 --baud=115200 session.cap
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import getopt
+import sys
+import threading
+import time
+from struct import Struct
+
+MAGIC = b'PDTCAP01'
+# magic, baud, source
+HEADER = Struct('<8sI8s')
+RECORD = Struct('<qH')
+
+# Busiest window for the peak link use
+WINDOW_NS = 100000000
+# Interval distribution bucket upper edges, ms
+INTERVAL_EDGES = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 33, 100, 1000)
+
+class SerialCapture:
+    """Write time stamped serial bytes to a capture file"""
+    def __init__(self, path, baud, source='port'):
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, baud, source.encode()))
+        self.start_ns = time.monotonic_ns()
+        self.records = 0
+
+    def record(self, data, time_ns=None):
+        """Record bytes sent or received at time.monotonic_ns() time_ns"""
+        if time_ns is None:
+            time_ns = time.monotonic_ns()
+        with self.lock:
+            # Records of up to 64 KB, longer writes are split
+            for offset in range(0, len(data), 0xffff):
+                chunk = data[offset:offset + 0xffff]
+                self.file.write(RECORD.pack(time_ns - self.start_ns, len(chunk)))
+                self.file.write(chunk)
+                self.records += 1
+        return
+
+    def close(self):
+        """Flush and close the file"""
+        with self.lock:
+            self.file.close()
+        return
+
+class CaptureTee:
+    """Serial port wrapper recording every write to a SerialCapture"""
+    def __init__(self, port, capture):
+        self.port = port
+        self.capture = capture
+
+    def write(self, data):
+        """Write then record what the port took"""
+        time_ns = time.monotonic_ns()
+        written = self.port.write(data)
+        if written is None:
+            written = len(data)
+        if written:
+            self.capture.record(bytes(data[:written]), time_ns)
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+class Capture:
+    """Read a capture file"""
+    def __init__(self, path):
+        with open(path, 'rb') as capture_file:
+            self.data = capture_file.read()
+        if len(self.data) < HEADER.size:
+            raise ValueError('%s is not a serial capture file' % path)
+        magic, self.baud, source = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a serial capture file' % path)
+        self.source = source.rstrip(b'\0').decode()
+
+    def records(self):
+        """Yield (time ns, bytes), a record cut short by a crash is left out"""
+        data = self.data
+        offset = HEADER.size
+        while offset + RECORD.size <= len(data):
+            time_ns, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            if offset + length > len(data):
+                break
+            yield time_ns, data[offset:offset + length]
+            offset += length
+
+def state_name(state):
+    """Pressed buttons and dpad direction of a GadgetState as text"""
+    if state.console == 'ps4':
+        from ds4gpadserial import DS4Button as buttons, DS4DPad as dpads
+    else:
+        from nsgpadserial import NSButton as buttons, NSDPad as dpads
+    names = []
+    for button in buttons:
+        if state.buttons & (1 << button):
+            names.append(button.name)
+    unknown = state.buttons & ~sum(1 << button for button in buttons)
+    if unknown:
+        names.append('0x%x' % unknown)
+    if state.dpad != dpads.CENTERED:
+        try:
+            names.append('DPAD_' + dpads(state.dpad).name)
+        except ValueError:
+            names.append('DPAD_%d' % state.dpad)
+    return '+'.join(names) or 'idle'
+
+def analyze(capture, baud=None, top=10):
+    """Return the analysis of a Capture as text"""
+    # pylint: disable=too-many-locals,too-many-statements
+    from gadgetemu import FrameParser
+    from latency import LatencyHistogram
+    baud = baud or capture.baud
+    parser = FrameParser()
+    # 10 us buckets up to 1 s
+    intervals = LatencyHistogram(bucket_ns=10000, buckets=100000)
+    interval_counts = [0] * (len(INTERVAL_EDGES) + 1)
+    # (console, buttons, dpad) to ns spent in it
+    state_ns = {}
+    state_names = {}
+    total_bytes = 0
+    first_ns = last_ns = None
+    # Bytes per WINDOW_NS window for the busiest complete one
+    window_start = 0
+    window_bytes = 0
+    peak_bytes = None
+    last_state = None
+    last_key = None
+    for time_ns, data in capture.records():
+        if first_ns is None:
+            first_ns = window_start = time_ns
+        last_ns = time_ns
+        total_bytes += len(data)
+        while time_ns >= window_start + WINDOW_NS:
+            peak_bytes = max(peak_bytes or 0, window_bytes)
+            window_start += WINDOW_NS
+            window_bytes = 0
+        window_bytes += len(data)
+        for state in parser.feed(data, time_ns):
+            if last_state is not None:
+                interval = state.time_ns - last_state.time_ns
+                intervals.add(interval)
+                bucket = 0
+                while bucket < len(INTERVAL_EDGES) and interval > INTERVAL_EDGES[bucket] * 1e6:
+                    bucket += 1
+                interval_counts[bucket] += 1
+                state_ns[last_key] = state_ns.get(last_key, 0) + interval
+            last_key = (state.console, state.buttons, state.dpad)
+            if last_key not in state_names:
+                state_names[last_key] = state_name(state)
+            last_state = state
+    if first_ns is None:
+        return 'empty capture'
+    if last_state is not None:
+        # The last state holds until the capture ends
+        state_ns[last_key] = state_ns.get(last_key, 0) + last_ns - last_state.time_ns
+    seconds = max(last_ns - first_ns, 1) / 1e9
+    frames = parser.frames
+    lines = []
+    lines.append('%s capture, %.3f s, %d bytes, %d reports' %
+                 (capture.source, seconds, total_bytes, frames))
+    lines.append('%.1f reports/s, %.0f bytes/s' % (frames / seconds, total_bytes / seconds))
+    if baud:
+        # 8N1: 10 bits on the line per byte
+        line = 'link %d baud: %.2f%% used' % (baud, total_bytes * 10 * 100 / (baud * seconds))
+        if peak_bytes is not None:
+            line += ', busiest %d ms %.2f%%' % (WINDOW_NS // 1000000,
+                                                peak_bytes * 10 * 100 / (baud * WINDOW_NS / 1e9))
+        lines.append(line)
+    lines.append('redundant reports %d (%.1f%%), state changes %d' %
+                 (parser.redundant_frames, parser.redundant_frames * 100 / max(frames, 1),
+                  frames - parser.redundant_frames))
+    lines.append('malformed frames %d, skipped bytes %d' %
+                 (parser.bad_frames, parser.skipped_bytes))
+    if intervals.count:
+        lines.append('interval ms: mean %.3f p50 %.3f p90 %.3f p99 %.3f max %.3f' %
+                     (intervals.total_ns / intervals.count / 1e6,
+                      intervals.percentile(50) / 1e6, intervals.percentile(90) / 1e6,
+                      intervals.percentile(99) / 1e6, intervals.max_ns / 1e6))
+        low = 0
+        for edge, count in zip(INTERVAL_EDGES + (None,), interval_counts):
+            label = ('%g-%g ms' % (low, edge)) if edge is not None else ('> %g ms' % low)
+            lines.append('  %-14s %8d %6.1f%%' % (label, count, count * 100 / intervals.count))
+            low = edge
+    lines.append('%-40s %10s %6s' % ('state', 'time s', '%'))
+    total_ns = sum(state_ns.values()) or 1
+    ranked = sorted(state_ns.items(), key=lambda item: item[1], reverse=True)
+    for key, spent_ns in ranked[:top]:
+        lines.append('%-40s %10.3f %6.1f' % (state_names[key], spent_ns / 1e9,
+                                              spent_ns * 100 / total_ns))
+    if len(ranked) > top:
+        lines.append('%d more states' % (len(ranked) - top))
+    return '\n'.join(lines)
+
+def main():
+    """ Analyze the capture files named on the command line """
+    baud = None
+    top = 10
+    opts, args = getopt.getopt(sys.argv[1:], 'h', ['help', 'baud=', 'top='])
+    for o, a in opts:
+        if o in ('-h', '--help'):
+            print(__doc__.split('MIT License')[0].strip())
+            return
+        if o == '--baud':
+            # Link speed for the use figures, default the one in the file
+            baud = int(a)
+        elif o == '--top':
+            # Number of button states listed
+            top = int(a)
+    for path in args:
+        if len(args) > 1:
+            print(path)
+        print(analyze(Capture(path), baud, top))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+"""
+Gadget serial port connection manager for NSGamepadSerial and DS4GamepadSerial.
+
+SerialConnection stands in for the serial port. It opens the first
+candidate port or URL that works, and when a write fails it drops the port
+and a background thread keeps trying the candidates until one opens again.
+The new port is swapped in with one assignment and on_connect is called,
+usually to resend the full gamepad state. While there is no port, writes
+return at once and the report is counted as dropped, so input handling
+never waits for open() or a dead port.
+
+Writes use write_timeout. 0, for writes from the input handling thread,
+never waits: the port takes what fits in its output buffer and the rest of
+a report is written ahead of the next one. With the writer thread a small
+timeout keeps a port that stopped draining from blocking it for ever. A
+full buffer or a write timeout is backpressure, the report is counted as
+dropped and the port kept. Only a serial.SerialException or OSError from
+the port means it is lost.
+
+With capture set to a serialcapture.SerialCapture every byte the port
+takes is recorded, the end of a cut short report with the write that
+finished it, so the capture holds whole frames.
+
+A udev symlink such as /dev/serial/by-id/... or a symlink to a pty slave
+keeps the same candidate name across reconnects.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import threading
+import time
+import serial
+
+class SerialConnection:
+    """Serial port stand in that reconnects in a background thread"""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, candidates, baudrate=2000000, retry_interval=0.5,
+                 write_timeout=0.1):
+        """
+        candidates are device paths or pyserial URLs, tried in order.
+        write_timeout is in seconds, 0 to never wait.
+        """
+        self.candidates = list(candidates)
+        self.baudrate = baudrate
+        self.retry_interval = retry_interval
+        self.write_timeout = write_timeout
+        self.on_connect = None
+        # SerialCapture recording the bytes written, None for no capture
+        self.capture = None
+        # Guards port swaps and wakes the reconnect thread
+        self.changed = threading.Condition()
+        self.port = None
+        self.name = None
+        # File descriptor for non-blocking writes, None to use port.write
+        self.fd = None
+        # End of a report the port took only part of
+        self.tail = b''
+        # Lost ports for the thread to close
+        self.broken = []
+        self.running = False
+        self.thread = None
+        self.connects = 0
+        self.write_errors = 0
+        self.write_timeouts = 0
+        self.partial_writes = 0
+        self.reports_dropped = 0
+
+    def open(self, candidate):
+        """Open one candidate, raise serial.SerialException if it fails"""
+        # With write_timeout 0 a device is written with os.write. pyserial
+        # URL handlers such as loop:// time out every write with 0.
+        return serial.serial_for_url(candidate, self.baudrate, timeout=0,
+                                     write_timeout=self.write_timeout or None)
+
+    def connect(self):
+        """Try each candidate once. Return True if one is open."""
+        for candidate in self.candidates:
+            try:
+                port = self.open(candidate)
+            except (serial.SerialException, OSError, ValueError):
+                continue
+            fd = None
+            if self.write_timeout == 0:
+                try:
+                    fd = port.fileno()
+                except (AttributeError, OSError, serial.SerialException):
+                    pass
+            with self.changed:
+                self.port = port
+                self.fd = fd
+                self.tail = b''
+                self.name = candidate
+                self.connects += 1
+            return True
+        return False
+
+    def start(self, on_connect=None):
+        """
+        Start the reconnect thread. on_connect(name) is called from it after
+        each reconnect, with no locks held.
+        """
+        self.on_connect = on_connect
+        with self.changed:
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name='SerialConnection',
+                                       daemon=True)
+        self.thread.start()
+        return
+
+    def lost(self, port):
+        """Drop a port that failed, the thread closes it and reconnects"""
+        with self.changed:
+            if self.port is port:
+                self.port = None
+                self.fd = None
+                self.tail = b''
+                self.broken.append(port)
+                self.write_errors += 1
+                self.changed.notify()
+        return
+
+    def writeNow(self, port, fd, data):
+        """Write what the port takes without waiting, return the byte count"""
+        if fd is None:
+            written = port.write(data)
+            return len(data) if written is None else written
+        try:
+            return os.write(fd, data)
+        except BlockingIOError:
+            # pyserial retries this in a loop, the output buffer is full
+            return 0
+
+    def write(self, data):
+        """
+        Write to the current port. Return the bytes of data it took, 0 if
+        there is none, it failed or it is backed up.
+        """
+        port = self.port
+        fd = self.fd
+        if port is None:
+            self.reports_dropped += 1
+            return 0
+        capture = self.capture
+        time_ns = time.monotonic_ns() if capture is not None else 0
+        try:
+            if self.tail:
+                # Finish the report cut short first, the gadget needs
+                # whole frames
+                written = self.writeNow(port, fd, self.tail)
+                if written and capture is not None:
+                    capture.record(self.tail[:written], time_ns)
+                self.tail = self.tail[written:]
+                if self.tail:
+                    self.reports_dropped += 1
+                    return 0
+            written = self.writeNow(port, fd, data)
+            if written and capture is not None:
+                capture.record(bytes(data[:written]), time_ns)
+        except serial.SerialTimeoutException:
+            # Backed up, not gone
+            self.write_timeouts += 1
+            self.reports_dropped += 1
+            return 0
+        except (serial.SerialException, OSError):
+            self.lost(port)
+            self.reports_dropped += 1
+            return 0
+        if written < len(data):
+            if written == 0:
+                self.reports_dropped += 1
+            else:
+                self.tail = bytes(data[written:])
+                self.partial_writes += 1
+        return written
+
+    @property
+    def out_waiting(self):
+        """
+        Bytes in the current port output buffer and of a report it took only
+        part of, 0 if there is no port
+        """
+        port = self.port
+        if port is None:
+            return 0
+        try:
+            return port.out_waiting + len(self.tail)
+        except (serial.SerialException, OSError):
+            self.lost(port)
+            return 0
+
+    @property
+    def connected(self):
+        """True if a port is open"""
+        return self.port is not None
+
+    def stats(self):
+        """Return the connection counters as a dict"""
+        with self.changed:
+            return {'port': self.name if self.port is not None else None,
+                    'connects': self.connects,
+                    'write_errors': self.write_errors,
+                    'write_timeouts': self.write_timeouts,
+                    'partial_writes': self.partial_writes,
+                    'dropped': self.reports_dropped}
+
+    def close(self):
+        """Stop the reconnect thread and close the port"""
+        with self.changed:
+            self.running = False
+            self.changed.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.changed:
+            ports = self.broken
+            self.broken = []
+            if self.port is not None:
+                ports.append(self.port)
+                self.port = None
+        for port in ports:
+            close_quietly(port)
+        return
+
+    def run(self):
+        """Reconnect thread main loop"""
+        while True:
+            with self.changed:
+                while self.running and self.port is not None and not self.broken:
+                    self.changed.wait()
+                if not self.running:
+                    return
+                broken = self.broken
+                self.broken = []
+            for port in broken:
+                close_quietly(port)
+            if self.port is not None:
+                continue
+            if self.connect():
+                if self.on_connect is not None:
+                    self.on_connect(self.name)
+            else:
+                with self.changed:
+                    if self.running:
+                        self.changed.wait(self.retry_interval)
+
+def close_quietly(port):
+    """Close a port that may already be gone"""
+    try:
+        port.close()
+    except (serial.SerialException, OSError):
+        pass
+    return
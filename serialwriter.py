@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+"""
+Background writer thread for NSGamepadSerial and DS4GamepadSerial.
+
+The gamepad setters only change the in-memory state and post to the writer.
+The writer thread encodes the newest state and sends it so a slow or
+stalled serial port never blocks the caller. States posted while the thread
+is busy writing are superseded by the newest one and never sent. With a
+queuemonitor.QueueMonitor the thread also waits while the port output queue
+is over its limit.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import threading
+import time
+
+class SerialWriter:
+    """Send the newest gamepad state from a background thread"""
+    def __init__(self, gamepad):
+        self.gamepad = gamepad
+        # Shares the gamepad lock so state changes and posts are atomic
+        self.report_ready = threading.Condition(gamepad.thread_lock)
+        self.pending = 0
+        # Latency marks of the touches in the pending state
+        self.marks = []
+        self.running = False
+        self.thread = None
+        self.reports_posted = 0
+        self.reports_written = 0
+        self.reports_superseded = 0
+
+    def start(self):
+        """Start the writer thread"""
+        with self.report_ready:
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name='SerialWriter',
+                                       daemon=True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        """Send the last pending state then stop the writer thread"""
+        with self.report_ready:
+            self.running = False
+            self.report_ready.notify()
+        self.thread.join()
+        return
+
+    def post(self, marks=None):
+        """Signal a state change. Caller must hold gamepad.thread_lock."""
+        if marks:
+            self.marks.extend(marks)
+        self.pending += 1
+        self.reports_posted += 1
+        self.report_ready.notify()
+        return
+
+    def stats(self):
+        """Return the writer counters as a dict"""
+        with self.report_ready:
+            return {'posted': self.reports_posted,
+                    'written': self.reports_written,
+                    'superseded': self.reports_superseded,
+                    'pending': self.pending}
+
+    def run(self):
+        """Writer thread main loop"""
+        monitor = None
+        while True:
+            with self.report_ready:
+                while self.running and not self.pending and not self.gamepad.taps and \
+                        not (monitor and monitor.held):
+                    due = self.gamepad.keepaliveDue()
+                    if due is None:
+                        self.report_ready.wait()
+                    elif due > 0:
+                        self.report_ready.wait(due)
+                    else:
+                        # Keepalive, send the unchanged state again
+                        self.pending += 1
+                monitor = self.gamepad.queue_monitor
+                if not self.pending and not self.gamepad.taps and not (monitor and monitor.held):
+                    return
+                taps = self.gamepad.taps
+                if monitor is not None and self.running and \
+                        monitor.hold(self.gamepad.ser_port, self.pending, self.marks):
+                    self.pending = 0
+                    self.marks = []
+                    # The states queued by sendChanges() are held back too
+                    while taps:
+                        monitor.hold(self.gamepad.ser_port, 1, taps.popleft()[1])
+                    if monitor.held:
+                        # Let the port drain, newer states are coalesced
+                        # into the held one
+                        self.report_ready.wait(monitor.retry_interval)
+                    continue
+                if taps:
+                    # A change undone before it was sent goes out first, the
+                    # pending state follows it
+                    report, marks = taps.popleft()
+                else:
+                    if self.pending:
+                        self.reports_superseded += self.pending - 1
+                    self.pending = 0
+                    marks = self.marks
+                    if marks:
+                        self.marks = []
+                    if monitor is not None:
+                        marks = monitor.release(marks)
+                    report = self.gamepad.encode()
+                    if report is None:
+                        continue
+            # The port write happens without the lock so setters never wait.
+            # Only this thread packs the report buffer while it is running.
+            self.gamepad.ser_port.write(report)
+            self.reports_written += 1
+            if monitor is not None:
+                with self.report_ready:
+                    monitor.written(len(report))
+            if marks:
+                self.gamepad.latency.record(marks, time.monotonic_ns())
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+"""
+Cell press state shared by the pdtouch.py input and render processes.
+
+A multiprocessing.shared_memory block holds a small header and the press
+count of every cell, indexed by cell id like TouchAreas.press_counts:
+
+    generation (I), quit (I), cells (I), pad (I), press counts (h) * cells
+
+The input process creates the block and uses press_counts as its
+TouchAreas.press_counts, so buttonOn and buttonOff write to the block
+directly. After each touch frame it bumps generation. The render process,
+started with multiprocessing, attaches to the block by name, polls
+generation at its own frame rate and redraws the cells whose pressed
+state changed. Either side sets quit to stop the other.
+
+Only the input process writes the press counts. A frame read half
+written is drawn again at the next poll since generation changes after
+the counts.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from multiprocessing import shared_memory
+
+# generation, quit, cells, pad
+HEADER_WORDS = 4
+HEADER_SIZE = HEADER_WORDS * 4
+GENERATION = 0
+QUIT = 1
+CELLS = 2
+
+class SharedCells:
+    """Per cell press counts in a shared memory block"""
+    def __init__(self, cells, name=None):
+        """
+        Create a block for cells press counts, cell id 0 included, or
+        attach to the block called name.
+        """
+        if name is None:
+            self.block = shared_memory.SharedMemory(create=True,
+                                                    size=HEADER_SIZE + cells * 2)
+            self.owner = True
+        else:
+            # Attaching registers the block with the resource tracker again.
+            # A process started by multiprocessing shares the creator's
+            # tracker, so the block stays until the creator unlinks it.
+            self.block = shared_memory.SharedMemory(name)
+            self.owner = False
+        self.header = self.block.buf[:HEADER_SIZE].cast('I')
+        if self.owner:
+            self.header[CELLS] = cells
+        elif self.header[CELLS] != cells:
+            cells_shared = self.header[CELLS]
+            self.header.release()
+            self.block.close()
+            raise ValueError('shared block has %d cells, expected %d' % (cells_shared, cells))
+        self.press_counts = self.block.buf[HEADER_SIZE:HEADER_SIZE + cells * 2].cast('h')
+
+    @property
+    def name(self):
+        """Name to attach to the block with"""
+        return self.block.name
+
+    @property
+    def generation(self):
+        """Bumped by publish()"""
+        return self.header[GENERATION]
+
+    def publish(self):
+        """The press counts changed"""
+        self.header[GENERATION] = (self.header[GENERATION] + 1) & 0xffffffff
+        return
+
+    def requestQuit(self):
+        """Ask both processes to stop"""
+        self.header[QUIT] = 1
+        return
+
+    def quitRequested(self):
+        """True once either process called requestQuit()"""
+        return self.header[QUIT] != 0
+
+    def close(self):
+        """
+        Detach from the block, removing it if this process created it. Any
+        press_counts reference kept elsewhere must be dropped first.
+        """
+        self.press_counts.release()
+        self.header.release()
+        self.block.close()
+        if self.owner:
+            self.block.unlink()
+        return
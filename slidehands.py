@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+"""
+Table driven hand segmentation for the 32 cell Project Diva slider.
+
+A hand starts at the first touched cell. It ends 4 cells past the fourth
+untouched cell after the start. Touched cells after the first untouched one
+do not restart the count so two fingers close together are one hand. This is
+the rule of the bit by bit state machine formerly in SlideBar.find_hands.
+
+The slider mask is processed a byte at a time. HAND_TABLE has an entry for
+every (state, byte) pair giving the next state and the hand start and end
+events inside the byte, so no per bit work is done at run time.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# States: 0 = no hand, 1 = in hand, 2..4 = 1..3 untouched cells seen
+NUM_STATES = 5
+# Events below END_EVENT are a hand start at bit (event) of the byte.
+# Events from END_EVENT up are a hand end at bit (event - END_EVENT).
+END_EVENT = 16
+
+def build_hand_table():
+    """Return the (state << 8 | byte) -> (next state, events) table"""
+    table = []
+    for state in range(NUM_STATES):
+        for byte in range(256):
+            events = []
+            next_state = state
+            for b in range(7, -1, -1):
+                touched = byte & (1 << b)
+                if next_state == 0:
+                    if touched:
+                        events.append(b)
+                        next_state = 1
+                elif not touched:
+                    if next_state == 4:
+                        events.append(END_EVENT + b + 4)
+                        next_state = 0
+                    else:
+                        next_state += 1
+            table.append((next_state, tuple(events)))
+    return tuple(table)
+
+HAND_TABLE = build_hand_table()
+
+def find_hands(slider_bits):
+    """
+    Return the hands on the slider as a list of (start, end) tuples, left
+    hand first. Bit 31 is the left most cell so start >= end.
+    """
+    hands = []
+    if not slider_bits:
+        return hands
+    state = 0
+    start = 0
+    for shift in (24, 16, 8, 0):
+        state, events = HAND_TABLE[(state << 8) | ((slider_bits >> shift) & 0xFF)]
+        for event in events:
+            if event < END_EVENT:
+                start = shift + event
+            else:
+                hands.append((start, shift + event - END_EVENT))
+    if state:
+        # Hand runs off the right end of the slider
+        hands.append((start, state - 1))
+    return hands
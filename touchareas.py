@@ -1,7 +1,49 @@
 import os
+import array
 import pygame
 
+class Cell:
+    """ Drawing state of one cell. Touch state is in the TouchAreas columns. """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('cell_id', 'rect', 'button_center', 'color', 'text', 'textpos',
+                 'picture', 'sprites')
+
+    def __init__(self, cell_id, rect, button_center, color):
+        self.cell_id = cell_id
+        self.rect = rect
+        self.button_center = button_center
+        self.color = color
+        self.text = None
+        self.textpos = None
+        self.picture = None
+        self.sprites = None
+
 class TouchAreas:
+    # When True drawCell only queues the cell in pending_cells and
+    # flushDisplay() draws all of them then puts them on the screen with one
+    # pygame.display.update. This keeps drawing off the touch to serial path.
+    defer_updates = False
+    # When False deferred drawCell calls are dropped, the screen keeps the
+    # layout drawn at startup
+    feedback = True
+    # Newest (touch area, color) per cell id waiting to be drawn
+    pending_cells = {}
+    # Screen rects drawn but not yet updated, shared by all touch areas
+    dirty_rects = []
+    # Color of a touched cell. Sprites are pre-rendered for this color and
+    # for each cell's idle color.
+    pressed_color = (0, 128, 128)
+    # Per cell columns indexed by cell id, shared by all touch areas. Cell
+    # ids are given out by draw() in drawing order starting at 1, id 0 means
+    # no cell. press_counts is the number of fingers on the cell, buttons
+    # the button code or -1, owners the index of the touch area in areas.
+    press_counts = array.array('h', [0])
+    buttons = array.array('h', [-1])
+    owners = array.array('B', [0])
+    areas = [None]
+    # Cell views for drawing, also indexed by cell id
+    views = [None]
+
     def __init__(self, topLeft, bottomRight, rows, columns, gridlines, bgcolor, font, properties, displaysurf):
         """ Constructor """
         self.topLeft = topLeft
@@ -11,6 +53,8 @@ class TouchAreas:
         self.gridLines = gridlines
         self.bgcolor = bgcolor
         self.cells = []
+        # Cell id of the top left cell, the others follow row by row
+        self.first = 0
         self.cell_height = (bottomRight[1] - topLeft[1]) / rows
         self.cell_width = (bottomRight[0] - topLeft[0]) / columns
         self.font = font
@@ -19,89 +63,282 @@ class TouchAreas:
         (self.screen_width, self.screen_height) = displaysurf.get_size()
         self.screen_width_max = self.screen_width - 1     # Max pixel co-ord
         self.screen_height_max = self.screen_height -1    # Max pixel co-ord
+        self.name = type(self).__name__
+        self.owner = len(TouchAreas.areas)
+        TouchAreas.areas.append(self)
+
+    @staticmethod
+    def clearCells():
+        """ Forget all touch areas and cells, the next cell id is 1 again """
+        TouchAreas.press_counts = array.array('h', [0])
+        TouchAreas.buttons = array.array('h', [-1])
+        TouchAreas.owners = array.array('B', [0])
+        TouchAreas.areas = [None]
+        TouchAreas.views = [None]
+        TouchAreas.pending_cells = {}
+
+    def drawCell(self, cell_id, color=None):
+        """
+        Draw one cell in color, its idle color if None, or queue it if
+        updates are deferred
+        """
+        if TouchAreas.defer_updates:
+            if TouchAreas.feedback:
+                TouchAreas.pending_cells[cell_id] = (self, color)
+            return
+        cell = TouchAreas.views[cell_id]
+        self.paintCell(cell, color)
+        pygame.display.update(cell.rect)
 
-    def drawCell(self, gridcell, color):
-        """ Draw one cell """
-        rect = gridcell['rect']
+    def paintCell(self, cell, color=None):
+        """ Draw one cell on the display surface without updating the screen """
+        if color is None:
+            color = cell.color
+        rect = cell.rect
+        if cell.sprites:
+            sprite = cell.sprites.get(tuple(color))
+            if sprite:
+                self.displaysurf.blit(sprite, rect)
+                return
         pygame.draw.rect(self.displaysurf, color, rect, 0)
-        picture = gridcell.get('picture')
-        if picture:
-            self.displaysurf.blit(picture, rect)
-        text = gridcell.get('text')
-        textpos = gridcell.get('textpos')
-        if text and textpos:
-            self.displaysurf.blit(text, textpos)
-        pygame.display.update(rect)
-
-    def draw(self):
+        if cell.picture:
+            self.displaysurf.blit(cell.picture, rect)
+        if cell.text and cell.textpos:
+            self.displaysurf.blit(cell.text, cell.textpos)
+
+    @staticmethod
+    def flushDisplay(merge=False, lock=None):
+        """
+        Draw all queued cells and update the screen for them. If merge is
+        True overlapping rects are combined first. If cells are queued by
+        another thread, lock is the lock it holds while queueing.
+        """
+        if lock is not None:
+            with lock:
+                pending = TouchAreas.pending_cells
+                TouchAreas.pending_cells = {}
+        else:
+            pending = TouchAreas.pending_cells
+            TouchAreas.pending_cells = {}
+        if pending:
+            views = TouchAreas.views
+            for cell_id, (touch_area, color) in pending.items():
+                cell = views[cell_id]
+                touch_area.paintCell(cell, color)
+                TouchAreas.dirty_rects.append(cell.rect)
+        rects = TouchAreas.dirty_rects
+        if not rects:
+            return
+        if merge:
+            rects = mergeRects(rects)
+        pygame.display.update(rects)
+        TouchAreas.dirty_rects.clear()
+
+    def renderSprite(self, cell, color):
+        """ Return a surface of one cell drawn in color with its picture and label """
+        rect = cell.rect
+        sprite = pygame.Surface(rect.size)
+        sprite.fill(color)
+        if cell.picture:
+            sprite.blit(cell.picture, (0, 0))
+        if cell.text and cell.textpos:
+            sprite.blit(cell.text, cell.textpos.move(-rect.x, -rect.y))
+        if pygame.display.get_surface() is not None:
+            # Same pixel format as the display for the fastest blit
+            sprite = sprite.convert()
+        return sprite
+
+    def buildSprites(self):
+        """
+        Pre-render idle and pressed sprites for every cell so a press or
+        release is one blit. Call again if the layout or resolution changes.
+        """
+        for cell in self.cells:
+            sprites = {}
+            for color in (cell.color, self.pressed_color):
+                sprites[tuple(color)] = self.renderSprite(cell, color)
+            cell.sprites = sprites
+
+    def draw(self, sprites=None):
         """
         Draw all buttons. Usually called only once.
         Draw grid of size width x height. Each element of the grid is a cell of
         cell_width x cell_height. For example, given a screen size of 1920 x 1080 and a grid 32 cols and 1
         row, cell_width = 1920 / 32 and cell_height = 1080 / 1
+        If sprites, a {color: sprite} dict per cell from a cached layout, is
+        given nothing is rendered. The cells only get their geometry and sprites.
+        Gives the cells the next free cell ids. Cells whose properties have
+        a rect and center, as compiled layouts give, use those.
         """
+        self.first = len(TouchAreas.views)
         cell_index = 0
         for y in range(self.rows):
             for x in range(self.columns):
-                gridcell = {}
-                gridcell['myself'] = self
-                gridcell["buttonDown"] = 0
-                rect = pygame.Rect(self.topLeft[0] + x*self.cell_width,
-                        self.topLeft[1] + y*self.cell_height,
-                        self.cell_width, self.cell_height)
-                gridcell["rect"] = rect
-                cell_center = (self.topLeft[0] + int(x * self.cell_width + self.cell_width/2),
-                    self.topLeft[1] + int(y * self.cell_height + self.cell_height/2))
-                gridcell["button_center"] = cell_center
-                if self.cell_properties:
-                    props= self.cell_properties[cell_index]
-                    if props.get('label') != None:
-                        text = self.font.render(props['label'], 1, (10, 10, 10))
-                        textpos = text.get_rect(center=cell_center)
-                        gridcell['text'] = text
-                        gridcell['textpos'] = textpos
-                        self.displaysurf.blit(text, textpos)
-                    if props.get('picture') != None:
-                        gridcell['picture'] = pygame.image.load(os.path.join('assets', props['picture']))
-                    gridcell['color'] = props.get('buttonColor', self.bgcolor)
-                    self.drawCell(gridcell, gridcell['color'])
-                    if props.get('button') != None:
-                        gridcell['button'] = props['button']
-                gridcell['index'] = cell_index
-                self.cells.append(gridcell)
+                props = self.cell_properties[cell_index] if self.cell_properties else {}
+                if 'rect' in props:
+                    rect = pygame.Rect(props['rect'])
+                    cell_center = props['center']
+                else:
+                    rect = pygame.Rect(self.topLeft[0] + x*self.cell_width,
+                            self.topLeft[1] + y*self.cell_height,
+                            self.cell_width, self.cell_height)
+                    cell_center = (self.topLeft[0] + int(x * self.cell_width + self.cell_width/2),
+                        self.topLeft[1] + int(y * self.cell_height + self.cell_height/2))
+                cell = Cell(self.first + cell_index, rect, cell_center,
+                            tuple(props.get('buttonColor', self.bgcolor)))
+                if props.get('label') != None and sprites is None:
+                    cell.text = self.font.render(props['label'], 1, (10, 10, 10))
+                    cell.textpos = cell.text.get_rect(center=cell_center)
+                    self.displaysurf.blit(cell.text, cell.textpos)
+                if props.get('picture') != None and sprites is None:
+                    cell.picture = pygame.image.load(os.path.join('assets', props['picture']))
+                TouchAreas.press_counts.append(0)
+                TouchAreas.buttons.append(props.get('button', -1))
+                TouchAreas.owners.append(self.owner)
+                TouchAreas.views.append(cell)
+                self.cells.append(cell)
+                if self.cell_properties and sprites is None:
+                    self.drawCell(cell.cell_id)
                 cell_index = cell_index + 1
-            if self.gridLines:
+            if self.gridLines and sprites is None:
                 # Draw horizontal grid lines
                 pygame.draw.line(self.displaysurf, (0, 0, 0),
                         (0, y*self.cell_height), (self.screen_width_max, y*self.cell_height))
-        if self.gridLines:
+        if self.gridLines and sprites is None:
             # Draw vertical grid lines
             for x in range(self.columns):
                 pygame.draw.line(self.displaysurf, (0, 0, 0),
                         (x*self.cell_width, self.topLeft[1]), (x*self.cell_width, self.bottomRight[1]))
-    
-    def buttonOn(self, gridcell):
+        if sprites is None:
+            self.buildSprites()
+        else:
+            for cell, cell_sprites in zip(self.cells, sprites):
+                cell.sprites = cell_sprites
+
+    def buttonOn(self, cell_id):
         """ Button touched/pressed """
-        gridcell['buttonDown'] += 1
-        return (gridcell['buttonDown'] == 1)
+        press_counts = TouchAreas.press_counts
+        count = press_counts[cell_id] + 1
+        press_counts[cell_id] = count
+        return count == 1
 
-    def buttonOff(self, gridcell):
+    def buttonOff(self, cell_id):
         """ Button released """
-        gridcell['buttonDown'] -= 1
-        if gridcell['buttonDown'] < 0:
-            gridcell['buttonDown'] = 0
-        return (gridcell['buttonDown'] == 0)
+        press_counts = TouchAreas.press_counts
+        count = press_counts[cell_id] - 1
+        if count < 0:
+            count = 0
+        press_counts[cell_id] = count
+        return count == 0
 
     def touchToCell(self, x, y):
-        """ Convert touch co-ordinates to cell array offset """
+        """ Convert touch co-ordinates to cell id, 0 if outside the area """
         x = int(x)
         y = int(y)
         if (x >= self.topLeft[0]) and (x <= self.bottomRight[0]) and (y >= self.topLeft[1]) and (y <= self.bottomRight[1]):
-            x = int(x / self.cell_width)
+            x = int((x - self.topLeft[0]) / self.cell_width)
             if x >= self.columns:
                 x = self.columns-1
-            y = int(y / self.cell_height)
+            y = int((y - self.topLeft[1]) / self.cell_height)
             if y >= self.rows:
                 y = self.rows - 1
-            return self.cells[y*(self.rows-1) + x]
-        return -1
+            return self.first + y*self.columns + x
+        return 0
+
+def mergeRects(rects):
+    """ Return a list of rects with overlapping rects combined """
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        overlap = rect.collidelist(merged)
+        while overlap != -1:
+            rect.union_ip(merged.pop(overlap))
+            overlap = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+class HitMap:
+    """
+    Screen wide hit-test table. Maps touch co-ordinates to a cell id with one
+    array lookup instead of calling touchToCell on every touch area.
+    The table is sampled every (1 << shift) pixels in x and y.
+    """
+    def __init__(self, width, height, shift=0):
+        """ Constructor """
+        self.shift = shift
+        self.width = ((width - 1) >> shift) + 1
+        self.height = ((height - 1) >> shift) + 1
+        # Cell id 0 means no cell
+        self.table = array.array('H', [0]) * (self.width * self.height)
+        # Cell ids in the order added
+        self.cell_ids = []
+        # (topLeft, bottomRight, rows, columns, cell ids, mask) per area
+        self.grids = []
+
+    def add(self, touch_area, mask=None):
+        """
+        Add all cells of a touch area. Call after touch_area.draw() and call
+        build() or load() after adding all areas. Areas added first win where
+        areas overlap. If mask is given, only points
+        where mask.get_at((x, y)) is true belong to the area, for example a
+        pygame.mask.Mask for a non rectangular area.
+        """
+        cell_ids = [cell.cell_id for cell in touch_area.cells]
+        self.addGrid(touch_area.topLeft, touch_area.bottomRight,
+                     touch_area.rows, touch_area.columns, cell_ids, mask)
+
+    def addGrid(self, topLeft, bottomRight, rows, columns, cell_ids, mask=None):
+        """ Add a rows x columns grid of cell ids without a touch area """
+        self.cell_ids.extend(cell_ids)
+        self.grids.append((topLeft, bottomRight, rows, columns, cell_ids, mask))
+
+    def load(self, table):
+        """
+        Use a table made by build() for the same areas instead of building it.
+        Tables are built with cell ids 1, 2, 3... in the order added.
+        """
+        if len(table) != len(self.table):
+            raise ValueError('hit-test table size %d, expected %d' % (len(table), len(self.table)))
+        if self.cell_ids != list(range(1, len(self.cell_ids) + 1)):
+            raise ValueError('cell ids are not 1..%d in the order added' % len(self.cell_ids))
+        self.table = table
+
+    def build(self):
+        """ Fill the table from all added areas """
+        table = self.table
+        table[:] = array.array('H', [0]) * len(table)
+        # Later areas first so earlier areas overwrite them
+        for (topLeft, bottomRight, rows, columns, cell_ids, mask) in reversed(self.grids):
+            left, top = topLeft
+            right, bottom = bottomRight
+            cell_width = (right - left) / columns
+            cell_height = (bottom - top) / rows
+            # Column runs: (first sample x, end sample x, column)
+            runs = []
+            for sx in range(self.width):
+                x = sx << self.shift
+                if x < left or x > right:
+                    continue
+                column = min(int((x - left) / cell_width), columns - 1)
+                if runs and runs[-1][2] == column and runs[-1][1] == sx:
+                    runs[-1][1] = sx + 1
+                else:
+                    runs.append([sx, sx + 1, column])
+            for sy in range(self.height):
+                y = sy << self.shift
+                if y < top or y > bottom:
+                    continue
+                row = min(int((y - top) / cell_height), rows - 1)
+                offset = sy * self.width
+                for start, end, column in runs:
+                    cell_id = cell_ids[row*columns + column]
+                    if mask is None:
+                        table[offset+start:offset+end] = array.array('H', [cell_id]) * (end - start)
+                    else:
+                        for sx in range(start, end):
+                            if mask.get_at((sx << self.shift, y)):
+                                table[offset+sx] = cell_id
+
+    def lookup(self, x, y):
+        """ Convert on screen touch co-ordinates to cell id, 0 if no cell """
+        return self.table[(int(y) >> self.shift) * self.width + (int(x) >> self.shift)]
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+"""
+Touch session recording and replay for pdtouch.py.
+
+A session file is a header followed by fixed size 32 byte records:
+
+    touch   time ns (q), type (B), pad, finger id (q), x (f), y (f)
+    report  time ns (q), REPORT (B), length (B), pad, report bytes (16s)
+    burst   time ns (q), BURST (B), pad
+
+x and y are 0..1 like SDL FINGER events. A burst record marks the end of
+one pygame.event.get() burst so a replay sends reports at the same points.
+The file is written and read through mmap so long sessions do not need
+Python objects per record.
+
+MIT License
+
+Copyright (c) 2020 touchgadgetdev@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import mmap
+import threading
+import time
+from struct import Struct
+
+MAGIC = b'PDTREC01'
+# magic, console, slider mode, record size
+HEADER = Struct('<8s8s12sI')
+TOUCH = Struct('<qB7xqff')
+REPORT = Struct('<qBB6x16s')
+RECORD_SIZE = TOUCH.size
+TIME = Struct('<q')
+
+# Record types
+FINGERDOWN = 0
+FINGERUP = 1
+FINGERMOTION = 2
+REPORT_TYPE = 3
+BURST = 4
+
+GROW_BYTES = 1 << 20
+
+class SessionRecorder:
+    """Write touches and serial reports to a session file"""
+    def __init__(self, path, console, slider):
+        self.lock = threading.Lock()
+        self.file = open(path, 'w+b')
+        self.size = GROW_BYTES
+        self.file.truncate(self.size)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        HEADER.pack_into(self.map, 0, MAGIC, console.encode(), slider.encode(),
+                         RECORD_SIZE)
+        self.offset = HEADER.size
+        self.start_ns = time.monotonic_ns()
+
+    def reserve(self):
+        """Return the offset for the next record, growing the file if full"""
+        offset = self.offset
+        if offset + RECORD_SIZE > self.size:
+            self.map.close()
+            self.size += GROW_BYTES
+            self.file.truncate(self.size)
+            self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.offset = offset + RECORD_SIZE
+        return offset
+
+    def touch(self, touch_type, finger_id, x, y, t_ns):
+        """Record one FINGERDOWN, FINGERUP or FINGERMOTION"""
+        with self.lock:
+            TOUCH.pack_into(self.map, self.reserve(), t_ns - self.start_ns,
+                            touch_type, finger_id, x, y)
+        return
+
+    def report(self, data):
+        """Record one serial report"""
+        with self.lock:
+            REPORT.pack_into(self.map, self.reserve(),
+                             time.monotonic_ns() - self.start_ns,
+                             REPORT_TYPE, len(data), bytes(data))
+        return
+
+    def burst(self):
+        """Record the end of one burst of events"""
+        with self.lock:
+            offset = self.reserve()
+            TOUCH.pack_into(self.map, offset, time.monotonic_ns() - self.start_ns,
+                            BURST, 0, 0.0, 0.0)
+        return
+
+    def close(self):
+        """Flush and cut the file to the records written"""
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            self.file.truncate(self.offset)
+            self.file.close()
+        return
+
+class RecordingPort:
+    """Serial port wrapper recording every report written"""
+    def __init__(self, port, recorder):
+        self.port = port
+        self.recorder = recorder
+
+    def write(self, data):
+        """Record then write"""
+        self.recorder.report(data)
+        return self.port.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+class CapturePort:
+    """Stand in serial port keeping the reports written, for replay"""
+    def __init__(self):
+        self.reports = []
+        self.out_waiting = 0
+
+    def write(self, data):
+        """Keep a copy of the report"""
+        self.reports.append(bytes(data))
+        return len(data)
+
+    def close(self):
+        """Nothing to close"""
+        return
+
+class Session:
+    """Read a session file"""
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, console, slider, record_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            raise ValueError('%s is not a touch session file' % path)
+        self.console = console.rstrip(b'\0').decode()
+        self.slider = slider.rstrip(b'\0').decode()
+        self.count = (len(self.map) - HEADER.size) // RECORD_SIZE
+
+    def records(self):
+        """
+        Yield (type, time ns, finger id, x, y) for touches,
+        (REPORT_TYPE, time ns, report bytes) for reports and
+        (BURST, time ns) for burst ends.
+        """
+        for offset in range(HEADER.size, HEADER.size + self.count * RECORD_SIZE,
+                            RECORD_SIZE):
+            record_type = self.map[offset + 8]
+            if record_type == REPORT_TYPE:
+                t_ns, _, length, data = REPORT.unpack_from(self.map, offset)
+                yield (REPORT_TYPE, t_ns, data[:length])
+            elif record_type == BURST:
+                yield (BURST, TIME.unpack_from(self.map, offset)[0])
+            else:
+                t_ns, _, finger_id, x, y = TOUCH.unpack_from(self.map, offset)
+                yield (record_type, t_ns, finger_id, x, y)
+
+    def reports(self):
+        """Return the list of recorded reports"""
+        return [record[2] for record in self.records() if record[0] == REPORT_TYPE]
+
+    def close(self):
+        """Close the file"""
+        self.map.close()
+        self.file.close()
+        return
+
+def diff_reports(recorded, produced):
+    """Return a list of lines describing differences between report lists"""
+    lines = []
+    for index in range(max(len(recorded), len(produced))):
+        old = recorded[index] if index < len(recorded) else None
+        new = produced[index] if index < len(produced) else None
+        if old != new:
+            lines.append('report %d: recorded %s replayed %s' %
+                         (index, old.hex() if old else '-', new.hex() if new else '-'))
+    return lines